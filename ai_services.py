@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
+import json
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from tag_cache import tag_cache
+
 class AIService:
     def __init__(self):
         load_dotenv()
@@ -11,12 +14,17 @@ class AIService:
             raise ValueError("No se encontró la OPENAI_API_KEY en el archivo .env")
         self.client = OpenAI(api_key=api_key)
 
-    def generate_tags_for_text(self, text_content):
+    def generate_tags_for_text(self, text_content, check_cache=True):
         """
         Analiza un texto y devuelve una lista de etiquetas relevantes.
+        Consulta antes la caché por hash del contenido; solo llama a OpenAI si no está.
+        `check_cache=False` se usa cuando quien llama ya la consultó (no se cuenta otro fallo).
         """
         if not text_content:
             return []
+        cached = tag_cache.get(text_content) if check_cache else None
+        if cached is not None:
+            return cached
         try:
             prompt = f"""
             Eres un experto en marketing digital. Analiza el siguiente texto de una publicación y extrae de 3 a 5 palabras clave o etiquetas relevantes para categorizarlo.
@@ -36,12 +44,59 @@ class AIService:
             raw_tags = completion.choices[0].message.content
             # Limpiar la respuesta para asegurar el formato
             tags = [tag.strip() for tag in raw_tags.split(',') if tag.strip()]
+            tag_cache.put(text_content, tags)
             return tags
             
         except Exception as e:
             print(f"Error al generar etiquetas con IA: {e}")
             return []
     
+    def generate_tags_for_texts(self, texts):
+        """
+        Etiqueta varios textos con una sola llamada a la API.
+        Devuelve una lista de listas de etiquetas en el mismo orden que `texts`. Si la respuesta no
+        se pudo interpretar, los textos que no estaban en la caché quedan a None: ya se consultaron,
+        así que quien llama puede recurrir a generate_tags_for_text(texto, check_cache=False).
+        """
+        if not texts:
+            return []
+        results = [tag_cache.get(text) for text in texts]
+        missing = [text for text, tags in zip(texts, results) if tags is None]
+        if not missing:
+            return results
+        try:
+            numbered = "\n\n".join(f"[{i}] '{text}'" for i, text in enumerate(missing, 1))
+            prompt = f"""
+            Eres un experto en marketing digital. Para cada uno de los siguientes textos de publicaciones, extrae de 3 a 5 palabras clave o etiquetas relevantes para categorizarlo.
+            Responde únicamente con un objeto JSON de la forma {{"tags": [["etiqueta", ...], ...]}}, con una lista de etiquetas en minúsculas por cada texto y en el mismo orden.
+            
+            TEXTOS A ANALIZAR:
+            {numbered}
+            """
+            
+            completion = self.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                response_format={"type": "json_object"},
+            )
+            
+            result = json.loads(completion.choices[0].message.content).get("tags")
+            if not isinstance(result, list) or len(result) != len(missing):
+                print(f"Error al generar etiquetas en lote con IA: se esperaban {len(missing)} listas.")
+                return results
+            generated = iter(result)
+            for i, text in enumerate(texts):
+                if results[i] is None:
+                    tags = next(generated)
+                    results[i] = [str(tag).strip() for tag in tags if str(tag).strip()] if isinstance(tags, list) else []
+                    tag_cache.put(text, results[i])
+            return results
+            
+        except Exception as e:
+            print(f"Error al generar etiquetas en lote con IA: {e}")
+            return results
+    
     def generate_text_variations(self, topic, count=5):
         """
         Genera variaciones de texto sobre un tema específico.
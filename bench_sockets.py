@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga del servidor de SocketIO: abre muchos WebSockets inactivos (como paneles abiertos),
+los mantiene un tiempo y mide cuántos aguantan y cuánto tarda mientras tanto una petición HTTP.
+
+    python bench_sockets.py --url http://localhost:5001 --sockets 5000 --hold 60 --server-pid <pid>
+
+Sirve para comparar `python main.py` (SERVER_MODE=threading) con `python server.py` (eventlet o
+gevent). No tiene dependencias: habla Engine.IO v4 sobre WebSocket directamente con asyncio.
+Con --server-pid se muestrea de /proc el número de hilos y la memoria del servidor.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import asyncio
+import argparse
+import resource
+import statistics
+from collections import Counter
+from urllib.parse import urlsplit
+
+SOCKET_PATH = "/socket.io/?EIO=4&transport=websocket"
+PROBE_PATH = "/socket.io/?EIO=4&transport=polling"
+
+
+# --- WebSocket mínimo (RFC 6455, lado cliente) ---
+
+def ws_frame(text, opcode=0x1):
+    payload = text.encode('utf-8') if isinstance(text, str) else text
+    mask = os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+    return header + mask + bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+async def ws_read(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+async def ws_connect(host, port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((
+        f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+    ).encode())
+    await writer.drain()
+    response = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    status_line = response.split(b"\r\n", 1)[0].decode(errors='replace')
+    if " 101 " not in status_line:
+        writer.close()
+        raise ConnectionError(status_line)
+    return reader, writer
+
+
+# --- Clientes ---
+
+class Results:
+    def __init__(self):
+        self.connect_seconds = []
+        self.errors = Counter()
+        self.open = 0
+        self.peak_open = 0
+        self.dropped = 0
+        self.probe_seconds = []
+        self.probe_errors = 0
+        self.server_samples = []
+
+
+async def idle_socket(args, results, stop, slots):
+    """Un panel inactivo: conecta, entra en el namespace, responde a los pings y no hace nada más."""
+    host, port = args.host, args.port
+    started = time.perf_counter()
+    async with slots:
+        try:
+            reader, writer = await ws_connect(host, port, SOCKET_PATH, args.timeout)
+            opcode, payload = await asyncio.wait_for(ws_read(reader), args.timeout)
+            if not payload.startswith(b'0'):
+                raise ConnectionError("sin paquete OPEN de Engine.IO")
+            writer.write(ws_frame('40'))
+            await writer.drain()
+            while True:
+                opcode, payload = await asyncio.wait_for(ws_read(reader), args.timeout)
+                if payload.startswith(b'40'):
+                    break
+                if payload.startswith(b'44'):
+                    raise ConnectionError("namespace rechazado")
+        except Exception as e:
+            results.errors[type(e).__name__ if not str(e) else f"{type(e).__name__}: {str(e)[:60]}"] += 1
+            return
+    results.connect_seconds.append(time.perf_counter() - started)
+    results.open += 1
+    results.peak_open = max(results.peak_open, results.open)
+
+    async def keepalive():
+        while True:
+            opcode, payload = await ws_read(reader)
+            if opcode == 0x8:
+                raise ConnectionError("cerrado por el servidor")
+            if opcode == 0x9:
+                writer.write(ws_frame(payload, opcode=0xA))
+            elif payload == b'2':
+                writer.write(ws_frame('3'))
+            await writer.drain()
+
+    task = asyncio.ensure_future(keepalive())
+    stopper = asyncio.ensure_future(stop.wait())
+    await asyncio.wait({task, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    if task.done():
+        results.dropped += 1
+    else:
+        task.cancel()
+    stopper.cancel()
+    results.open -= 1
+    writer.close()
+
+
+async def probe(args, results, stop):
+    """Mide, una vez por segundo, una petición HTTP corta mientras los sockets están abiertos."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(args.host, args.port), args.timeout)
+            writer.write(f"GET {PROBE_PATH} HTTP/1.1\r\nHost: {args.host}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status = await asyncio.wait_for(reader.readline(), args.timeout)
+            writer.close()
+            if b" 200 " not in status:
+                raise ConnectionError(status)
+            results.probe_seconds.append(time.perf_counter() - started)
+        except Exception:
+            results.probe_errors += 1
+        if args.server_pid:
+            results.server_samples.append(server_stats(args.server_pid))
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+
+def server_stats(pid):
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                key, _, value = line.partition(':')
+                if key in ('Threads', 'VmRSS'):
+                    stats[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return stats
+
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            print(f"⚠️ Límite de descriptores: {target}; no se podrán abrir {needed} sockets.")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summary(args, results, elapsed):
+    connect_ms = [seconds * 1000 for seconds in results.connect_seconds]
+    probe_ms = [seconds * 1000 for seconds in results.probe_seconds]
+    samples = [sample for sample in results.server_samples if sample]
+    return {
+        "sockets_requested": args.sockets,
+        "sockets_connected": len(connect_ms),
+        "sockets_peak_open": results.peak_open,
+        "sockets_dropped_while_idle": results.dropped,
+        "connect_errors": dict(results.errors),
+        "connect_ms": {"p50": percentile(connect_ms, 0.5), "p95": percentile(connect_ms, 0.95), "max": max(connect_ms, default=None)},
+        "probe_ms": {"p50": percentile(probe_ms, 0.5), "p95": percentile(probe_ms, 0.95), "max": max(probe_ms, default=None),
+                     "mean": round(statistics.mean(probe_ms), 2) if probe_ms else None},
+        "probe_errors": results.probe_errors,
+        "server_threads_max": max((sample.get('Threads', 0) for sample in samples), default=None),
+        "server_rss_mb_max": round(max((sample.get('VmRSS', 0) for sample in samples), default=0) / 1024, 1) if samples else None,
+        "elapsed_seconds": round(elapsed, 1),
+    }
+
+
+async def run(args):
+    results = Results()
+    stop = asyncio.Event()
+    slots = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    prober = asyncio.ensure_future(probe(args, results, stop))
+    clients = [asyncio.ensure_future(idle_socket(args, results, stop, slots)) for _ in range(args.sockets)]
+
+    # Fase de conexión: hasta que todos han conectado o fallado.
+    while len(results.connect_seconds) + sum(results.errors.values()) < args.sockets:
+        await asyncio.sleep(0.5)
+    print(f"🔌 {len(results.connect_seconds)} sockets abiertos en {time.perf_counter() - started:.1f}s; manteniéndolos {args.hold}s...")
+    await asyncio.sleep(args.hold)
+    stop.set()
+    await asyncio.gather(prober, *clients, return_exceptions=True)
+    return summary(args, results, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de WebSockets inactivos contra el servidor SocketIO.")
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--sockets", type=int, default=2000, help="Sockets inactivos a abrir.")
+    parser.add_argument("--concurrency", type=int, default=200, help="Conexiones abriéndose a la vez.")
+    parser.add_argument("--hold", type=float, default=30, help="Segundos que se mantienen abiertos.")
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--server-pid", type=int, help="PID del servidor para muestrear hilos y memoria.")
+    parser.add_argument("--json", action="store_true", help="Imprime solo el resultado en JSON.")
+    args = parser.parse_args()
+    url = urlsplit(args.url)
+    args.host, args.port = url.hostname, url.port or 80
+
+    raise_fd_limit(args.sockets + 64)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    ok = result["sockets_connected"] == args.sockets and not result["sockets_dropped_while_idle"]
+    print("✅ Todos los sockets se mantuvieron abiertos." if ok else "❌ Hubo sockets que no conectaron o se cayeron.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
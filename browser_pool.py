@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
+from webdriver_manager.chrome import ChromeDriverManager
+
+from system_resources import process_tree_rss_mb
+
+
+class PooledBrowser:
+    """Un Chrome/WebDriver vivo ligado a un directorio de perfil concreto."""
+    def __init__(self, profile_path, headless, driver):
+        self.profile_path = profile_path
+        self.headless = headless
+        self.driver = driver
+        self.jobs = 0
+        self.idle_since = None
+        self.reused = False
+
+    def memory_mb(self):
+        process = getattr(self.driver.service, 'process', None)
+        return process_tree_rss_mb(process.pid) if process else None
+
+
+class BrowserPool:
+    """
+    Mantiene navegadores ya arrancados para sacar el inicio de Chrome del camino crítico de cada trabajo.
+    - La ruta de chromedriver se resuelve una sola vez (ChromeDriverManager consulta la red).
+    - Chrome no permite abrir dos veces el mismo user-data-dir, así que hay como mucho una
+      instancia por perfil (`profiles/client_<id>`), que se reutiliza entre trabajos del mismo cliente.
+    - Las instancias se reciclan tras N trabajos o si superan un umbral de memoria, y las ociosas
+      se cierran tras un tiempo o cuando browser_scheduler necesita liberar RAM.
+    """
+    def __init__(self):
+        self.max_jobs_per_browser = int(os.getenv("BROWSER_MAX_JOBS", 20))
+        self.max_browser_memory_mb = int(os.getenv("BROWSER_RECYCLE_MEMORY_MB", 900))
+        self.idle_ttl_seconds = int(os.getenv("BROWSER_POOL_IDLE_SECONDS", 300))
+        self.max_idle = int(os.getenv("BROWSER_POOL_MAX_IDLE", 4))
+        self.driver_path = None
+        self.lock = threading.Lock()
+        self.idle = {}      # (profile_path, headless) -> PooledBrowser
+        self.warming = {}   # (profile_path, headless) -> threading.Event
+        self._janitor = None
+
+    def resolve_driver_path(self):
+        """Descarga/localiza chromedriver una sola vez por proceso (llamar al arrancar)."""
+        with self.lock:
+            if self.driver_path is None:
+                self.driver_path = ChromeDriverManager().install()
+            return self.driver_path
+
+    def checkout(self, profile_path, options, headless=True):
+        """
+        Entrega un navegador para el perfil: el que esté ocioso en el pool o uno nuevo.
+        Args:
+            options (ChromeOptions): Opciones a usar si hay que lanzar un Chrome nuevo.
+        """
+        key = (profile_path, headless)
+        while True:
+            with self.lock:
+                pooled = self.idle.pop(key, None)
+                warming = self.warming.get(key)
+            if pooled:
+                if self._is_alive(pooled):
+                    pooled.reused = True
+                    pooled.jobs += 1
+                    return pooled
+                self._quit(pooled)
+                continue
+            if warming:
+                # Un precalentamiento de este mismo perfil está en curso: se espera en lugar de duplicarlo.
+                warming.wait(60)
+                continue
+            pooled = self._launch(profile_path, options, headless)
+            pooled.jobs += 1
+            return pooled
+
+    def checkin(self, pooled):
+        """Devuelve un navegador al pool, o lo cierra si le toca reciclarse."""
+        if pooled is None:
+            return
+        memory_mb = pooled.memory_mb()
+        if (pooled.jobs >= self.max_jobs_per_browser
+                or (memory_mb is not None and memory_mb > self.max_browser_memory_mb)
+                or not self._reset(pooled)):
+            self._quit(pooled)
+            return
+        pooled.idle_since = time.monotonic()
+        with self.lock:
+            previous = self.idle.pop((pooled.profile_path, pooled.headless), None)
+            self.idle[(pooled.profile_path, pooled.headless)] = pooled
+            evicted = self._over_capacity()
+            self._start_janitor()
+        for browser in ([previous] if previous else []) + evicted:
+            self._quit(browser)
+
+    def prewarm(self, profile_path, options, headless=True):
+        """Lanza en segundo plano el navegador de un perfil para que esté listo cuando llegue su trabajo."""
+        key = (profile_path, headless)
+        with self.lock:
+            if key in self.idle or key in self.warming:
+                return
+            self.warming[key] = threading.Event()
+
+        def warm():
+            try:
+                pooled = self._launch(profile_path, options, headless)
+                pooled.idle_since = time.monotonic()
+                with self.lock:
+                    self.idle[key] = pooled
+                    evicted = self._over_capacity()
+                    self._start_janitor()
+                for browser in evicted:
+                    self._quit(browser)
+            except Exception as e:
+                print(f"⚠️ No se pudo precalentar Chrome para {profile_path}: {e}")
+            finally:
+                with self.lock:
+                    self.warming.pop(key).set()
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def evict_idle(self, count=1):
+        """Cierra los `count` navegadores ociosos más antiguos. Devuelve cuántos cerró."""
+        with self.lock:
+            oldest = sorted(self.idle.items(), key=lambda item: item[1].idle_since)[:count]
+            for key, _ in oldest:
+                del self.idle[key]
+        for _, pooled in oldest:
+            self._quit(pooled)
+        return len(oldest)
+
+    def discard_profile(self, profile_path):
+        """Cierra cualquier navegador ocioso de un perfil (p. ej. antes de borrar el cliente)."""
+        with self.lock:
+            keys = [key for key in self.idle if key[0] == profile_path]
+            browsers = [self.idle.pop(key) for key in keys]
+        for pooled in browsers:
+            self._quit(pooled)
+
+    def close_all(self):
+        self.evict_idle(len(self.idle))
+
+    # --- Internos ---
+
+    def _launch(self, profile_path, options, headless):
+        service = ChromeService(self.driver_path or self.resolve_driver_path())
+        return PooledBrowser(profile_path, headless, webdriver.Chrome(service=service, options=options))
+
+    def _is_alive(self, pooled):
+        try:
+            pooled.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, pooled):
+        """Deja el navegador en una sola pestaña en blanco para el siguiente trabajo."""
+        try:
+            handles = pooled.driver.window_handles
+            for handle in handles[1:]:
+                pooled.driver.switch_to.window(handle)
+                pooled.driver.close()
+            pooled.driver.switch_to.window(handles[0])
+            pooled.driver.get('about:blank')
+            return True
+        except Exception:
+            return False
+
+    def _quit(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"⚠️ Error cerrando Chrome de {pooled.profile_path}: {e}")
+
+    def _over_capacity(self):
+        """Saca del pool los ociosos que exceden `max_idle` (los más antiguos). Llamar con el lock tomado."""
+        excess = len(self.idle) - self.max_idle
+        if excess <= 0:
+            return []
+        oldest = sorted(self.idle.items(), key=lambda item: item[1].idle_since)[:excess]
+        return [self.idle.pop(key) for key, _ in oldest]
+
+    def _start_janitor(self):
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._janitor_loop, daemon=True)
+            self._janitor.start()
+
+    def _janitor_loop(self):
+        """Cierra periódicamente los navegadores que llevan demasiado tiempo ociosos."""
+        while True:
+            time.sleep(30)
+            now = time.monotonic()
+            with self.lock:
+                expired = [key for key, pooled in self.idle.items() if now - pooled.idle_since > self.idle_ttl_seconds]
+                browsers = [self.idle.pop(key) for key in expired]
+            for pooled in browsers:
+                self._quit(pooled)
+
+
+# Instancia global
+browser_pool = BrowserPool()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+import itertools
+
+from system_resources import available_memory_mb, cpu_count, load_average
+
+
+class BrowserSlotScheduler:
+    """
+    Reparte "ranuras" de navegador entre los trabajos de publicación.
+    En lugar de un número fijo, la capacidad se calcula a partir de la RAM libre y la CPU
+    medidas, de modo que una VM pequeña admite tantos Chrome como realmente le caben.
+    Un trabajo que va a esperar entre publicaciones devuelve su ranura y la vuelve a pedir después.
+    """
+    def __init__(self):
+        self.browser_memory_mb = int(os.getenv("BROWSER_MEMORY_MB", 400))      # RAM que consume un Chrome headless
+        self.memory_reserve_mb = int(os.getenv("BROWSER_MEMORY_RESERVE_MB", 512))  # RAM que se deja para Flask, BD, SO...
+        self.browsers_per_cpu = float(os.getenv("BROWSERS_PER_CPU", 2))
+        self.min_slots = int(os.getenv("BROWSER_MIN_SLOTS", 1))
+        self.max_slots = int(os.getenv("BROWSER_MAX_SLOTS", 12))
+        # Un Chrome recién lanzado tarda en reflejar su consumo en MemAvailable.
+        self.warmup_seconds = float(os.getenv("BROWSER_WARMUP_SECONDS", 30))
+        self.cond = threading.Condition()
+        self.slots = {}  # token -> (client_id, momento de la asignación)
+        self.reclaimers = []
+        self.reclaiming = False  # Hay un trabajo ejecutando los reclamadores (fuera del candado)
+        self._tokens = itertools.count(1)
+
+    def add_reclaimer(self, reclaim):
+        """
+        Registra una función que libera RAM cuando no hay ranuras (p. ej. cerrar navegadores ociosos).
+        Debe devolver cuántos recursos liberó.
+        """
+        self.reclaimers.append(reclaim)
+
+    def capacity(self):
+        """Número de navegadores simultáneos que admite ahora mismo la máquina."""
+        in_use = len(self.slots)
+        now = time.monotonic()
+        warming_up = sum(1 for _, acquired_at in self.slots.values() if now - acquired_at < self.warmup_seconds)
+
+        free_mb = available_memory_mb()
+        if free_mb is None:
+            by_memory = self.max_slots
+        else:
+            headroom = free_mb - self.memory_reserve_mb - warming_up * self.browser_memory_mb
+            by_memory = in_use + int(headroom // self.browser_memory_mb)
+
+        cpus = cpu_count()
+        by_cpu = int(cpus * self.browsers_per_cpu)
+        load = load_average()
+        if load is not None and load > cpus:
+            # CPU saturada: no se admiten más navegadores de los que ya hay.
+            by_cpu = min(by_cpu, in_use)
+
+        return max(self.min_slots, min(by_memory, by_cpu, self.max_slots))
+
+    def acquire(self, client_id, cancelled=None, poll_seconds=5):
+        """
+        Bloquea hasta que haya una ranura libre y la asigna al cliente.
+        Args:
+            cancelled (callable): Si devuelve True mientras se espera, se abandona la espera.
+        Returns:
+            int: Token de la ranura, o None si la espera se canceló.
+        """
+        while True:
+            with self.cond:
+                if len(self.slots) < self.capacity():
+                    token = next(self._tokens)
+                    self.slots[token] = (client_id, time.monotonic())
+                    return token
+                if cancelled and cancelled():
+                    return None
+                if self.reclaiming or not self.reclaimers:
+                    # Se reevalúa periódicamente porque la RAM libre cambia sin que nadie lo notifique.
+                    self.cond.wait(poll_seconds)
+                    continue
+                self.reclaiming = True
+            # Los reclamadores tardan (cerrar un Chrome son segundos): se ejecutan sin el candado para
+            # no bloquear release() ni status(), y de uno en uno para no cerrar de más.
+            freed = 0
+            try:
+                freed = sum(reclaim() for reclaim in self.reclaimers)
+            finally:
+                with self.cond:
+                    self.reclaiming = False
+                    self.cond.notify_all()
+            with self.cond:
+                self.cond.wait(1 if freed else poll_seconds)
+
+    def release(self, token):
+        """Libera una ranura y despierta a los trabajos en espera."""
+        with self.cond:
+            if self.slots.pop(token, None):
+                self.cond.notify_all()
+
+    def status(self):
+        """Resumen para diagnóstico: ranuras ocupadas y capacidad actual."""
+        with self.cond:
+            return {"in_use": len(self.slots), "capacity": self.capacity()}
+
+
+# Instancia global
+browser_scheduler = BrowserSlotScheduler()
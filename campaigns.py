@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+from urllib.parse import urlsplit
+
+from database import db_manager, normalize_tags, tag_match_clause
+
+# Subdominios de Facebook que apuntan a la misma página que facebook.com.
+FACEBOOK_HOST_PREFIXES = ('www.', 'web.', 'm.', 'mbasic.')
+
+
+def group_url_key(url):
+    """
+    Clave para detectar el mismo grupo guardado con URLs distintas: sin esquema, sin 'www.'/'m.',
+    sin parámetros ni fragmento, sin barra final y en minúsculas.
+    """
+    url = (url or '').strip()
+    parts = urlsplit(url if '://' in url else f"https://{url}")
+    host = parts.netloc.lower()
+    for prefix in FACEBOOK_HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return f"{host}{parts.path.rstrip('/')}".lower()
+
+
+class CampaignPlanner:
+    """
+    Planifica las publicaciones en grupos como campañas persistentes (`campaigns` + `campaign_targets`).
+    - El conjunto de grupos se calcula una sola vez, con una consulta sobre el índice de etiquetas,
+      y se deduplica por URL.
+    - Los grupos se reparten entre `shards` navegadores del mismo cliente (round-robin en el orden
+      de la consulta); cada shard es un trabajo de la cola con su propio perfil de Chrome.
+    - Cada grupo pasa por 'pending' -> 'posting' -> 'done' / 'failed'. Al reanudar solo se retoman
+      los 'pending': un grupo que quedó en 'posting' por una caída no se publica dos veces.
+    """
+    def __init__(self):
+        self.max_shards = max(1, int(os.getenv("CAMPAIGN_MAX_SHARDS", 4)))
+
+    def plan(self, client_id, group_tags, content_tags, max_shards=1):
+        """
+        Devuelve la campaña que hay que ejecutar para estas etiquetas: la que quedó a medias si son las
+        mismas (se reanuda donde se quedó) o una nueva. Una campaña a medias con otras etiquetas se cancela.
+        Returns:
+            dict: Fila de la campaña más `pending`, `duplicates` y `resumed`; None si ningún grupo coincide.
+        """
+        group_tags = normalize_tags(group_tags)
+        content_tags = normalize_tags(content_tags)
+        current = db_manager.fetch_one(
+            "SELECT * FROM campaigns WHERE client_id = %s AND status = 'running' ORDER BY id DESC LIMIT 1", (client_id,)
+        )
+        if current:
+            if current['group_tags'] == ",".join(group_tags) and current['content_tags'] == ",".join(content_tags):
+                pending = self.pending_count(current['id'])
+                if pending:
+                    return dict(current, pending=pending, duplicates=0, resumed=True)
+                self._finish(current['id'], 'completed')
+            else:
+                self._finish(current['id'], 'cancelled')
+
+        group_filter, group_params = tag_match_clause('groups', 'g.id', client_id, group_tags)
+        groups = db_manager.fetch_all(
+            f"SELECT g.id, g.url FROM groups g WHERE g.client_id = %s AND {group_filter} ORDER BY g.id",
+            (client_id,) + group_params
+        )
+        targets, seen = [], set()
+        for group in groups:
+            key = group_url_key(group['url'])
+            if key not in seen:
+                seen.add(key)
+                targets.append(group['id'])
+        if not targets:
+            return None
+
+        shards = max(1, min(max_shards, self.max_shards, len(targets)))
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO campaigns (client_id, group_tags, content_tags, shards) VALUES (%s, %s, %s, %s)",
+                (client_id, ",".join(group_tags), ",".join(content_tags), shards)
+            )
+            campaign_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO campaign_targets (campaign_id, group_id, shard, position) VALUES (%s, %s, %s, %s)",
+                [(campaign_id, group_id, position % shards, position) for position, group_id in enumerate(targets)]
+            )
+        campaign = self.get(campaign_id)
+        return dict(campaign, pending=len(targets), duplicates=len(groups) - len(targets), resumed=False)
+
+    def get(self, campaign_id):
+        return db_manager.fetch_one("SELECT * FROM campaigns WHERE id = %s", (campaign_id,))
+
+    def pending_targets(self, campaign_id, shard):
+        """Grupos que le quedan a un shard, en el orden planificado."""
+        return db_manager.fetch_all(
+            """SELECT g.* FROM campaign_targets ct
+               JOIN groups g ON g.id = ct.group_id
+               WHERE ct.campaign_id = %s AND ct.shard = %s AND ct.status = 'pending'
+               ORDER BY ct.position""",
+            (campaign_id, shard)
+        )
+
+    def pending_count(self, campaign_id):
+        row = db_manager.fetch_one(
+            "SELECT COUNT(*) AS pending FROM campaign_targets WHERE campaign_id = %s AND status = 'pending'", (campaign_id,)
+        )
+        return row['pending'] if row else 0
+
+    def mark_target(self, campaign_id, group_id, status, error=None):
+        db_manager.execute_query(
+            "UPDATE campaign_targets SET status = %s, error = %s WHERE campaign_id = %s AND group_id = %s",
+            (status, error, campaign_id, group_id), commit=True
+        )
+
+    def finish_if_done(self, campaign_id):
+        """
+        Da la campaña por completada si no le quedan grupos pendientes. Se llama cuando ya no queda
+        ningún shard en marcha; si quedan pendientes, sigue 'running' para poder reanudarla.
+        """
+        if not self.pending_count(campaign_id):
+            self._finish(campaign_id, 'completed')
+
+    def progress(self, client_id):
+        """Estado de la última campaña del cliente: grupos por estado en total y por shard."""
+        campaign = db_manager.fetch_one(
+            "SELECT * FROM campaigns WHERE client_id = %s ORDER BY id DESC LIMIT 1", (client_id,)
+        )
+        if not campaign:
+            return None
+        rows = db_manager.fetch_all(
+            "SELECT shard, status, COUNT(*) AS total FROM campaign_targets WHERE campaign_id = %s GROUP BY shard, status",
+            (campaign['id'],)
+        )
+        totals, shards = {}, {}
+        for row in rows:
+            totals[row['status']] = totals.get(row['status'], 0) + row['total']
+            shards.setdefault(row['shard'], {})[row['status']] = row['total']
+        return dict(campaign, targets=totals, shard_targets=shards)
+
+    # --- Internos ---
+
+    def _finish(self, campaign_id, status):
+        db_manager.execute_query(
+            "UPDATE campaigns SET status = %s, finished_at = NOW() WHERE id = %s AND status = 'running'",
+            (status, campaign_id), commit=True
+        )
+
+
+# Instancia global
+campaign_planner = CampaignPlanner()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import heapq
+import random
+import threading
+
+from database import db_manager, normalize_tags, tag_match_clause
+
+
+class ContentSelector:
+    """
+    Elige pares texto/imagen menos usados para UNA ejecución de publicación de un cliente.
+    Los IDs candidatos y su uso se cargan una sola vez al empezar; cada elección se resuelve
+    después en memoria con montículos (uso, desempate aleatorio) en O(log n), sin
+    `ORDER BY usage_count, RAND()` en la base de datos.
+    """
+    ALL_IMAGES = None  # Clave del montículo que contiene todas las imágenes del cliente.
+
+    def __init__(self, client_id, content_tags):
+        self.client_id = client_id
+        self.content_tags = normalize_tags(content_tags)
+        self.lock = threading.Lock()
+        # Textos: uso actual, etiquetas y montículo de (usage_count, desempate, text_id).
+        self.text_usage = {}
+        self.text_tags = {}
+        self.text_heap = []
+        # Textos entregados que aún no se han marcado como usados o liberados.
+        self.in_flight = set()
+        # Imágenes: no tienen contador en BD, se equilibra el uso dentro de la ejecución.
+        self.image_usage = {}
+        self.image_tags = {}
+        self.image_heaps = {}
+
+    def load(self):
+        """Carga los textos que coinciden con las etiquetas de contenido y todas las imágenes del cliente."""
+        tag_filter, tag_params = tag_match_clause('texts', 't.id', self.client_id, self.content_tags)
+        text_rows = db_manager.fetch_all(
+            f"""SELECT t.id, t.usage_count, tg.name AS tag
+                FROM texts t
+                LEFT JOIN text_tags tt ON tt.text_id = t.id
+                LEFT JOIN tags tg ON tg.id = tt.tag_id
+                WHERE t.client_id = %s AND {tag_filter}""",
+            (self.client_id,) + tag_params
+        )
+        image_rows = db_manager.fetch_all(
+            """SELECT i.id, tg.name AS tag
+               FROM images i
+               LEFT JOIN image_tags it ON it.image_id = i.id
+               LEFT JOIN tags tg ON tg.id = it.tag_id
+               WHERE i.client_id = %s""",
+            (self.client_id,)
+        )
+
+        with self.lock:
+            for row in text_rows:
+                self.text_usage[row['id']] = row['usage_count'] or 0
+                tags = self.text_tags.setdefault(row['id'], [])
+                if row['tag']:
+                    tags.append(row['tag'])
+            self.text_heap = [(usage, random.random(), text_id) for text_id, usage in self.text_usage.items()]
+            heapq.heapify(self.text_heap)
+
+            for row in image_rows:
+                self.image_usage[row['id']] = 0
+                tags = self.image_tags.setdefault(row['id'], [])
+                if row['tag']:
+                    tags.append(row['tag'])
+            for image_id in self.image_usage:
+                self._push_image(image_id)
+        return len(self.text_usage), len(self.image_usage)
+
+    # --- Selección ---
+
+    def pick_pair(self):
+        """
+        Reserva el texto menos usado y elige la imagen menos usada que comparta alguna de sus etiquetas.
+        Si no hay imagen coherente, usa la menos usada del cliente.
+        Returns:
+            tuple: (fila de texto, fila de imagen, coincidencia) donde coincidencia es 'tags' o 'any'.
+                   (None, None, None) si no queda contenido disponible.
+        """
+        while True:
+            with self.lock:
+                text_id = self._pop_text()
+            if text_id is None:
+                return None, None, None
+            text = db_manager.fetch_one("SELECT * FROM texts WHERE id = %s AND client_id = %s", (text_id, self.client_id))
+            if text:
+                break
+            # El texto se borró durante la ejecución: se descarta y se prueba el siguiente.
+            self._forget_text(text_id)
+
+        while True:
+            with self.lock:
+                image_id, match = self._peek_image(self.text_tags.get(text_id, []))
+            if image_id is None:
+                return text, None, None
+            image = db_manager.fetch_one("SELECT * FROM images WHERE id = %s AND client_id = %s", (image_id, self.client_id))
+            if image:
+                # La imagen cuenta su uso al elegirse: el par siguiente puede elegirse antes de que
+                # este se publique, y no debe repetir imagen por eso.
+                with self.lock:
+                    self.image_usage[image_id] += 1
+                    self._push_image(image_id)
+                return text, image, match
+            with self.lock:
+                self.image_usage.pop(image_id, None)
+
+    def mark_used(self, text_id):
+        """Registra una publicación exitosa: el texto vuelve al montículo con un uso más."""
+        with self.lock:
+            self.in_flight.discard(text_id)
+            if text_id in self.text_usage:
+                self.text_usage[text_id] += 1
+                heapq.heappush(self.text_heap, (self.text_usage[text_id], random.random(), text_id))
+
+    def release(self, text_id):
+        """Devuelve al montículo un texto reservado que no llegó a publicarse, sin sumar uso."""
+        with self.lock:
+            if text_id in self.in_flight and text_id in self.text_usage:
+                self.in_flight.discard(text_id)
+                heapq.heappush(self.text_heap, (self.text_usage[text_id], random.random(), text_id))
+
+    # --- Montículos ---
+
+    def _pop_text(self):
+        while self.text_heap:
+            usage, _, text_id = heapq.heappop(self.text_heap)
+            # Las entradas obsoletas (uso desactualizado o texto ya reservado) se descartan al salir.
+            if self.text_usage.get(text_id) == usage and text_id not in self.in_flight:
+                self.in_flight.add(text_id)
+                return text_id
+        return None
+
+    def _forget_text(self, text_id):
+        with self.lock:
+            self.in_flight.discard(text_id)
+            self.text_usage.pop(text_id, None)
+            self.text_tags.pop(text_id, None)
+
+    def _push_image(self, image_id):
+        entry = (self.image_usage[image_id], random.random(), image_id)
+        for key in self.image_tags.get(image_id, []) + [self.ALL_IMAGES]:
+            heapq.heappush(self.image_heaps.setdefault(key, []), entry)
+
+    def _top_image(self, key):
+        heap = self.image_heaps.get(key)
+        while heap:
+            usage, _, image_id = heap[0]
+            if self.image_usage.get(image_id) == usage:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def _peek_image(self, tags):
+        candidates = [top for top in (self._top_image(tag) for tag in tags) if top]
+        if candidates:
+            return min(candidates)[2], 'tags'
+        top = self._top_image(self.ALL_IMAGES)
+        return (top[2], 'any') if top else (None, None)
@@ -1,13 +1,100 @@
 # -*- coding: utf-8 -*-
 import os
+import json
+import time
+import atexit
+import itertools
+import threading
+from collections import Counter, namedtuple
+from contextlib import contextmanager
 import mysql.connector
-from mysql.connector import pooling
 from dotenv import load_dotenv
 
+from db_pool import BlockingConnectionPool
+
+# Errores de conexión o de pool: la escritura puede funcionar más tarde, así que se reintenta.
+TRANSIENT_DB_ERRORS = (mysql.connector.OperationalError, mysql.connector.InterfaceError, mysql.connector.errors.PoolError)
+
 # Carga las variables de entorno desde el archivo .env
 # (DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_PORT)
 load_dotenv()
 
+# Tablas que tienen etiquetas y su tabla de unión normalizada: tabla -> (tabla_unión, columna_fk)
+TAG_LINKS = {
+    'texts': ('text_tags', 'text_id'),
+    'images': ('image_tags', 'image_id'),
+    'groups': ('group_tags', 'group_id'),
+}
+# Columna CSV heredada que cada tabla sigue guardando para mostrarla en el panel.
+TAG_SOURCE_COLUMNS = {'texts': 'ai_tags', 'images': 'manual_tags', 'groups': 'tags'}
+
+
+def normalize_tags(tags):
+    """
+    Normaliza etiquetas a minúsculas, sin espacios sobrantes ni duplicados.
+    Acepta un string separado por comas ("Coches, venta") o una lista.
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    normalized = []
+    for tag in tags:
+        name = " ".join(str(tag).split()).lower()[:191]
+        if name and name not in normalized:
+            normalized.append(name)
+    return normalized
+
+
+def tag_match_clause(table, id_column, client_id, tags):
+    """
+    Construye el filtro "tiene alguna de estas etiquetas" para `texts`, `images` o `groups`.
+    Resuelve las etiquetas por el índice único (client_id, name) y los elementos por la
+    clave primaria de la tabla de unión, sin recorrer las columnas CSV.
+    Returns:
+        tuple: (fragmento SQL, parámetros). Con una lista vacía no coincide nada.
+    """
+    if not tags:
+        return "1 = 0", ()
+    link_table, fk_column = TAG_LINKS[table]
+    placeholders = ", ".join(["%s"] * len(tags))
+    clause = f"""{id_column} IN (
+        SELECT lt.{fk_column} FROM tags tg
+        JOIN {link_table} lt ON lt.tag_id = tg.id
+        WHERE tg.client_id = %s AND tg.name IN ({placeholders})
+    )"""
+    return clause, (client_id,) + tuple(tags)
+
+
+# Tablas del panel que se sincronizan de forma incremental (columna `updated_at` + tombstones en `deleted_items`).
+SYNC_TABLES = ('texts', 'images', 'groups', 'pages', 'scheduled_posts')
+
+
+# Importación masiva: INSERT multi-fila por tabla (`{values}` se rellena con un grupo por fila).
+# Los duplicados de la clave única se saltan con `ON DUPLICATE KEY UPDATE id = id` (no con IGNORE,
+# que también convertiría en avisos los datos inválidos). `is_new` distingue las filas nuevas: un
+# `id = id` no cambia nada, así que `updated_at` solo vale NOW(6) (la hora de la sentencia) en ellas.
+BULK_INSERTS = {
+    'texts': ("INSERT INTO texts (client_id, content, ai_tags, tag_status) VALUES {values} RETURNING id, content",
+              "(%s, %s, '', 'pending')"),
+    'groups': ("""INSERT INTO groups (client_id, url, tags) VALUES {values}
+                  ON DUPLICATE KEY UPDATE id = id RETURNING id, url, tags, updated_at = NOW(6) AS is_new""",
+               "(%s, %s, %s)"),
+    'pages': ("""INSERT INTO pages (client_id, name, page_url) VALUES {values}
+                 ON DUPLICATE KEY UPDATE id = id RETURNING id, name, page_url, updated_at = NOW(6) AS is_new""",
+              "(%s, %s, %s)"),
+    'images': ("""INSERT INTO images (client_id, path, manual_tags, content_hash, thumb_path) VALUES {values}
+                  ON DUPLICATE KEY UPDATE id = id RETURNING id, path, manual_tags, updated_at = NOW(6) AS is_new""",
+               "(%s, %s, %s, %s, %s)"),
+}
+
+
+PUBLICATION_LOG_INSERT = """
+    INSERT INTO publication_log (client_id, timestamp, status, target_type, target_url, text_content, image_path, published_post_url, error_details)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
 class DatabaseManager:
     """
     Gestiona toda la interacción con la base de datos MariaDB/MySQL.
@@ -17,17 +104,39 @@ class DatabaseManager:
         """
         Inicializa el pool de conexiones a la base de datos y crea las tablas si no existen.
         """
+        # Buffer de reintentos de publicaciones que no se pudieron escribir al momento (ver record_publication).
+        self.write_buffer_flush_seconds = float(os.getenv("DB_WRITE_BUFFER_FLUSH_SECONDS", 5))
+        # Límites para que un error permanente no bloquee el buffer: reintentos por fila y filas retenidas.
+        # Lo que se descarta se guarda en DB_DEAD_LETTER_FILE (una publicación JSON por línea).
+        self.write_max_retries = max(1, int(os.getenv("DB_WRITE_MAX_RETRIES", 5)))
+        self.write_buffer_limit = max(1, int(os.getenv("DB_WRITE_BUFFER_LIMIT", 10000)))
+        self.dead_letter_file = os.getenv("DB_DEAD_LETTER_FILE", "dead_letter_publications.jsonl")
+        self._publication_buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_thread = None
+        atexit.register(self.close_publications)
+        # Caché de filas de `clients` por id (ver get_client). Es por proceso: con varios procesos,
+        # un cambio hecho en otro se ve como mucho CLIENT_CACHE_TTL_SECONDS después.
+        self.client_cache_ttl = float(os.getenv("CLIENT_CACHE_TTL_SECONDS", 30))
+        self._client_cache = {}  # client_id -> (expira_en, fila)
+        self._client_cache_lock = threading.Lock()
+        # Días que se guardan los tombstones de borrados para la sincronización incremental.
+        self.tombstone_retention_days = int(os.getenv("SYNC_TOMBSTONE_DAYS", 30))
         try:
-            self.pool = mysql.connector.pooling.MySQLConnectionPool(
+            # Tamaño, espera máxima y cola de espera configurables (DB_POOL_SIZE, DB_POOL_TIMEOUT_SECONDS,
+            # DB_POOL_MAX_WAITERS); por defecto se dimensiona según los hilos que comparten el pool.
+            self.pool = BlockingConnectionPool(
                 pool_name="marketing_pool",
-                pool_size=5, # Número de conexiones a mantener abiertas. 5 es un buen punto de partida.
                 host=os.getenv("DB_HOST", "localhost"),
                 user=os.getenv("DB_USER"),
                 password=os.getenv("DB_PASSWORD"),
                 database=os.getenv("DB_NAME"),
-                port=os.getenv("DB_PORT", 3306)
+                port=os.getenv("DB_PORT", 3306),
+                # Con eventlet/gevent (server.py) hace falta el conector puro: el de C no cede el bucle de eventos.
+                use_pure=os.getenv("DB_USE_PURE", "0").lower() in ("1", "true")
             )
-            print("✅ Pool de conexiones a MariaDB creado exitosamente.")
+            print(f"✅ Pool de conexiones a MariaDB creado exitosamente ({self.pool.pool_size} conexiones).")
             self.setup_tables()
         except mysql.connector.Error as err:
             print(f"❌ Error crítico al conectar con MariaDB: {err}")
@@ -60,6 +169,26 @@ class DatabaseManager:
             cursor.close()
             conn.close() # Devuelve la conexión al pool.
 
+    def execute_insert(self, query, params=()):
+        """
+        Ejecuta un INSERT, confirma la transacción y devuelve el id autoincremental de la fila creada.
+        Returns:
+            int: El id insertado, o None si hubo un error.
+        """
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            conn.commit()
+            return cursor.lastrowid
+        except mysql.connector.Error as err:
+            print(f"❌ Error de base de datos: {err}")
+            conn.rollback()
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
     def fetch_all(self, query, params=()):
         """
         Ejecuta una consulta y devuelve todas las filas encontradas como una lista de diccionarios.
@@ -86,7 +215,450 @@ class DatabaseManager:
         finally:
             cursor.close()
             conn.close()
-            
+
+    def iter_rows(self, query, params=(), chunk_size=None, row_format='dict', fetch_size=500):
+        """
+        Generador que recorre el resultado de una consulta sin cargarlo entero en memoria: usa un
+        cursor sin buffer, así que las filas llegan del servidor a medida que se leen.
+        La conexión queda ocupada hasta que el generador se agota o se cierra; no debe dejarse a medias
+        sin cerrar (usar `with closing(...)` o consumirlo entero).
+        Args:
+            chunk_size (int): Si se indica, entrega listas de hasta `chunk_size` filas en lugar de filas sueltas.
+            row_format (str): 'dict' (por defecto), 'tuple' o 'namedtuple'.
+            fetch_size (int): Filas que se leen del servidor por vuelta cuando no hay `chunk_size`.
+        """
+        if row_format not in ('dict', 'tuple', 'namedtuple'):
+            raise ValueError(f"row_format '{row_format}' no es válido. Opciones: dict, tuple, namedtuple")
+        conn = self.pool.get_connection()
+        cursor = conn.cursor(buffered=False, dictionary=(row_format == 'dict'))
+        try:
+            cursor.execute(query, params)
+            row_type = namedtuple('Row', cursor.column_names, rename=True) if row_format == 'namedtuple' else None
+            while True:
+                rows = cursor.fetchmany(chunk_size or fetch_size)
+                if not rows:
+                    break
+                if row_type:
+                    rows = [row_type(*row) for row in rows]
+                if chunk_size:
+                    yield rows
+                else:
+                    yield from rows
+        finally:
+            # Si el generador se cerró antes de tiempo, hay que descartar las filas pendientes
+            # para devolver la conexión limpia al pool.
+            try:
+                if conn.unread_result:
+                    conn.consume_results()
+            except mysql.connector.Error:
+                pass
+            cursor.close()
+            conn.close()
+
+    def execute_many(self, query, seq_params, commit=True):
+        """
+        Ejecuta la misma consulta para muchas filas con una sola conexión y un solo viaje por lote.
+        Returns:
+            int: Número de filas afectadas, o None si hubo un error.
+        """
+        conn = self.pool.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(query, seq_params)
+            if commit:
+                conn.commit()
+            return cursor.rowcount
+        except mysql.connector.Error as err:
+            print(f"❌ Error de base de datos: {err}")
+            conn.rollback()
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Abre una transacción sobre una única conexión del pool y entrega su cursor (filas como diccionarios).
+        Confirma al salir del bloque y revierte si se produce cualquier excepción.
+        """
+        conn = self.pool.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    # --- Escritura de publicaciones ---
+
+    def record_publication(self, client_id, log_values, success, text_id=None):
+        """
+        Escribe en una sola transacción la fila de `publication_log` de una publicación y, si fue
+        exitosa, el incremento de `texts.usage_count` del texto usado. El consumo del plan no pasa
+        por aquí: se reserva antes de publicar (ver quota.QuotaManager).
+        Se escribe al momento, así que una caída del proceso no pierde publicaciones ya hechas. Solo
+        si la BD no está disponible la publicación queda en el buffer de reintentos, que un hilo
+        vuelca en lote cada `write_buffer_flush_seconds`.
+        Args:
+            log_values (tuple): Valores de la fila, en el orden de PUBLICATION_LOG_INSERT.
+            text_id (int): Texto de la biblioteca que se publicó, si lo hay.
+        """
+        entry = {
+            'client_id': client_id, 'log': log_values, 'success': success,
+            'text_id': text_id if success else None, 'attempts': 0
+        }
+        try:
+            self._write_publications([entry])
+        except TRANSIENT_DB_ERRORS as err:
+            print(f"⚠️ No se pudo guardar la publicación ({err}); queda pendiente de reintento.")
+            self._requeue([entry], err)
+            with self._buffer_lock:
+                if self._flush_thread is None:
+                    self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+                    self._flush_thread.start()
+        except mysql.connector.Error as err:
+            self._dead_letter([entry], err)
+
+    def flush_publications(self):
+        """
+        Vuelca el buffer de reintentos en una única transacción (executemany). Se llama también al
+        terminar cada ejecución y al salir.
+        - Si falla la conexión, el lote vuelve al buffer para el siguiente intento.
+        - Si falla por los datos (p. ej. la clave foránea de un cliente ya borrado), se reintenta fila
+          a fila para que una fila mala no bloquee las demás; las que fallan se descartan a
+          DB_DEAD_LETTER_FILE.
+        - Una fila que agota `write_max_retries` intentos también se descarta.
+        Returns:
+            int: Número de publicaciones escritas.
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch, self._publication_buffer = self._publication_buffer, []
+            if not batch:
+                return 0
+
+            try:
+                self._write_publications(batch)
+                return len(batch)
+            except TRANSIENT_DB_ERRORS as err:
+                print(f"❌ Error volcando {len(batch)} publicaciones pendientes: {err}")
+                self._requeue(batch, err)
+                return 0
+            except mysql.connector.Error as err:
+                print(f"⚠️ Falló el lote de {len(batch)} publicaciones ({err}); se reintenta fila a fila.")
+
+            written, failed = 0, []
+            for entry in batch:
+                try:
+                    self._write_publications([entry])
+                    written += 1
+                except TRANSIENT_DB_ERRORS as err:
+                    failed.append((entry, err))
+                except mysql.connector.Error as err:
+                    self._dead_letter([entry], err)
+            for entry, err in failed:
+                self._requeue([entry], err)
+            return written
+
+    def _write_publications(self, entries):
+        """Escribe en una transacción las filas de log y los contadores de uso de los textos."""
+        text_counts = Counter((entry['text_id'], entry['client_id']) for entry in entries if entry['text_id'])
+        with self.transaction() as cursor:
+            cursor.executemany(PUBLICATION_LOG_INSERT, [entry['log'] for entry in entries])
+            if text_counts:
+                cursor.executemany(
+                    "UPDATE texts SET usage_count = usage_count + %s WHERE id = %s AND client_id = %s",
+                    [(count, text_id, client_id) for (text_id, client_id), count in text_counts.items()]
+                )
+
+    def _requeue(self, entries, error):
+        """Devuelve filas al principio del buffer; las que agotaron sus intentos se descartan."""
+        retry, exhausted = [], []
+        for entry in entries:
+            entry['attempts'] += 1
+            (retry if entry['attempts'] < self.write_max_retries else exhausted).append(entry)
+        with self._buffer_lock:
+            self._publication_buffer = retry + self._publication_buffer
+            overflow = self._trim_buffer()
+        self._dead_letter(exhausted, error)
+        self._dead_letter(overflow, "buffer lleno")
+
+    def _trim_buffer(self):
+        """Quita las filas más antiguas que sobrepasan `write_buffer_limit`. Llamar con _buffer_lock."""
+        excess = len(self._publication_buffer) - self.write_buffer_limit
+        if excess <= 0:
+            return []
+        overflow, self._publication_buffer = self._publication_buffer[:excess], self._publication_buffer[excess:]
+        return overflow
+
+    def _dead_letter(self, entries, error):
+        """Guarda en DB_DEAD_LETTER_FILE las publicaciones que no se pudieron escribir."""
+        if not entries:
+            return
+        print(f"❌ {len(entries)} publicaciones descartadas del buffer ({error}); guardadas en {self.dead_letter_file}.")
+        try:
+            with open(self.dead_letter_file, 'a', encoding='utf-8') as dead_letter:
+                for entry in entries:
+                    dead_letter.write(json.dumps(dict(entry, error=str(error)), default=str, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"❌ No se pudo escribir {self.dead_letter_file}: {e}")
+
+    def close_publications(self):
+        """Al salir: último intento de volcar los reintentos; lo que no se escriba va a DB_DEAD_LETTER_FILE."""
+        self.flush_publications()
+        with self._buffer_lock:
+            remaining, self._publication_buffer = self._publication_buffer, []
+        self._dead_letter(remaining, "pendiente al cerrar el proceso")
+
+    def _flush_loop(self):
+        """Hilo de fondo: reintenta el buffer cada `write_buffer_flush_seconds`."""
+        while True:
+            time.sleep(self.write_buffer_flush_seconds)
+            self.flush_publications()
+
+    # --- Caché de clientes ---
+
+    def get_client(self, client_id):
+        """
+        Devuelve la fila completa de `clients` (o None), cacheada durante `client_cache_ttl` segundos.
+        Quien modifique la fila debe llamar a invalidate_client. Se entrega una copia.
+        """
+        now = time.monotonic()
+        with self._client_cache_lock:
+            cached = self._client_cache.get(client_id)
+            if cached and cached[0] > now:
+                return dict(cached[1])
+        client = self.fetch_one("SELECT * FROM clients WHERE id = %s", (client_id,))
+        if client:
+            with self._client_cache_lock:
+                self._client_cache[client_id] = (now + self.client_cache_ttl, client)
+            return dict(client)
+        return None
+
+    def invalidate_client(self, client_id):
+        with self._client_cache_lock:
+            self._client_cache.pop(int(client_id), None)
+
+    # --- Índice normalizado de etiquetas ---
+
+    def sync_tags(self, client_id, table, item_id, tags):
+        """
+        Sustituye las etiquetas de un elemento (texto, imagen o grupo) en el índice normalizado.
+        Debe llamarse cada vez que se escribe la columna CSV de etiquetas correspondiente.
+        """
+        try:
+            with self.transaction() as cursor:
+                self._link_tags(cursor, client_id, table, [(item_id, normalize_tags(tags))])
+        except mysql.connector.Error as err:
+            print(f"❌ Error sincronizando etiquetas de {table} {item_id}: {err}")
+
+    def _link_tags(self, cursor, client_id, table, items):
+        """
+        Reescribe los enlaces de etiquetas de varios elementos de un mismo cliente dentro de una transacción.
+        Args:
+            items (list): Pares (item_id, [etiquetas normalizadas]).
+        """
+        if not items:
+            return
+        link_table, fk_column = TAG_LINKS[table]
+        names = sorted({name for _, item_tags in items for name in item_tags})
+        tag_ids = {}
+        if names:
+            cursor.executemany(
+                "INSERT IGNORE INTO tags (client_id, name) VALUES (%s, %s)",
+                [(client_id, name) for name in names]
+            )
+            placeholders = ", ".join(["%s"] * len(names))
+            cursor.execute(
+                f"SELECT id, name FROM tags WHERE client_id = %s AND name IN ({placeholders})",
+                (client_id,) + tuple(names)
+            )
+            tag_ids = {row['name']: row['id'] for row in cursor.fetchall()}
+
+        item_ids = [item_id for item_id, _ in items]
+        placeholders = ", ".join(["%s"] * len(item_ids))
+        cursor.execute(f"DELETE FROM {link_table} WHERE {fk_column} IN ({placeholders})", tuple(item_ids))
+        links = [(tag_ids[name], item_id) for item_id, item_tags in items for name in item_tags if name in tag_ids]
+        if links:
+            cursor.executemany(f"INSERT IGNORE INTO {link_table} (tag_id, {fk_column}) VALUES (%s, %s)", links)
+
+    # --- Importación masiva ---
+
+    def bulk_insert(self, client_id, table, rows):
+        """
+        Inserta un lote de filas de un cliente en una sola transacción con un INSERT multi-fila
+        (lo mismo que haría executemany) y devuelve las filas realmente insertadas.
+        En grupos, páginas e imágenes los duplicados de su clave única (URL o hash del contenido) se
+        saltan y no se devuelven; cualquier otro error de datos aborta el lote. RETURNING es de
+        MariaDB 10.5+. Las etiquetas de grupos e imágenes se enlazan en la misma transacción.
+        Args:
+            rows (list): Tuplas de valores sin client_id, en el orden de BULK_INSERTS[table].
+        """
+        if not rows:
+            return []
+        query, row_placeholder = BULK_INSERTS[table]
+        params = tuple(value for row in rows for value in (client_id,) + tuple(row))
+        with self.transaction() as cursor:
+            cursor.execute(query.format(values=", ".join([row_placeholder] * len(rows))), params)
+            inserted, seen = [], set()
+            for row in cursor.fetchall():
+                # Un duplicado dentro del mismo lote puede devolver dos veces la fila recién creada.
+                if row.pop('is_new', 1) and row['id'] not in seen:
+                    seen.add(row['id'])
+                    inserted.append(row)
+            if table in ('groups', 'images'):
+                column = TAG_SOURCE_COLUMNS[table]
+                self._link_tags(cursor, client_id, table, [(row['id'], normalize_tags(row[column])) for row in inserted])
+        return inserted
+
+    # --- Sincronización incremental del panel ---
+
+    def delete_item(self, client_id, table, item_id):
+        """
+        Borra un elemento de una tabla sincronizada y deja su tombstone en `deleted_items` en la misma
+        transacción, para que los paneles que sincronizan con `since=` se enteren del borrado.
+        Devuelve True si el elemento existía.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE id = %s AND client_id = %s", (item_id, client_id))
+            if cursor.rowcount == 0:
+                return False
+            cursor.execute(
+                "INSERT INTO deleted_items (client_id, table_name, item_id) VALUES (%s, %s, %s)",
+                (client_id, table, item_id)
+            )
+            # Poda oportunista: los paneles con un cursor más viejo que la retención hacen una carga completa.
+            cursor.execute(
+                "DELETE FROM deleted_items WHERE deleted_at < NOW(6) - INTERVAL %s DAY LIMIT 1000",
+                (self.tombstone_retention_days,)
+            )
+        return True
+
+    def data_versions(self, client_id):
+        """
+        Versión de cada tabla sincronizada para un cliente (y el último id del historial de publicaciones).
+        Cambia con cualquier alta, edición o borrado; sirve para el ETag de /api/data/initial.
+        Se lee por clave primaria de `collection_versions`: no depende del tamaño de las tablas.
+        """
+        rows = self.fetch_all("SELECT table_name, version FROM collection_versions WHERE client_id = %s", (client_id,))
+        stored = {row['table_name']: row['version'] for row in rows}
+        versions = {table: str(stored.get(table, 0)) for table in SYNC_TABLES}
+        # El historial solo crece: basta con su último id.
+        last_log = self.fetch_one("SELECT MAX(id) AS last_id FROM publication_log WHERE client_id = %s", (client_id,))
+        versions['publication_log'] = str(last_log['last_id'] if last_log else None)
+        return versions
+
+    def table_version(self, client_id, table):
+        """Versión de una sola tabla sincronizada (mismo formato que data_versions)."""
+        row = self.fetch_one(
+            "SELECT version FROM collection_versions WHERE client_id = %s AND table_name = %s", (client_id, table)
+        )
+        return str(row['version'] if row else 0)
+
+    # --- Migraciones ---
+
+    def run_migrations(self):
+        """
+        Aplica una sola vez cada migración pendiente, registrándola en `schema_migrations`.
+        Cada migración es una función o una lista de sentencias SQL. Todas son idempotentes
+        (`IF NOT EXISTS`, `INSERT IGNORE`), así que dos procesos arrancando a la vez no rompen nada.
+        """
+        migrations = [
+            ('0001_tags_from_csv_columns', self._migrate_csv_tags),
+            ('0002_scheduled_posts_claims', [
+                """ALTER TABLE scheduled_posts
+                    ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(128) NULL,
+                    ADD COLUMN IF NOT EXISTS claimed_at DATETIME NULL,
+                    ADD COLUMN IF NOT EXISTS error_details TEXT NULL,
+                    ADD INDEX IF NOT EXISTS idx_status_publish_at (status, publish_at)""",
+            ]),
+            ('0003_texts_tag_status', [
+                # 'pending' mientras el pipeline de etiquetado de IA no ha procesado el texto.
+                """ALTER TABLE texts
+                    ADD COLUMN IF NOT EXISTS tag_status VARCHAR(20) NOT NULL DEFAULT 'done',
+                    ADD INDEX IF NOT EXISTS idx_tag_status (tag_status)""",
+            ]),
+            ('0004_sync_updated_at', [
+                f"""ALTER TABLE {table}
+                    ADD COLUMN IF NOT EXISTS updated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+                    ADD INDEX IF NOT EXISTS idx_client_updated (client_id, updated_at)"""
+                for table in SYNC_TABLES
+            ]),
+            ('0005_listing_indexes', [
+                # Paginación por clave de los listados (/api/items/<tabla>, /api/publication_log).
+                *[f"ALTER TABLE {table} ADD INDEX IF NOT EXISTS idx_client_id (client_id, id)" for table in SYNC_TABLES],
+                """ALTER TABLE texts ADD INDEX IF NOT EXISTS idx_client_tag_status (client_id, tag_status, id)""",
+                """ALTER TABLE scheduled_posts ADD INDEX IF NOT EXISTS idx_client_status (client_id, status, id)""",
+                """ALTER TABLE publication_log
+                    ADD INDEX IF NOT EXISTS idx_client_timestamp (client_id, timestamp, id),
+                    ADD INDEX IF NOT EXISTS idx_client_status_timestamp (client_id, status, timestamp, id)""",
+            ]),
+            ('0006_client_usage_from_counter', [
+                # El contador heredado `clients.publications_this_month` pasa a ser el consumo del mes actual.
+                """INSERT IGNORE INTO client_usage (client_id, period, used)
+                   SELECT id, DATE_FORMAT(UTC_TIMESTAMP(), '%Y-%m'), publications_this_month FROM clients""",
+            ]),
+            ('0007_images_hash_thumbnail', [
+                # El hash del contenido evita guardar dos veces la misma imagen de un cliente.
+                """ALTER TABLE images
+                    ADD COLUMN IF NOT EXISTS content_hash CHAR(64) NULL,
+                    ADD COLUMN IF NOT EXISTS thumb_path VARCHAR(512) NULL,
+                    ADD UNIQUE INDEX IF NOT EXISTS uq_client_content_hash (client_id, content_hash)""",
+            ]),
+            ('0008_panel_logs_origin', [
+                # El seq de cada línea solo es creciente dentro del proceso que la escribió (`origin`).
+                """ALTER TABLE panel_logs
+                    ADD COLUMN IF NOT EXISTS origin VARCHAR(128) NOT NULL DEFAULT '' AFTER room,
+                    ADD INDEX IF NOT EXISTS idx_room_id (room, id)""",
+            ]),
+            ('0009_collection_version_triggers', [
+                # Un trigger por tabla y operación: cubre todas las escrituras (endpoints, programador,
+                # pipeline de etiquetado, buffer de publicaciones) sin que cada una tenga que acordarse.
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+                    FOR EACH ROW INSERT INTO collection_versions (client_id, table_name, version)
+                    VALUES ({'OLD' if event == 'DELETE' else 'NEW'}.client_id, '{table}', 1)
+                    ON DUPLICATE KEY UPDATE version = version + 1"""
+                for table in SYNC_TABLES for event in ('INSERT', 'UPDATE', 'DELETE')
+            ]),
+            ('0010_texts_tagging_claims', [
+                # El pipeline de etiquetado reclama cada texto ('pending' -> 'tagging') antes de llamar a la IA.
+                """ALTER TABLE texts
+                    ADD COLUMN IF NOT EXISTS tagging_owner VARCHAR(128) NULL,
+                    ADD COLUMN IF NOT EXISTS tagging_started_at DATETIME NULL""",
+            ]),
+        ]
+        applied = {row['name'] for row in self.fetch_all("SELECT name FROM schema_migrations")}
+        for name, migration in migrations:
+            if name in applied:
+                continue
+            print(f"🔧 Aplicando migración {name}...")
+            if callable(migration):
+                migration()
+            else:
+                with self.transaction() as cursor:
+                    for statement in migration:
+                        cursor.execute(statement)
+            self.execute_query("INSERT IGNORE INTO schema_migrations (name) VALUES (%s)", (name,), commit=True)
+
+    def _migrate_csv_tags(self, batch_size=500):
+        """Rellena el índice normalizado de etiquetas a partir de las columnas CSV existentes."""
+        for table, column in TAG_SOURCE_COLUMNS.items():
+            rows = self.iter_rows(f"SELECT id, client_id, {column} AS csv_tags FROM {table} ORDER BY client_id, id")
+            batch, batch_client = [], None
+            for row in itertools.chain(rows, [None]):
+                if batch and (row is None or row['client_id'] != batch_client or len(batch) >= batch_size):
+                    with self.transaction() as cursor:
+                        self._link_tags(cursor, batch_client, table, batch)
+                    batch = []
+                if row is not None:
+                    batch_client = row['client_id']
+                    batch.append((row['id'], normalize_tags(row['csv_tags'])))
+
     def setup_tables(self):
         """
         Define y crea todo el esquema de la base de datos para el sistema multi-inquilino.
@@ -186,6 +758,176 @@ class DatabaseManager:
         ) ENGINE=InnoDB;
         """
 
+        # 5. Índice normalizado de etiquetas: sustituye a los `LIKE '%tag%'` sobre columnas CSV.
+        #    Las etiquetas son por cliente y se guardan normalizadas (minúsculas), por eso la
+        #    colación binaria: la búsqueda es exacta y usa el índice único (client_id, name).
+        create_tags_table = """
+        CREATE TABLE IF NOT EXISTS tags (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            client_id INT NOT NULL,
+            name VARCHAR(191) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            UNIQUE KEY (client_id, name),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+
+        # Tablas de unión: la clave primaria (tag_id, item_id) resuelve "elementos con la etiqueta X".
+        create_tag_link_tables = [
+            f"""
+            CREATE TABLE IF NOT EXISTS {link_table} (
+                tag_id INT NOT NULL,
+                {fk_column} INT NOT NULL,
+                PRIMARY KEY (tag_id, {fk_column}),
+                KEY ({fk_column}),
+                FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE,
+                FOREIGN KEY ({fk_column}) REFERENCES {table}(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB;
+            """
+            for table, (link_table, fk_column) in TAG_LINKS.items()
+        ]
+
+        # 6. Cola persistente de trabajos (ver jobs.DatabaseJobQueue). Varios procesos la consumen
+        #    reclamando filas con un token de arrendamiento que renuevan mientras trabajan.
+        create_jobs_table = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            client_id INT NOT NULL,
+            task_type VARCHAR(64) NOT NULL,
+            payload TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            lease_token CHAR(32) NULL,
+            lease_owner VARCHAR(128) NULL,
+            lease_expires_at DATETIME NULL,
+            cancel_requested TINYINT(1) NOT NULL DEFAULT 0,
+            last_error TEXT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            KEY (status, lease_expires_at),
+            KEY (lease_token),
+            KEY (client_id, task_type, status),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+
+        # 7. Caché de etiquetas de IA por hash del contenido normalizado (ver tag_cache.TagCache).
+        #    Es global: el mismo texto produce las mismas etiquetas sea cual sea el cliente.
+        create_ai_tag_cache_table = """
+        CREATE TABLE IF NOT EXISTS ai_tag_cache (
+            content_hash CHAR(64) PRIMARY KEY,
+            tags TEXT NOT NULL,
+            hits INT NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            KEY (last_used_at)
+        ) ENGINE=InnoDB;
+        """
+
+        # 8. Tombstones de los elementos borrados, para la sincronización incremental del panel.
+        create_deleted_items_table = """
+        CREATE TABLE IF NOT EXISTS deleted_items (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            client_id INT NOT NULL,
+            table_name VARCHAR(32) NOT NULL,
+            item_id INT NOT NULL,
+            deleted_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            KEY (client_id, deleted_at),
+            KEY (deleted_at),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+        # Versión de cada colección sincronizada por cliente: la incrementan los triggers de la
+        # migración 0009 con cada alta, edición o borrado, dentro de la misma transacción.
+        create_collection_versions_table = """
+        CREATE TABLE IF NOT EXISTS collection_versions (
+            client_id INT NOT NULL,
+            table_name VARCHAR(32) NOT NULL,
+            version BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (client_id, table_name),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+
+        # 9. Consumo del plan por cliente y mes ('YYYY-MM'). Cada mes es una fila nueva, así que
+        #    no hace falta resetear contadores (ver quota.QuotaManager).
+        create_client_usage_table = """
+        CREATE TABLE IF NOT EXISTS client_usage (
+            client_id INT NOT NULL,
+            period CHAR(7) NOT NULL,
+            used INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (client_id, period),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+        # Reservas de cuota aún sin gastar de cada proceso, con arrendamiento para recuperarlas si muere.
+        create_quota_leases_table = """
+        CREATE TABLE IF NOT EXISTS quota_leases (
+            client_id INT NOT NULL,
+            period CHAR(7) NOT NULL,
+            owner VARCHAR(128) NOT NULL,
+            held INT NOT NULL DEFAULT 0,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (client_id, period, owner),
+            KEY (client_id, period, expires_at),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+
+        # 10. Campañas de publicación en grupos: el conjunto de grupos se planifica una vez, se reparte
+        #     entre navegadores (shards) y el progreso de cada grupo queda guardado para poder reanudar
+        #     (ver campaigns.CampaignPlanner).
+        create_campaigns_table = """
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            client_id INT NOT NULL,
+            group_tags TEXT NOT NULL,
+            content_tags TEXT NOT NULL,
+            shards INT NOT NULL DEFAULT 1,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME NULL,
+            KEY (client_id, status),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+        create_campaign_targets_table = """
+        CREATE TABLE IF NOT EXISTS campaign_targets (
+            campaign_id INT NOT NULL,
+            group_id INT NOT NULL,
+            shard INT NOT NULL DEFAULT 0,
+            position INT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            error TEXT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (campaign_id, group_id),
+            KEY (campaign_id, shard, status, position),
+            FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE,
+            FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB;
+        """
+
+        # 11. Historial de la consola del panel compartido entre procesos (ver log_stream.LogStreamer).
+        create_panel_logs_table = """
+        CREATE TABLE IF NOT EXISTS panel_logs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            room VARCHAR(64) NOT NULL,
+            origin VARCHAR(128) NOT NULL DEFAULT '',
+            seq BIGINT NOT NULL,
+            log_type VARCHAR(16) NOT NULL,
+            message TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_room_id (room, id),
+            KEY (created_at)
+        ) ENGINE=InnoDB;
+        """
+
+        create_schema_migrations_table = """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(191) PRIMARY KEY,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB;
+        """
+
         # Lista de todos los comandos de creación de tablas
         commands = [
             create_clients_table,
@@ -194,12 +936,25 @@ class DatabaseManager:
             create_groups_table,
             create_pages_table,
             create_scheduled_posts_table,
-            create_publication_log_table
+            create_publication_log_table,
+            create_tags_table,
+            *create_tag_link_tables,
+            create_jobs_table,
+            create_ai_tag_cache_table,
+            create_deleted_items_table,
+            create_collection_versions_table,
+            create_client_usage_table,
+            create_quota_leases_table,
+            create_campaigns_table,
+            create_campaign_targets_table,
+            create_panel_logs_table,
+            create_schema_migrations_table
         ]
         
         print("🔧 Verificando y creando el esquema de la base de datos...")
         for command in commands:
             self.execute_query(command, commit=True)
+        self.run_migrations()
         print("✅ Esquema de la base de datos listo.")
 
 # --- Instancia Global ---
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError, Error as MySQLError
+
+
+def default_pool_size():
+    """
+    Tamaño por defecto: un hilo worker de navegador, más los hilos de Flask/SocketIO y de fondo
+    (etiquetado, programador, volcados) que pueden tener una conexión a la vez.
+    mysql-connector no admite más de 32 conexiones por pool.
+    """
+    workers = int(os.getenv("MAX_WORKER_THREADS", 16))
+    background = int(os.getenv("TAGGING_MAX_CONCURRENCY", 4)) + 4
+    web = int(os.getenv("DB_POOL_WEB_CONNECTIONS", 8))
+    return min(workers + background + web, pooling.CNX_POOL_MAXSIZE)
+
+
+class _PooledConnection:
+    """Conexión prestada: delega todo en la conexión real y devuelve su hueco del pool al cerrarse."""
+    def __init__(self, pool, cnx):
+        self._pool = pool
+        self._cnx = cnx
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._cnx.close()
+        finally:
+            self._pool._checkin()
+
+
+class BlockingConnectionPool:
+    """
+    Envoltorio de MySQLConnectionPool que espera a que haya una conexión libre en lugar de lanzar
+    PoolError en cuanto se agotan.
+    - La espera está acotada por `timeout` segundos y por un máximo de hilos esperando a la vez
+      (`max_waiters`); por encima de eso se falla enseguida para no acumular peticiones.
+    - mysql-connector ya comprueba cada conexión al prestarla (ping + reconexión); si esa
+      reconexión falla se reintenta una vez con otra.
+    - Lleva métricas de uso: esperas, conexiones en uso, agotamientos.
+    """
+    def __init__(self, pool_name, pool_size=None, timeout=None, max_waiters=None, **db_config):
+        self.pool_size = min(int(pool_size or os.getenv("DB_POOL_SIZE", 0) or default_pool_size()), pooling.CNX_POOL_MAXSIZE)
+        self.timeout = float(timeout if timeout is not None else os.getenv("DB_POOL_TIMEOUT_SECONDS", 10))
+        self.max_waiters = int(max_waiters if max_waiters is not None else os.getenv("DB_POOL_MAX_WAITERS", 64))
+        self._pool = pooling.MySQLConnectionPool(pool_name=pool_name, pool_size=self.pool_size, **db_config)
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._metrics = {
+            "checkouts": 0, "in_use": 0, "peak_in_use": 0, "waiting": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "timeouts": 0, "rejected": 0, "reconnect_errors": 0,
+        }
+
+    def get_connection(self):
+        """Presta una conexión; espera como mucho `timeout` segundos. Lanza PoolError si no hay."""
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._metrics["waiting"] >= self.max_waiters:
+                    self._metrics["rejected"] += 1
+                    raise PoolError(f"Pool de conexiones agotado: {self.max_waiters} hilos ya esperando.")
+                self._metrics["waiting"] += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self._metrics["waiting"] -= 1
+            if not acquired:
+                with self._lock:
+                    self._metrics["timeouts"] += 1
+                raise PoolError(f"Pool de conexiones agotado: sin conexión libre tras {self.timeout:g}s.")
+
+        try:
+            cnx = self._get_validated()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            metrics = self._metrics
+            metrics["checkouts"] += 1
+            metrics["in_use"] += 1
+            metrics["peak_in_use"] = max(metrics["peak_in_use"], metrics["in_use"])
+            metrics["wait_seconds_total"] += waited
+            metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+        return _PooledConnection(self, cnx)
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["pool_size"] = self.pool_size
+        metrics["wait_seconds_avg"] = round(metrics["wait_seconds_total"] / metrics["checkouts"], 4) if metrics["checkouts"] else 0.0
+        metrics["wait_seconds_total"] = round(metrics["wait_seconds_total"], 3)
+        metrics["wait_seconds_max"] = round(metrics["wait_seconds_max"], 4)
+        return metrics
+
+    # --- Internos ---
+
+    def _get_validated(self):
+        try:
+            return self._pool.get_connection()
+        except PoolError:
+            raise
+        except MySQLError:
+            # La conexión estaba caída y no pudo reconectar; se prueba una vez más.
+            with self._lock:
+                self._metrics["reconnect_errors"] += 1
+            return self._pool.get_connection()
+
+    def _checkin(self):
+        with self._lock:
+            self._metrics["in_use"] -= 1
+        self._slots.release()
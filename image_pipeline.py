@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Procesado de imágenes subidas: guardado en streaming con hash del contenido y miniaturas.
+Las miniaturas necesitan Pillow; si no está instalado se omiten y el panel muestra el original.
+"""
+import os
+import uuid
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_DIR = 'thumbs'
+
+
+def save_upload(file_storage, directory):
+    """
+    Copia un archivo subido a `directory` por bloques, calculando su SHA-256 a la vez, sin cargarlo
+    entero en memoria. El archivo queda con un nombre temporal (ver promote_upload).
+    Returns:
+        tuple: (ruta temporal, hash hexadecimal, extensión en minúsculas)
+    """
+    extension = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lower()
+    temp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}{extension}")
+    digest = hashlib.sha256()
+    with open(temp_path, 'wb') as target:
+        while True:
+            chunk = file_storage.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            target.write(chunk)
+    return temp_path, digest.hexdigest(), extension
+
+
+def promote_upload(temp_path, directory, content_hash, extension):
+    """
+    Da al archivo su nombre definitivo, derivado del hash: no hay colisiones entre subidas
+    simultáneas y la misma imagen siempre acaba en el mismo archivo. Devuelve el nombre.
+    """
+    filename = f"{content_hash[:32]}{extension}"
+    final_path = os.path.join(directory, filename)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, final_path)
+    return filename
+
+
+def make_thumbnail(source_path, target_path, size):
+    """Genera una miniatura JPEG de como mucho `size` px de lado. Se ejecuta en el pool de procesos."""
+    with Image.open(source_path) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(target_path, 'JPEG', quality=80, optimize=True)
+    return target_path
+
+
+class ThumbnailPool:
+    """
+    Pool de procesos para generar miniaturas en paralelo (el redimensionado es CPU pura).
+    Conviene llamar a start() al arrancar, antes de lanzar hilos: los procesos se crean con fork.
+    Con IMAGE_THUMBNAIL_WORKERS=0 las miniaturas se generan en el propio hilo de la petición, o con
+    `offload(fn, *args)` si está definido (server.py lo usa para llevarlas a un hilo real del sistema).
+    """
+    def __init__(self):
+        self.size = int(os.getenv("IMAGE_THUMBNAIL_SIZE", 320))
+        self.workers = int(os.getenv("IMAGE_THUMBNAIL_WORKERS", min(4, os.cpu_count() or 1)))
+        self.timeout = float(os.getenv("IMAGE_THUMBNAIL_TIMEOUT_SECONDS", 30))
+        self.executor = None
+        self.offload = None
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def start(self):
+        if self.enabled and self.workers > 0 and self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+            # Fuerza la creación de los procesos ahora, mientras el proceso principal no tiene hilos.
+            for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+
+    def generate(self, directory, filenames):
+        """
+        Genera en paralelo las miniaturas de varias imágenes de `directory`.
+        Returns:
+            dict: nombre de archivo -> ruta relativa de su miniatura (solo las que se pudieron generar).
+        """
+        if not self.enabled or not filenames:
+            return {}
+        thumbs_dir = os.path.join(directory, THUMBNAIL_DIR)
+        os.makedirs(thumbs_dir, exist_ok=True)
+        jobs = {
+            filename: (os.path.join(directory, filename), os.path.join(thumbs_dir, f"{os.path.splitext(filename)[0]}.jpg"))
+            for filename in filenames
+        }
+        if self.workers > 0 and self.executor is None:
+            self.start()
+
+        thumbnails = {}
+        if self.executor:
+            futures = {filename: self.executor.submit(make_thumbnail, source, target, self.size) for filename, (source, target) in jobs.items()}
+            for filename, future in futures.items():
+                try:
+                    future.result(timeout=self.timeout)
+                    thumbnails[filename] = f"{THUMBNAIL_DIR}/{os.path.basename(jobs[filename][1])}"
+                except Exception as e:
+                    print(f"⚠️ No se pudo generar la miniatura de {filename}: {e}")
+        else:
+            run = self.offload or (lambda fn, *args: fn(*args))
+            for filename, (source, target) in jobs.items():
+                try:
+                    run(make_thumbnail, source, target, self.size)
+                    thumbnails[filename] = f"{THUMBNAIL_DIR}/{os.path.basename(target)}"
+                except Exception as e:
+                    print(f"⚠️ No se pudo generar la miniatura de {filename}: {e}")
+        return thumbnails
+
+
+# Instancia global
+thumbnail_pool = ThumbnailPool()
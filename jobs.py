@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Colas de trabajos pesados (publicaciones con navegador).
+Dos backends con la misma interfaz:
+- DatabaseJobQueue: tabla `jobs` con arrendamientos (lease) y latido (heartbeat). Sobrevive a
+  reinicios y permite varios procesos/nodos consumiendo la misma cola.
+- MemoryJobQueue: la `Queue` local del proceso de siempre, para desarrollo.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from queue import Queue, PriorityQueue
+from datetime import datetime, timedelta
+
+from database import db_manager
+
+
+class MemoryJobQueue:
+    """Cola local del proceso. Los trabajos se pierden al reiniciar."""
+    def __init__(self):
+        self.queue = PriorityQueue()  # (0 si es prioritario, job_id)
+        self.priority_task_types = ()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.on_cancel = None
+        self._ids = iter(range(1, 2 ** 63))
+
+    def put(self, job, cursor=None):
+        """`cursor` se acepta por compatibilidad con DatabaseJobQueue; aquí el trabajo se encola al momento."""
+        with self.lock:
+            job = dict(job, job_id=next(self._ids), status='queued')
+            self.jobs[job['job_id']] = job
+        priority = 0 if job['task_type'] in self.priority_task_types else 1
+        self.queue.put((priority, job['job_id']))
+        return job['job_id']
+
+    def get(self):
+        while True:
+            _, job_id = self.queue.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job and job['status'] == 'queued':
+                    job['status'] = 'running'
+                    return job
+            self.queue.task_done()
+
+    def complete(self, job, error=None):
+        with self.lock:
+            self.jobs.pop(job['job_id'], None)
+        self.queue.task_done()
+
+    def has_active(self, client_id, task_type, data=None):
+        """¿Hay algún trabajo de este tipo en cola o en marcha? `data` filtra por campos del trabajo."""
+        with self.lock:
+            return any(
+                job['client_id'] == client_id and job['task_type'] == task_type
+                and all((job.get('data') or {}).get(key) == value for key, value in (data or {}).items())
+                for job in self.jobs.values()
+            )
+
+    def request_cancel(self, client_id, task_type):
+        """Cancela los trabajos en cola y avisa (on_cancel) a los que ya se están ejecutando."""
+        running = []
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if job['client_id'] != client_id or job['task_type'] != task_type:
+                    continue
+                if job['status'] == 'queued':
+                    del self.jobs[job['job_id']]
+                else:
+                    running.append(job)
+        for job in running:
+            if self.on_cancel:
+                self.on_cancel(job)
+        return bool(running)
+
+
+class DatabaseJobQueue:
+    """
+    Cola persistente sobre la tabla `jobs`.
+    Un único hilo sondeador por proceso reclama trabajos mientras haya workers libres, con un UPDATE
+    condicional que asigna un token de arrendamiento, y se los entrega a los workers (get).
+    Mientras se ejecutan, un hilo de latido renueva `lease_expires_at`. Si el proceso muere, el
+    arrendamiento caduca y otro proceso lo vuelve a tomar (hasta `max_attempts` veces); esa
+    recuperación va en un barrido aparte, cada `sweep_seconds`.
+    Los tipos de `priority_task_types` se reclaman antes que el resto, y `reserved_workers` workers
+    libres se guardan solo para ellos, para que no esperen detrás de trabajos largos.
+    """
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = int(os.getenv("JOB_LEASE_SECONDS", 120))
+        self.poll_seconds = float(os.getenv("JOB_POLL_SECONDS", 2))
+        self.sweep_seconds = float(os.getenv("JOB_SWEEP_SECONDS", 60))
+        self.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+        self.reserved_workers = int(os.getenv("JOB_RESERVED_WORKERS", 1))
+        self.priority_task_types = ()
+        self.leased = {}  # job_id -> trabajo en ejecución en este proceso
+        self.lock = threading.Lock()
+        self.new_job = threading.Event()
+        self.handoff = Queue()  # Trabajos reclamados por el sondeador, para los workers
+        self.idle_workers = 0
+        self.on_cancel = None
+        self._heartbeat = None
+        self._poller = None
+
+    def put(self, job, cursor=None):
+        """
+        Encola un trabajo. Con `cursor` (de db_manager.transaction) el INSERT va dentro de esa
+        transacción: el trabajo solo existe si se confirma el cambio que lo originó.
+        """
+        query = "INSERT INTO jobs (client_id, task_type, payload) VALUES (%s, %s, %s)"
+        params = (job['client_id'], job['task_type'], json.dumps(job.get('data') or {}))
+        if cursor is not None:
+            cursor.execute(query, params)
+            job_id = cursor.lastrowid
+        else:
+            job_id = db_manager.execute_insert(query, params)
+        self.new_job.set()
+        return job_id
+
+    def get(self):
+        """Bloquea hasta que el sondeador entregue un trabajo. Devuelve un dict con job_id, client_id, task_type y data."""
+        with self.lock:
+            self.idle_workers += 1
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, daemon=True)
+                self._poller.start()
+        self.new_job.set()
+        return self.handoff.get()
+
+    def complete(self, job, error=None):
+        db_manager.execute_query(
+            "UPDATE jobs SET status = %s, last_error = %s, lease_expires_at = NULL WHERE id = %s AND lease_token = %s",
+            ('failed' if error else 'done', error, job['job_id'], job['lease_token']), commit=True
+        )
+        with self.lock:
+            self.leased.pop(job['job_id'], None)
+
+    def has_active(self, client_id, task_type, data=None):
+        """¿Hay algún trabajo de este tipo en cola o en marcha? `data` filtra por campos del payload."""
+        data = data or {}
+        payload_filter = "".join(f" AND JSON_EXTRACT(payload, '$.{key}') = %s" for key in data)
+        return db_manager.fetch_one(
+            f"""SELECT id FROM jobs WHERE client_id = %s AND task_type = %s AND status IN ('queued', 'running')
+                {payload_filter} LIMIT 1""",
+            (client_id, task_type) + tuple(data.values())
+        ) is not None
+
+    def request_cancel(self, client_id, task_type):
+        """
+        Cancela los trabajos en cola y marca los que se están ejecutando; el proceso que los tiene
+        lo detecta en su siguiente latido y llama a on_cancel.
+        """
+        db_manager.execute_query(
+            "UPDATE jobs SET status = 'cancelled' WHERE client_id = %s AND task_type = %s AND status = 'queued'",
+            (client_id, task_type), commit=True
+        )
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE client_id = %s AND task_type = %s AND status = 'running'",
+                (client_id, task_type)
+            )
+            running = cursor.rowcount > 0
+        if running:
+            self._check_cancellations()
+        return running
+
+    # --- Internos ---
+
+    def _poll_loop(self):
+        """
+        Reclama trabajos mientras haya workers esperando en get(). Sin trabajo en cola solo hace una
+        lectura por sondeo; los abandonados por procesos caídos se buscan en el barrido periódico.
+        """
+        next_sweep = 0
+        while True:
+            try:
+                with self.lock:
+                    idle = self.idle_workers
+                    # Nunca se reservan todos los workers del proceso: al menos uno atiende cualquier tipo.
+                    reserved = min(self.reserved_workers, idle + len(self.leased) - 1) if self.priority_task_types else 0
+                job, sweep = None, False
+                if idle:
+                    sweep = time.monotonic() >= next_sweep
+                    if sweep:
+                        next_sweep = time.monotonic() + self.sweep_seconds
+                    job = self._claim(include_expired=sweep, priority_only=idle <= reserved)
+                if job:
+                    if sweep:
+                        next_sweep = 0  # Puede haber más abandonados: se sigue barriendo
+                    with self.lock:
+                        self.idle_workers -= 1
+                    self.handoff.put(job)
+                    continue
+            except Exception as e:
+                print(f"⚠️ Error reclamando trabajos de la cola: {e}")
+            self.new_job.wait(self.poll_seconds)
+            self.new_job.clear()
+
+    def _claim(self, include_expired=False, priority_only=False):
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        types = tuple(self.priority_task_types) or ('',)
+        in_types = f"task_type IN ({', '.join(['%s'] * len(types))})"
+        type_filter, type_params = (f" AND {in_types}", types) if priority_only else ("", ())
+        conditions = []
+        # Una lectura barata antes de escribir: sin trabajo en cola, el sondeo no toca la tabla.
+        if db_manager.fetch_one(f"SELECT id FROM jobs WHERE status = 'queued'{type_filter} LIMIT 1", type_params):
+            conditions.append(("status = 'queued'" + type_filter, type_params))
+        if include_expired:
+            # Los trabajos cuyo arrendamiento caducó demasiadas veces se dan por fallidos.
+            db_manager.execute_query(
+                """UPDATE jobs SET status = 'failed', last_error = 'Arrendamiento caducado demasiadas veces.'
+                   WHERE status = 'running' AND lease_expires_at < %s AND attempts >= %s""",
+                (now, self.max_attempts), commit=True
+            )
+            conditions.append(("status = 'running' AND lease_expires_at < %s" + type_filter, (now,) + type_params))
+        # Primero los nuevos, los prioritarios delante y en orden de llegada; después los abandonados por un proceso caído.
+        for condition, params in conditions:
+            with db_manager.transaction() as cursor:
+                cursor.execute(
+                    f"""UPDATE jobs SET status = 'running', lease_token = %s, lease_owner = %s,
+                            lease_expires_at = %s, attempts = attempts + 1
+                        WHERE {condition} ORDER BY {in_types} DESC, id LIMIT 1""",
+                    (token, self.owner, lease_until) + params + types
+                )
+                claimed = cursor.rowcount == 1
+            if claimed:
+                row = db_manager.fetch_one("SELECT * FROM jobs WHERE lease_token = %s", (token,))
+                job = {
+                    'job_id': row['id'], 'client_id': row['client_id'], 'task_type': row['task_type'],
+                    'data': json.loads(row['payload']), 'lease_token': token, 'attempts': row['attempts']
+                }
+                with self.lock:
+                    self.leased[job['job_id']] = job
+                    self._start_heartbeat()
+                return job
+        return None
+
+    def _start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        """Renueva los arrendamientos de este proceso y comprueba si se pidió cancelar alguno."""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self.lock:
+                jobs = list(self.leased.values())
+            if not jobs:
+                continue
+            try:
+                db_manager.execute_many(
+                    "UPDATE jobs SET lease_expires_at = %s WHERE id = %s AND lease_token = %s",
+                    [(datetime.utcnow() + timedelta(seconds=self.lease_seconds), job['job_id'], job['lease_token']) for job in jobs]
+                )
+                self._check_cancellations()
+            except Exception as e:
+                print(f"⚠️ Error renovando arrendamientos de trabajos: {e}")
+
+    def _check_cancellations(self):
+        with self.lock:
+            jobs = dict(self.leased)
+        if not jobs:
+            return
+        placeholders = ", ".join(["%s"] * len(jobs))
+        rows = db_manager.fetch_all(
+            f"SELECT id FROM jobs WHERE id IN ({placeholders}) AND cancel_requested = 1",
+            tuple(jobs)
+        )
+        for row in rows:
+            if self.on_cancel:
+                self.on_cancel(jobs[row['id']])
+
+
+def create_job_queue():
+    """Crea la cola configurada en JOB_QUEUE_BACKEND ('database' por defecto, o 'memory')."""
+    backend = os.getenv("JOB_QUEUE_BACKEND", "database").lower()
+    if backend == "memory":
+        return MemoryJobQueue()
+    if backend == "database":
+        return DatabaseJobQueue()
+    raise ValueError(f"JOB_QUEUE_BACKEND '{backend}' no es válido. Opciones: database, memory")
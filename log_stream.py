@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import socket
+import threading
+from collections import deque
+from database import db_manager
+
+
+class _RoomLog:
+    """Estado de logs de una sala: líneas pendientes de enviar e historial reciente."""
+    def __init__(self, history_lines):
+        self.pending = deque()
+        self.history = deque(maxlen=history_lines)
+        self.dropped = 0
+        self.last_seq = 0
+
+
+class LogStreamer:
+    """
+    Envía los logs de los procesos al panel por SocketIO en lotes, en lugar de un evento por línea.
+    - Las líneas se acumulan por sala y un hilo las emite juntas cada `interval` segundos
+      (evento 'log_batch'), como mucho `batch_max` por sala y envío; también se escriben juntas en stdout.
+    - Si una sala acumula más de `pending_max` líneas (ráfagas más rápidas de lo que se envían),
+      se descartan las informativas y el lote lleva una línea que resume cuántas se omitieron;
+      los avisos y errores siempre se conservan.
+    - Cada sala guarda las últimas `history_lines` líneas para reenviarlas al reconectar
+      (history). Cada línea lleva el proceso que la escribió (`origin`) y un `seq` creciente dentro
+      de ese proceso: el panel recuerda el último seq de cada origen para no repetir ni perder líneas
+      cuando le llegan de varios procesos a la vez.
+    - Con `shared_history` (opcional), el historial se guarda en la tabla `panel_logs` en lugar de en
+      memoria: así el proceso web puede reenviar también las líneas que escribieron los workers.
+    """
+    KEEP_TYPES = ('warning', 'error', 'success')
+
+    def __init__(self, socketio, event='log_batch', shared_history=False):
+        self.socketio = socketio
+        self.event = event
+        self.shared_history = shared_history
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.interval = int(os.getenv("LOG_BATCH_INTERVAL_MS", 150)) / 1000
+        self.batch_max = int(os.getenv("LOG_BATCH_MAX_LINES", 200))
+        self.pending_max = int(os.getenv("LOG_ROOM_PENDING_MAX", 1000))
+        self.history_lines = int(os.getenv("LOG_HISTORY_LINES", 300))
+        self.history_seconds = int(os.getenv("LOG_HISTORY_SECONDS", 3600))
+        self.rooms = {}  # sala -> _RoomLog
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stored = []  # Líneas aún no guardadas en `panel_logs` (historial compartido)
+        self.last_trim = time.monotonic()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def publish(self, room, message, log_type='info'):
+        """Encola una línea para la sala (no bloquea: el envío lo hace el hilo de fondo)."""
+        room = str(room)
+        with self.lock:
+            state = self.rooms.get(room)
+            if state is None:
+                state = self.rooms[room] = _RoomLog(self.history_lines)
+            # Con ms de reloj como base, el orden se mantiene entre reinicios del proceso.
+            state.last_seq = max(state.last_seq + 1, int(time.time() * 1000))
+            line = {'origin': self.origin, 'seq': state.last_seq, 'data': message, 'type': log_type}
+            if self.shared_history:
+                self.stored.append((room, line))
+            else:
+                state.history.append(line)
+            if len(state.pending) >= self.pending_max:
+                if log_type not in self.KEEP_TYPES:
+                    state.dropped += 1
+                    return
+                self._drop_oldest_info(state)
+            state.pending.append(line)
+        if self.thread is None:
+            self.start()
+
+    def history(self, room, after=None):
+        """
+        Líneas recientes de la sala que el panel aún no tiene (para reenviar al reconectar).
+        Args:
+            after (dict): Último seq recibido de cada origen, {origin: seq}.
+        """
+        after = after if isinstance(after, dict) else {}
+        if self.shared_history:
+            rows = db_manager.fetch_all(
+                """SELECT origin, seq, log_type, message FROM panel_logs WHERE room = %s
+                   ORDER BY id DESC LIMIT %s""",
+                (str(room), self.history_lines)
+            )
+            lines = [{'origin': row['origin'], 'seq': row['seq'], 'data': row['message'], 'type': row['log_type']}
+                     for row in reversed(rows)]
+        else:
+            with self.lock:
+                state = self.rooms.get(str(room))
+                lines = list(state.history) if state else []
+        return [line for line in lines if line['seq'] > (after.get(line['origin']) or 0)]
+
+    def flush(self):
+        """Emite lo pendiente de todas las salas. Lo llama el hilo de fondo; también sirve al cerrar."""
+        batches = []
+        with self.lock:
+            for room, state in self.rooms.items():
+                if not state.pending and not state.dropped:
+                    continue
+                lines = [state.pending.popleft() for _ in range(min(self.batch_max, len(state.pending)))]
+                if state.dropped:
+                    # El resumen lleva el seq de la última línea del lote: con uno mayor, el panel
+                    # descartaría las pendientes de los lotes siguientes (filtra por seq).
+                    lines.append({'origin': self.origin, 'seq': lines[-1]['seq'] if lines else state.last_seq, 'type': 'warning',
+                                  'data': f"[{time.strftime('%H:%M:%S')}] ... {state.dropped} mensajes omitidos (demasiados a la vez)."})
+                    state.dropped = 0
+                batches.append((room, lines))
+            stored, self.stored = self.stored, []
+        if stored:
+            self._store(stored)
+        if not batches:
+            return False
+        sys.stdout.write("".join(f"[Cliente {room}] {line['data']}\n" for room, lines in batches for line in lines))
+        sys.stdout.flush()
+        for room, lines in batches:
+            try:
+                self.socketio.emit(self.event, {'lines': lines}, room=room)
+            except Exception as e:
+                print(f"⚠️ No se pudieron enviar {len(lines)} líneas de log a la sala {room}: {e}")
+        return True
+
+    # --- Internos ---
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Error enviando logs al panel: {e}")
+
+    def _store(self, lines):
+        """Guarda las líneas en el historial compartido y, de vez en cuando, borra las caducadas."""
+        try:
+            db_manager.execute_many(
+                "INSERT INTO panel_logs (room, origin, seq, log_type, message) VALUES (%s, %s, %s, %s, %s)",
+                [(room, line['origin'], line['seq'], line['type'], line['data']) for room, line in lines]
+            )
+            if time.monotonic() - self.last_trim >= 60:
+                self.last_trim = time.monotonic()
+                db_manager.execute_query(
+                    "DELETE FROM panel_logs WHERE created_at < NOW() - INTERVAL %s SECOND", (self.history_seconds,), commit=True
+                )
+        except Exception as e:
+            print(f"⚠️ No se pudieron guardar {len(lines)} líneas en el historial de logs: {e}")
+
+    def _drop_oldest_info(self, state):
+        """Hace sitio para un aviso o error descartando la línea informativa pendiente más antigua."""
+        for index, line in enumerate(state.pending):
+            if line['type'] not in self.KEEP_TYPES:
+                del state.pending[index]
+                state.dropped += 1
+                return
+        state.pending.popleft()
+        state.dropped += 1
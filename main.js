@@ -52,15 +52,32 @@ function connectWebSocket() {
     socket.on('connect', () => {
         console.log('✅ Conectado al servidor de logs vía WebSocket.');
         // Una vez conectado, nos autenticamos para unirnos a nuestra sala privada
+        // `after`: al reconectar, el servidor reenvía solo las líneas que nos perdimos
         socket.emit('join', { 
             token: clientState.token,
-            client_id: clientState.id
+            client_id: clientState.id,
+            after: LogManager.lastSeqs
         });
     });
 
-    // Escuchamos los mensajes de log que envía el servidor
-    socket.on('log_message', (msg) => {
-        LogManager.addLog(msg.data, msg.type);
+    // Escuchamos los logs que envía el servidor, agrupados en lotes
+    socket.on('log_batch', (msg) => {
+        LogManager.addLogs(msg.lines);
+    });
+
+    // Líneas recientes que se enviaron mientras no estábamos conectados
+    socket.on('log_history', (msg) => {
+        LogManager.addLogs(msg.lines);
+    });
+    
+    // Etiquetas de IA generadas en segundo plano para un texto
+    socket.on('text_tags', (data) => {
+        const text = (appState.data.texts || []).find(t => t.id === data.id);
+        if (text) {
+            text.ai_tags = data.ai_tags;
+            text.tag_status = data.tag_status;
+            DataManager.updateTextsTable();
+        }
     });
     
     // Escuchamos los cambios de estado de la publicación
@@ -152,6 +169,7 @@ function showLogin() {
     
     clientState = { id: null, name: null, token: null };
     localStorage.removeItem('jwt_token');
+    SyncCache.clear();
     document.getElementById('email').value = '';
     document.getElementById('password').value = '';
 }
@@ -267,11 +285,89 @@ const Utils = {
         } catch (_) {
             return false;
         }
+    },
+
+    // URL firmada de un archivo subido (la firma llega con los datos iniciales y se renueva sola)
+    uploadUrl(path) {
+        const url = `${API_URL}/uploads/client_${clientState.id}/${path}`;
+        return appState.data.uploads ? `${url}?${appState.data.uploads.query}` : url;
+    },
+
+    // Fusiona por id filas nuevas o actualizadas en una colección, quita las borradas y la reordena
+    mergeRows(table, rows, changed = [], deletedIds = []) {
+        const replaced = new Set(changed.map(row => row.id).concat(deletedIds));
+        const merged = changed.concat((rows || []).filter(row => !replaced.has(row.id)));
+        if (table === 'scheduled_posts') {
+            merged.sort((a, b) => Date.parse(b.publish_at) - Date.parse(a.publish_at));
+        } else {
+            merged.sort((a, b) => b.id - a.id);
+        }
+        return merged;
+    }
+};
+
+// Caché local del panel para la sincronización incremental con /api/data/initial
+const SyncCache = {
+    KEY: 'panel_sync_cache',
+    TABLES: ['texts', 'images', 'groups', 'pages', 'scheduled_posts'],
+
+    // Id del cliente dueño del token actual (campo `sub` del JWT)
+    owner() {
+        try {
+            const payload = clientState.token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/');
+            return String(JSON.parse(atob(payload)).sub);
+        } catch (_) {
+            return null;
+        }
+    },
+
+    load() {
+        try {
+            const cache = JSON.parse(localStorage.getItem(this.KEY));
+            return cache && cache.owner === this.owner() ? cache : null;
+        } catch (_) {
+            return null;
+        }
+    },
+
+    save(cursor, etag, data) {
+        const { mode, cursor: _cursor, versions, deleted, ...rows } = data;
+        try {
+            localStorage.setItem(this.KEY, JSON.stringify({ owner: this.owner(), cursor, etag, data: rows }));
+        } catch (error) {
+            // Sin espacio en localStorage: se sigue funcionando con cargas completas.
+            console.warn('No se pudo guardar la caché del panel:', error);
+            this.clear();
+        }
+    },
+
+    clear() {
+        localStorage.removeItem(this.KEY);
+    },
+
+    // Fusiona por id las filas cambiadas y quita las borradas
+    applyDelta(base, delta) {
+        const merged = {
+            ...base,
+            client_info: delta.client_info,
+            uploads: delta.uploads,
+            publication_log: delta.publication_log,
+            publication_log_cursor: delta.publication_log_cursor
+        };
+        for (const table of this.TABLES) {
+            merged[table] = Utils.mergeRows(table, base[table], delta[table] || [], delta.deleted?.[table] || []);
+        }
+        return merged;
     }
 };
 
 // Manejo de datos
 const DataManager = {
+    // Aplica la respuesta de un endpoint de modificación ({ items, deleted, version }) a una colección
+    applyMutation(table, result) {
+        appState.data[table] = Utils.mergeRows(table, appState.data[table], result.items || [], result.deleted || []);
+    },
+
     // Cargar datos iniciales
     async loadInitialData() {
         // 1. Verificación de seguridad: si no hay token, no continuar.
@@ -285,16 +381,26 @@ const DataManager = {
             Utils.showLoading(true);
             
             // 2. Realiza la petición a la API con el token de autorización.
-            const response = await fetch(`${API_URL}/api/data/initial`, {
-                method: 'GET',
-                headers: {
-                    'Authorization': `Bearer ${clientState.token}`
-                }
-            });
+            //    Si hay una copia local, solo se piden los cambios desde su cursor.
+            const cache = SyncCache.load();
+            const headers = { 'Authorization': `Bearer ${clientState.token}` };
+            let url = `${API_URL}/api/data/initial`;
+            if (cache) {
+                url += `?since=${encodeURIComponent(cache.cursor)}`;
+                if (cache.etag) headers['If-None-Match'] = cache.etag;
+            }
+            const response = await fetch(url, { method: 'GET', headers });
 
             // 3. Procesa la respuesta del servidor.
-            if (response.ok) {
-                const data = await response.json();
+            if (response.ok || response.status === 304) {
+                let data;
+                if (response.status === 304) {
+                    data = cache.data; // Nada cambió desde la última sincronización.
+                } else {
+                    const payload = await response.json();
+                    data = payload.mode === 'delta' ? SyncCache.applyDelta(cache.data, payload) : payload;
+                    SyncCache.save(payload.cursor, response.headers.get('ETag'), data);
+                }
                 appState.data = data; // Almacena los datos del cliente en el estado de la app.
                 
                 // Actualiza el nombre del cliente en la UI, por si se reanudó la sesión.
@@ -309,6 +415,7 @@ const DataManager = {
 
                 this.updateUI(); // Dibuja todos los datos en las tablas.
                 this.updateStatus(true);
+                this.scheduleUploadSignatureRefresh();
                 Utils.showNotification('Datos Sincronizados', 'Tu información se ha cargado correctamente.', 'success');
             } else {
                 // 4. Manejo de errores, especialmente de sesión expirada.
@@ -333,6 +440,30 @@ const DataManager = {
         }
     },
 
+    // Programa la renovación de la firma de /uploads antes de que caduque la actual
+    scheduleUploadSignatureRefresh() {
+        clearTimeout(this.uploadSignatureTimer);
+        if (!appState.data.uploads) return;
+        const delay = Math.max(appState.data.uploads.refresh_at * 1000 - Date.now(), 0);
+        this.uploadSignatureTimer = setTimeout(() => this.refreshUploadSignature(), delay);
+    },
+
+    async refreshUploadSignature() {
+        if (!clientState.token) return;
+        try {
+            const response = await fetch(`${API_URL}/api/uploads/signature`, {
+                headers: { 'Authorization': `Bearer ${clientState.token}` }
+            });
+            if (!response.ok) return;
+            appState.data.uploads = await response.json();
+            this.updateImagesTable();
+            this.updateScheduledPostsTable();
+            this.scheduleUploadSignatureRefresh();
+        } catch (error) {
+            console.warn('No se pudo renovar la firma de las imágenes:', error);
+        }
+    },
+
     // Actualizar interfaz con los datos
     updateUI() {
         this.updateStats();
@@ -389,6 +520,7 @@ const DataManager = {
                         ${(text.ai_tags || '').split(',').filter(tag => tag.trim()).map(tag => 
                             `<span class="tag">${tag.trim()}</span>`
                         ).join('')}
+                        ${['pending', 'tagging'].includes(text.tag_status) ? '<span class="tag tag-warning"><i class="fas fa-spinner fa-spin"></i> etiquetando</span>' : ''}
                     </td>
                     <td>
                         <span class="tag ${usageClass}">${usageCount}</span>
@@ -421,15 +553,17 @@ const DataManager = {
             if (usageCount >= 7 && usageCount < 10) usageClass = 'tag-warning';
             else if (usageCount >= 10) usageClass = 'tag-danger';
 
-            // Construye la URL completa de la imagen en el servidor
-            const imageUrl = `${API_URL}/uploads/client_${clientState.id}/${image.path.split(/[\\/]/).pop()}`;
+            // Construye la URL completa de la imagen en el servidor (la tabla muestra la miniatura si existe)
+            const imageUrl = Utils.uploadUrl(image.path.split(/[\\/]/).pop());
+            const previewUrl = image.thumb_path ? Utils.uploadUrl(image.thumb_path) : imageUrl;
 
             return `
                 <tr>
                     <td>${image.id}</td>
                     <td>
                         <img 
-                            src="${imageUrl}" 
+                            src="${previewUrl}" 
+                            loading="lazy"
                             class="image-preview" 
                             style="cursor: pointer;"
                             onclick="UIManager.showImageModal('${imageUrl}')"
@@ -516,7 +650,7 @@ const DataManager = {
         tbody.innerHTML = appState.data.scheduled_posts.map(post => {
             let statusClass = 'tag-warning';
             if (post.status === 'completed') statusClass = 'tag-success';
-            else if (post.status === 'failed') statusClass = 'tag-danger';
+            else if (post.status === 'failed' || post.status === 'expired') statusClass = 'tag-danger';
             
             return `
                 <tr>
@@ -525,7 +659,7 @@ const DataManager = {
                     <td style="max-width: 250px; word-wrap: break-word;">${Utils.truncateText(post.text_content)}</td>
                     <td>
                         ${post.image_path ? 
-                            `<img src="${API_URL}/uploads/client_${clientState.id}/${post.image_path.split(/[\\/]/).pop()}" class="image-preview" onerror="this.style.display='none'">` : 
+                            `<img src="${Utils.uploadUrl(post.image_path.split(/[\\/]/).pop())}" loading="lazy" class="image-preview" onerror="this.style.display='none'">` : 
                             'Sin imagen'
                         }
                     </td>
@@ -587,8 +721,9 @@ const DataManager = {
             Utils.showLoading(true);
             const result = await apiRequest(`/api/items/${type}/${id}`, 'DELETE');
             
-            // Recargamos todos los datos para mantener la consistencia
-            await this.loadInitialData(); 
+            // Quitamos el elemento localmente en lugar de recargar todos los datos
+            this.applyMutation(type, result);
+            this.updateUI();
             
             Utils.showNotification('Elemento eliminado', result.msg || "El elemento fue eliminado.", 'success');
 
@@ -640,6 +775,32 @@ const DataManager = {
                 </tr>
             `;
         }).join('');
+
+        if (appState.data.publication_log_cursor) {
+            tbody.innerHTML += `
+                <tr>
+                    <td colspan="5" style="text-align: center;">
+                        <button class="btn btn-sm btn-secondary" onclick="DataManager.loadMoreHistory()">Cargar más</button>
+                    </td>
+                </tr>
+            `;
+        }
+    },
+
+    // Siguiente página del historial (paginación por cursor)
+    async loadMoreHistory() {
+        try {
+            Utils.showLoading(true);
+            const cursor = encodeURIComponent(appState.data.publication_log_cursor);
+            const page = await apiRequest(`/api/publication_log?before=${cursor}`, 'GET');
+            appState.data.publication_log = appState.data.publication_log.concat(page.items);
+            appState.data.publication_log_cursor = page.next_cursor;
+            this.updateHistoryTable();
+        } catch (error) {
+            Utils.showNotification('Error', `No se pudo cargar el historial: ${error.message}`, 'error');
+        } finally {
+            Utils.showLoading(false);
+        }
     },
 };
 
@@ -660,8 +821,8 @@ const ContentManager = {
 
         try {
             Utils.showLoading(true);
-            const updatedTexts = await apiRequest('/api/texts', 'POST', { content: content });
-            appState.data.texts = updatedTexts;
+            const result = await apiRequest('/api/texts', 'POST', { content: content });
+            DataManager.applyMutation('texts', result);
             DataManager.updateTextsTable();
             DataManager.updateStats();
             document.getElementById('manual-text-input').value = '';
@@ -686,12 +847,12 @@ const ContentManager = {
 
         try {
             Utils.showLoading(true);
-            const updatedTexts = await apiRequest('/api/texts/generate-ai', 'POST', { topic: topic, count: count });
-            appState.data.texts = updatedTexts;
+            const result = await apiRequest('/api/texts/generate-ai', 'POST', { topic: topic, count: count });
+            DataManager.applyMutation('texts', result);
             DataManager.updateTextsTable();
             DataManager.updateStats();
             document.getElementById('ai-topic-input').value = '';
-            Utils.showNotification('Éxito', `Se generaron y añadieron ${count} textos con IA.`, 'success');
+            Utils.showNotification('Éxito', `Se generaron y añadieron ${result.items.length} textos con IA.`, 'success');
         } catch (error) {
             console.error('Error generando textos con IA:', error);
             Utils.showNotification('Error', `No se pudieron generar los textos: ${error.message}`, 'error');
@@ -723,8 +884,8 @@ const ContentManager = {
 
         try {
             Utils.showLoading(true);
-            const updatedImages = await apiRequest('/api/images/upload', 'POST', formData);
-            appState.data.images = updatedImages;
+            const result = await apiRequest('/api/images/upload', 'POST', formData);
+            DataManager.applyMutation('images', result);
             DataManager.updateImagesTable();
             DataManager.updateStats();
             DataManager.updateSelects();
@@ -755,8 +916,8 @@ const DestinationManager = {
         try {
             Utils.showLoading(true);
             // CORRECCIÓN: Apunta al endpoint correcto /api/groups
-            const updatedData = await apiRequest('/api/groups', 'POST', { url, tags });
-            appState.data.groups = updatedData;
+            const result = await apiRequest('/api/groups', 'POST', { url, tags });
+            DataManager.applyMutation('groups', result);
             DataManager.updateGroupsTable(); DataManager.updateStats();
             document.getElementById('group-url-input').value = '';
             document.getElementById('group-tags-single-input').value = '';
@@ -774,12 +935,12 @@ const DestinationManager = {
         try {
             Utils.showLoading(true);
             // CORRECCIÓN: Apunta al endpoint correcto /api/groups/bulk
-            const updatedData = await apiRequest('/api/groups/bulk', 'POST', { urls, tags });
-            appState.data.groups = updatedData;
-            DataManager.updateGroupsTable(); DataManager.updateStats();
+            const result = await apiRequest('/api/groups/bulk', 'POST', { urls, tags });
+            // Los grupos nuevos llegan con la sincronización incremental
+            await DataManager.loadInitialData();
             document.getElementById('bulk-groups-input').value = '';
             document.getElementById('bulk-tags-input').value = '';
-            Utils.showNotification('Éxito', 'Grupos importados.', 'success');
+            Utils.showNotification('Éxito', `${result.inserted} grupos importados (${result.duplicates} duplicados, ${result.invalid} no válidos).`, 'success');
         } catch (error) { Utils.showNotification('Error', `Error al importar: ${error.message}`, 'error'); }
         finally { Utils.showLoading(false); }
     },
@@ -792,8 +953,8 @@ const DestinationManager = {
         try {
             Utils.showLoading(true);
             // CORRECCIÓN: Apunta al endpoint correcto /api/pages
-            const updatedData = await apiRequest('/api/pages', 'POST', { name, page_url });
-            appState.data.pages = updatedData;
+            const result = await apiRequest('/api/pages', 'POST', { name, page_url });
+            DataManager.applyMutation('pages', result);
             DataManager.updatePagesTable(); DataManager.updateStats(); DataManager.updateSelects();
             document.getElementById('page-name-input').value = '';
             document.getElementById('page-url-input').value = '';
@@ -845,8 +1006,8 @@ const SchedulerManager = {
         try {
             Utils.showLoading(true);
             // CORRECCIÓN: Apunta al endpoint correcto /api/scheduled_posts
-            const updatedData = await apiRequest('/api/scheduled_posts', 'POST', data);
-            appState.data.scheduled_posts = updatedData;
+            const result = await apiRequest('/api/scheduled_posts', 'POST', data);
+            DataManager.applyMutation('scheduled_posts', result);
             DataManager.updateScheduledPostsTable(); DataManager.updateStats();
             document.getElementById('schedule-page-select').value = '';
             document.getElementById('schedule-datetime').value = '';
@@ -902,6 +1063,9 @@ const GroupPublishingManager = {
 
 // Manejo de logs
 const LogManager = {
+    MAX_LINES: 1000,
+    lastSeqs: {},  // Último seq recibido de cada proceso del servidor (origin -> seq)
+
     // Limpiar logs
     clearLogs() {
         const logPanel = document.getElementById('log-panel');
@@ -916,6 +1080,32 @@ const LogManager = {
         logEntry.textContent = message;
         logPanel.appendChild(logEntry);
         logPanel.scrollTop = logPanel.scrollHeight;
+    },
+
+    // Añadir un lote de logs del servidor ({origin, seq, data, type}) de una sola vez.
+    // El seq solo crece dentro de cada proceso, así que se compara con el último de su mismo origen.
+    addLogs(lines) {
+        const seen = { ...this.lastSeqs };
+        const fresh = (lines || []).filter(line => line.seq > (seen[line.origin] || 0));
+        if (!fresh.length) return;
+        for (const line of fresh) {
+            this.lastSeqs[line.origin] = Math.max(this.lastSeqs[line.origin] || 0, line.seq);
+        }
+
+        const logPanel = document.getElementById('log-panel');
+        const fragment = document.createDocumentFragment();
+        for (const line of fresh) {
+            const logEntry = document.createElement('p');
+            logEntry.className = `log-${line.type}`;
+            logEntry.textContent = line.data;
+            fragment.appendChild(logEntry);
+        }
+        logPanel.appendChild(fragment);
+        // El panel conserva solo las últimas MAX_LINES líneas
+        while (logPanel.childElementCount > this.MAX_LINES) {
+            logPanel.firstElementChild.remove();
+        }
+        logPanel.scrollTop = logPanel.scrollHeight;
     }
 };
 
@@ -1059,8 +1249,8 @@ const UIManager = {
         }
         try {
             Utils.showLoading(true);
-            const updatedTexts = await apiRequest(`/api/texts/${id}`, 'PUT', { content: newContent });
-            appState.data.texts = updatedTexts;
+            const result = await apiRequest(`/api/texts/${id}`, 'PUT', { content: newContent });
+            DataManager.applyMutation('texts', result);
             DataManager.updateTextsTable();
             UIManager.closeModal();
             Utils.showNotification('Texto actualizado', 'El texto se actualizó correctamente.', 'success');
@@ -5,39 +5,57 @@ import time
 import threading
 import uuid
 import shutil
-from datetime import datetime, timedelta, date
-from queue import Queue
+import glob
+from datetime import datetime, timedelta, date, timezone
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 import traceback
 # ... otras importaciones
 # main.py
 import subprocess
 import secrets
 import atexit
+import signal
+import sys
+import io
+import csv
+import json
+import hashlib
+import mimetypes
 # ... (resto de tus importaciones como os, random, time, etc.)
 
 # --- Módulos del Proyecto ---
 # Asegúrate de tener tu nuevo database.py para MariaDB y ai_services.py
-from database import db_manager
+from database import db_manager, normalize_tags, tag_match_clause, SYNC_TABLES, TAG_LINKS
 from ai_services import ai_service
+from tag_cache import tag_cache
+from content_selector import ContentSelector
+from browser_scheduler import browser_scheduler
+from browser_pool import browser_pool
+from post_scheduler import PostScheduler
+from jobs import create_job_queue
+from tagging import TaggingPipeline
+from quota import quota_manager
+from image_pipeline import save_upload, promote_upload, thumbnail_pool
+from uploads import UploadSigner, upload_etags
+from text_input import text_injector
+from selector_engine import selector_engine
+from campaigns import campaign_planner
+from log_stream import LogStreamer
 
 # --- Utilidades y Seguridad ---
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.utils import safe_join
 
 # --- Framework Web y Autenticación ---
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_file, make_response, Response, stream_with_context
 from flask_cors import CORS
-from flask_socketio import SocketIO, join_room, disconnect
-from flask_jwt_extended import create_access_token, get_jwt, jwt_required, JWTManager, decode_token
+from flask_socketio import SocketIO, join_room, disconnect, emit
+from flask_jwt_extended import create_access_token, get_jwt, jwt_required, JWTManager, decode_token, get_current_user
 
 # --- Lógica de Automatización (Selenium) ---
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import WebDriverException, TimeoutException
 
 # --- Carga de variables de entorno ---
@@ -49,7 +67,7 @@ load_dotenv()
 # ==============================================================================
 
 app = Flask(__name__)
-CORS(app) # Permite peticiones desde tu frontend en Github Pages
+CORS(app, expose_headers=['ETag']) # Permite peticiones desde tu frontend en Github Pages (ETag: sincronización incremental)
 
 # --- Configuración de Seguridad y JWT ---
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "una-clave-muy-secreta-y-dificil-de-adivinar")
@@ -70,6 +88,8 @@ def user_lookup_callback(_jwt_header, jwt_data):
     Esta función se llama en cada petición protegida.
     'sub' contiene la identidad (el client_id) del token.
     Devuelve el objeto de usuario si se encuentra en la BD, o None si no.
+    flask_jwt_extended guarda el resultado durante la petición (get_current_user), y la fila
+    sale de la caché de clientes de db_manager, así que no hay una consulta por petición.
     """
     identity = jwt_data.get("sub")
     if not identity:
@@ -78,47 +98,126 @@ def user_lookup_callback(_jwt_header, jwt_data):
         identity = int(identity)
     except (TypeError, ValueError):
         return None
-    return db_manager.fetch_one("SELECT * FROM clients WHERE id = %s", (identity,))
+    return db_manager.get_client(identity)
 
 # --- Configuración de Archivos y Workers ---
 app.config['UPLOAD_FOLDER'] = os.path.abspath('client_uploads')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-# Límite de navegadores simultáneos para una VM de 4GB. Ajustable.
-MAX_CONCURRENT_BROWSERS = 3
-job_queue = Queue()
+# Envío de /uploads: 'flask' (por defecto), 'x-accel' (Nginx) o 'x-sendfile' (Apache, lighttpd).
+UPLOAD_SERVE_MODE = os.getenv("UPLOAD_SERVE_MODE", "flask").lower()
+UPLOAD_ACCEL_PREFIX = os.getenv("UPLOAD_ACCEL_PREFIX", "/protected-uploads").rstrip('/')
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", 31536000))
+app.config['USE_X_SENDFILE'] = UPLOAD_SERVE_MODE == 'x-sendfile'
+upload_signer = UploadSigner(os.getenv("UPLOAD_URL_SECRET") or app.config["JWT_SECRET_KEY"])
+# Hilos que procesan la cola. No limitan los navegadores: eso lo decide browser_scheduler
+# según la RAM/CPU libres, así que puede haber más hilos que Chrome abiertos.
+MAX_WORKER_THREADS = int(os.getenv("MAX_WORKER_THREADS", 16))
+# Pausas entre publicaciones a partir de las cuales se cierra el navegador y se libera su ranura.
+BROWSER_HIBERNATE_AFTER_SECONDS = int(os.getenv("BROWSER_HIBERNATE_AFTER_SECONDS", 45))
+# XPaths de cada paso de la publicación en Facebook, con sus alternativas según idioma/diseño.
+# selector_engine los sondea todos a la vez y prueba primero el que funcionó la última vez.
+FACEBOOK_SELECTORS = {
+    "open_composer": [
+        '//div[contains(@aria-label, "Crear una publicación")]',
+        '//*[contains(text(), "Escribe algo")]',
+        '//div[contains(@role, "button") and contains(text(), "Escribe algo")]',
+        '//div[contains(@aria-label, "¿En qué estás pensando")]',
+    ],
+    "image_preview": ["//div[contains(@aria-label, 'foto')]", "//img[contains(@src, 'blob:')]"],
+    "publish": ["//div[@aria-label='Publicar' and @role='button']"],
+    "view_post": ["//a[.//span[contains(text(), 'Ver publicación')]]"],
+    "dialog": ["//div[@role='dialog']"],
+}
+# Cola de trabajos: persistente en la tabla `jobs` por defecto (JOB_QUEUE_BACKEND=memory para desarrollo).
+job_queue = create_job_queue()
+# Qué arranca este proceso: 'all' (API + workers), 'web' (solo API) o 'worker' (solo workers).
+# Con la cola persistente se pueden levantar varios procesos 'worker' en uno o más nodos.
+APP_ROLE = os.getenv("APP_ROLE", "all")
+# Modo del servidor web: 'threading' (python main.py, un hilo por conexión) o 'eventlet'/'gevent'
+# (python server.py, E/S cooperativa para miles de paneles conectados).
+SERVER_MODE = os.getenv("SERVER_MODE", "threading").lower()
 
 # --- Planes de Suscripción (Configuración Central) ---
+# `parallel_browsers`: navegadores que puede usar a la vez una campaña de grupos del cliente.
 PLANS = {
-    'free': {'limit': 50, 'price': 0, 'name': 'Prueba Gratuita'},
-    'basic': {'limit': 500, 'price': 10, 'name': 'Plan Básico'},
-    'pro': {'limit': 1000, 'price': 15, 'name': 'Plan Profesional'},
-    'unlimited': {'limit': float('inf'), 'price': 50, 'name': 'Plan Ilimitado'}
+    'free': {'limit': 50, 'price': 0, 'name': 'Prueba Gratuita', 'parallel_browsers': 1},
+    'basic': {'limit': 500, 'price': 10, 'name': 'Plan Básico', 'parallel_browsers': 1},
+    'pro': {'limit': 1000, 'price': 15, 'name': 'Plan Profesional', 'parallel_browsers': 2},
+    'unlimited': {'limit': float('inf'), 'price': 50, 'name': 'Plan Ilimitado', 'parallel_browsers': 3}
 }
 
 # --- WebSockets para Logs en Tiempo Real ---
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Con varios procesos, SOCKETIO_MESSAGE_QUEUE (p. ej. redis://...) reparte los eventos emitidos por los
+# workers a los clientes conectados a cualquier proceso web.
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SERVER_MODE, message_queue=os.getenv("SOCKETIO_MESSAGE_QUEUE"))
+# Los logs del panel se envían en lotes por sala (evento 'log_batch') y se guardan los recientes para reenviarlos.
+# Con procesos web y worker separados, LOG_HISTORY_BACKEND=database guarda el historial en la BD para que el web
+# reenvíe también lo que escriben los workers; por defecto cada proceso guarda en memoria solo sus líneas.
+LOG_HISTORY_BACKEND = os.getenv("LOG_HISTORY_BACKEND", "memory").lower()
+log_streamer = LogStreamer(socketio, shared_history=LOG_HISTORY_BACKEND == 'database')
+atexit.register(log_streamer.flush)
 
 
 # ==============================================================================
 # --- LÓGICA DE AUTOMATIZACIÓN Y GESTIÓN DE INSTANCIAS ---
 # ==============================================================================
 
+def client_profile_path(client_id, shard=0):
+    """Perfil de Chrome de un cliente. Los navegadores paralelos de una campaña (shard > 0) usan copias."""
+    return os.path.abspath(f'profiles/client_{client_id}' + (f'_{shard}' if shard else ''))
+
+class BrowserSession:
+    """Navegador de un trabajo: su ranura del planificador y la instancia sacada del pool."""
+    def __init__(self, slot):
+        self.slot = slot
+        self.pooled_browser = None
+        self.driver = None
+
 class AppLogic:
-    """Contiene toda la lógica de automatización para UN SOLO cliente."""
-    def __init__(self, client_id, socket_io_instance):
+    """
+    Contiene toda la lógica de automatización para UN SOLO cliente y uno de sus navegadores:
+    `shard` 0 es el perfil principal; los demás son los navegadores paralelos de una campaña.
+    """
+    def __init__(self, client_id, socket_io_instance, shard=0):
         self.client_id = client_id
         self.socketio = socket_io_instance
-        self.driver = None
+        self.shard = shard
+        self.browser_lock = threading.Lock()
         self.is_publishing = False
-        self.profile_path = os.path.abspath(f'profiles/client_{self.client_id}')
+        self.profile_path = client_profile_path(client_id, shard)
+
+    def prepare_profile(self):
+        """
+        Crea el perfil de Chrome si aún no existe; el de un navegador paralelo se copia del principal.
+        Se llama al empezar cada trabajo (acquire_browser), nunca bajo el candado de InstanceManager
+        ni en una petición HTTP: copiar un perfil completo tarda.
+        """
+        if self.shard and not os.path.isdir(self.profile_path):
+            self._seed_profile()
         os.makedirs(self.profile_path, exist_ok=True)
 
+    def _seed_profile(self):
+        """Copia el perfil principal (con la sesión de Facebook iniciada) para un navegador paralelo."""
+        source = client_profile_path(self.client_id)
+        if not os.path.isdir(source):
+            return
+        self.log_to_panel("Preparando el perfil de Chrome de este navegador (copia del principal)...")
+        # Se copia a un directorio temporal y se renombra: una copia a medias nunca pasa por perfil válido.
+        staging = f"{self.profile_path}.tmp"
+        try:
+            shutil.rmtree(staging, ignore_errors=True)
+            shutil.copytree(source, staging, ignore=shutil.ignore_patterns('Singleton*', '*Cache*', 'lockfile'))
+            os.replace(staging, self.profile_path)
+        except Exception as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            print(f"⚠️ No se pudo copiar el perfil de Chrome del cliente {self.client_id} para el navegador {self.shard + 1}: {e}")
+
     def log_to_panel(self, message, log_type='info'):
         """Envía un mensaje de log al frontend a través de WebSockets a la sala del cliente."""
         timestamp = time.strftime('%H:%M:%S')
-        formatted_message = f"[{timestamp}] {message}"
-        self.socketio.emit('log_message', {'data': formatted_message, 'type': log_type}, room=self.client_id)
-        print(f"[Cliente {self.client_id}] {formatted_message}")
+        formatted_message = f"[{timestamp}] {f'[Navegador {self.shard + 1}] ' if self.shard else ''}{message}"
+        # El envío (y la copia en stdout) se agrupa con las demás líneas de la sala; ver LogStreamer.
+        log_streamer.publish(self.client_id, formatted_message, log_type)
 
     def get_chrome_options(self, headless=True):
         """Genera las opciones de Chrome, permitiendo modo no-headless para login."""
@@ -136,27 +235,95 @@ class AppLogic:
         options.add_argument(f"user-data-dir={self.profile_path}")
         return options
 
-    def init_browser(self, headless=True):
-        """Inicia una instancia de navegador para este cliente."""
+    def init_browser(self, session, headless=True):
+        """Obtiene del pool una instancia de navegador para el perfil de este cliente."""
         try:
             self.log_to_panel("Configurando instancia de Chrome...")
-            service = ChromeService(ChromeDriverManager().install())
-            self.driver = webdriver.Chrome(service=service, options=self.get_chrome_options(headless=headless))
-            self.log_to_panel("Navegador iniciado y listo.")
+            session.pooled_browser = browser_pool.checkout(self.profile_path, self.get_chrome_options(headless=headless), headless)
+            session.driver = session.pooled_browser.driver
+            if session.pooled_browser.reused:
+                self.log_to_panel("Navegador reutilizado del pool y listo.")
+            else:
+                self.log_to_panel("Navegador iniciado y listo.")
             return True
         except Exception as e:
             self.log_to_panel(f"Error crítico al iniciar Chrome: {e}", "error")
             return False
 
-    def close_browser(self):
-        """Cierra la instancia del navegador si está abierta."""
-        if self.driver:
+    def close_browser(self, session):
+        """Devuelve el navegador al pool, que lo mantiene listo o lo cierra si le toca reciclarse."""
+        if session.driver:
             try:
-                self.driver.quit()
+                browser_pool.checkin(session.pooled_browser)
             finally:
-                self.driver = None
-                self.log_to_panel("Instancia del navegador cerrada.")
+                session.driver = None
+                session.pooled_browser = None
+                self.log_to_panel("Instancia del navegador liberada.")
     
+    def acquire_browser(self, headless=True, cancelled=None):
+        """
+        Espera una ranura de navegador libre (según RAM/CPU) y abre Chrome en ella.
+        El perfil de Chrome del cliente solo lo usa un trabajo a la vez (browser_lock): una publicación
+        programada entra mientras la campaña de grupos hiberna entre publicaciones.
+        Args:
+            cancelled (callable): Abandona la espera si devuelve True. Por defecto, al detener la publicación en grupos.
+        Returns:
+            BrowserSession: El navegador del trabajo (liberarlo con release_browser), o None si no se obtuvo.
+        """
+        cancelled = cancelled or (lambda: not self.is_publishing)
+        while not self.browser_lock.acquire(timeout=1):
+            if cancelled():
+                return None
+        try:
+            self.prepare_profile()
+        except Exception:
+            self.browser_lock.release()
+            raise
+        slots = browser_scheduler.status()
+        if slots["in_use"] >= slots["capacity"]:
+            self.log_to_panel("Esperando a que haya un navegador disponible en el servidor...")
+        slot = browser_scheduler.acquire(self.client_id, cancelled=cancelled)
+        if slot is None:
+            self.browser_lock.release()
+            return None
+        session = BrowserSession(slot)
+        if self.init_browser(session, headless=headless):
+            return session
+        self.release_browser(session)
+        return None
+
+    def release_browser(self, session):
+        """Cierra Chrome y devuelve la ranura para que otro trabajo pueda usarla."""
+        if session is None or session.slot is None:
+            return
+        try:
+            self.close_browser(session)
+        finally:
+            browser_scheduler.release(session.slot)
+            session.slot = None
+            self.browser_lock.release()
+
+    def _pause_between_posts(self, session, wait_time):
+        """
+        Espera entre publicaciones. Si la pausa es larga, el navegador hiberna: vuelve al pool y su ranura
+        queda libre para otros clientes; al terminar la pausa se pide otra y se recupera del pool
+        (o se relanza si el pool lo cerró para liberar memoria).
+        Returns:
+            BrowserSession: El navegador con el que seguir, o None si el proceso se detuvo o no se pudo reabrir.
+        """
+        if wait_time < BROWSER_HIBERNATE_AFTER_SECONDS:
+            time.sleep(wait_time)
+            return session
+
+        self.release_browser(session)
+        deadline = time.monotonic() + wait_time
+        # Se duerme en tramos cortos para responder rápido a una detención.
+        while self.is_publishing and time.monotonic() < deadline:
+            time.sleep(min(1, deadline - time.monotonic()))
+        if not self.is_publishing:
+            return None
+        return self.acquire_browser()
+
     # --- LÓGICA DE SELENIUM PORTADA DEL SCRIPT ORIGINAL ---
     # Se mantienen los XPaths y la robusta lógica de reintentos.
 
@@ -174,11 +341,18 @@ class AppLogic:
             self.log_to_panel(f"⚠️ Error validando imagen: {e}", "warning")
             return {"valid": False, "path": image_path, "error": str(e)}
 
-    def _create_post_on_facebook(self, text_content, image_path=None, max_retries=3):
+    def _resolve_image_path(self, image_path):
+        """Las imágenes se guardan solo con su nombre de archivo: devuelve su ruta en la carpeta del cliente."""
+        if not image_path:
+            return None
+        return os.path.join(app.config['UPLOAD_FOLDER'], f'client_{self.client_id}', os.path.basename(image_path))
+
+    def _create_post_on_facebook(self, driver, text_content, image_path=None, max_retries=3, image_checked=False):
         """
         Crea una publicación en Facebook. MANTIENE LOS XPATH ORIGINALES para máxima compatibilidad.
+        Con image_checked=True la ruta de la imagen ya viene validada (ver _prepare_pair).
         """
-        image_validation = self._validate_image_path(image_path)
+        image_validation = {"valid": True, "path": image_path} if image_checked else self._validate_image_path(image_path)
         if not image_validation["valid"]:
             self.log_to_panel(f"IMAGEN INVÁLIDA: {image_validation['error']}. Publicando solo texto.", "warning")
             image_path = None
@@ -189,50 +363,43 @@ class AppLogic:
             try:
                 # 1. Abrir el modal de publicación con varios selectores de respaldo
                 self.log_to_panel(f"Intento {attempt + 1}: Abriendo cuadro de publicación...")
-                open_button_selectors = [
-                    '//div[contains(@aria-label, "Crear una publicación")]',
-                    '//*[contains(text(), "Escribe algo")]',
-                    '//div[contains(@role, "button") and contains(text(), "Escribe algo")]',
-                    '//div[contains(@aria-label, "¿En qué estás pensando")]'
-                ]
-                open_button = None
-                for selector in open_button_selectors:
-                    try:
-                        open_button = WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((By.XPATH, selector)))
-                        if open_button: break
-                    except TimeoutException: continue
-                
-                if not open_button: raise Exception("No se encontró el botón/cuadro para crear una publicación.")
+                try:
+                    open_button = selector_engine.find(driver, "open_composer", FACEBOOK_SELECTORS["open_composer"])
+                except TimeoutException:
+                    raise Exception("No se encontró el botón/cuadro para crear una publicación.")
                 open_button.click()
-                time.sleep(random.uniform(2, 4))
 
-                # 2. Escribir el texto de forma humanizada
+                # 2. Escribir el texto (humanizado, por ráfagas o de una vez según POST_INPUT_MODE)
+                #    en cuanto el cuadro de texto del modal tiene el foco.
                 self.log_to_panel("Escribiendo contenido...")
-                post_box = self.driver.switch_to.active_element
-                for char in text_content:
-                    post_box.send_keys(char)
-                    time.sleep(random.uniform(0.05, 0.1))
+                try:
+                    post_box = selector_engine.wait_focused_textbox(driver)
+                except TimeoutException:
+                    post_box = driver.switch_to.active_element
+                typing_started = time.monotonic()
+                input_mode = text_injector.type_text(driver, post_box, text_content)
+                self.log_to_panel(f"Contenido escrito en {time.monotonic() - typing_started:.1f}s (modo {input_mode}).")
                 
                 # 3. Subir imagen si existe
                 if image_path:
                     self.log_to_panel(f"Subiendo imagen: {os.path.basename(image_path)}")
                     # Facebook oculta el input, por lo que es necesario encontrarlo sin importar su visibilidad
-                    file_input = self.driver.find_element(By.XPATH, "//input[@type='file']")
+                    file_input = driver.find_element(By.XPATH, "//input[@type='file']")
                     file_input.send_keys(image_path)
                     # Esperar a que la miniatura de la imagen aparezca como confirmación de subida
-                    WebDriverWait(self.driver, 45).until(EC.presence_of_element_located((By.XPATH, "//div[contains(@aria-label, 'foto')] | //img[contains(@src, 'blob:')]")))
+                    selector_engine.find(driver, "image_preview", FACEBOOK_SELECTORS["image_preview"], clickable=False, timeout=45)
                     self.log_to_panel("Imagen subida correctamente.")
 
                 # 4. Publicar
                 self.log_to_panel("Buscando botón de Publicar...")
-                publish_button = WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//div[@aria-label='Publicar' and @role='button']")))
+                publish_button = selector_engine.find(driver, "publish", FACEBOOK_SELECTORS["publish"])
                 publish_button.click()
                 self.log_to_panel("Publicación enviada.")
                 
                 # 5. Intentar obtener la URL de la publicación para el log
                 post_url = None
                 try:
-                    view_post_button = WebDriverWait(self.driver, 15).until(EC.element_to_be_clickable((By.XPATH, "//a[.//span[contains(text(), 'Ver publicación')]]")))
+                    view_post_button = selector_engine.find(driver, "view_post", FACEBOOK_SELECTORS["view_post"], timeout=15)
                     post_url = view_post_button.get_attribute('href')
                     self.log_to_panel(f"URL de publicación obtenida: {post_url}")
                 except TimeoutException:
@@ -244,165 +411,272 @@ class AppLogic:
                 self.log_to_panel(f"Error en intento de publicación {attempt + 1}/{max_retries}: {e}", "error")
                 if attempt == max_retries - 1:
                     return {"success": False, "error": str(e)}
-                time.sleep(5) # Esperar antes de reintentar
+                # Antes de reintentar, espera (como mucho 5 s) a que se cierre el modal que quedara abierto
+                selector_engine.wait_absent(driver, FACEBOOK_SELECTORS["dialog"], timeout=5)
         return {"success": False, "error": "Fallaron todos los reintentos de publicación."}
     
 
-    def _find_coherent_pair_for_group(self, content_tags_str):
+    def _find_coherent_pair_for_group(self, selector):
         """
-        Encuentra un par de texto e imagen coherentes y menos usados para este cliente,
-        basado en una lista de etiquetas de contenido.
-        """
-        # 1. Limpiar y validar las etiquetas de entrada
-        content_tags = [tag.strip() for tag in content_tags_str.split(',') if tag.strip()]
-        if not content_tags:
-            self.log_to_panel("No se proporcionaron etiquetas de contenido válidas para la búsqueda.", "warning")
-            return None, None
-
-        self.log_to_panel(f"Buscando contenido con etiquetas: {', '.join(content_tags)}...")
-
-        # 2. Construir dinámicamente la parte de la query SQL para las etiquetas
-        #    Esto previene inyección SQL ya que los valores se pasan como parámetros.
-        #    Ejemplo: "ai_tags LIKE %s OR ai_tags LIKE %s"
-        tags_query_part = " OR ".join(["ai_tags LIKE %s" for _ in content_tags])
-    
-        # 3. Preparar los parámetros para la query. El formato %tag% busca la etiqueta en cualquier parte del string.
-        #    Ejemplo: ('%coche%', '%venta%')
-        params_like = tuple([f"%{tag}%" for tag in content_tags])
-     
-        # 4. Construir y ejecutar la query para encontrar el texto menos usado que coincida
-        text_query = f"""
-            SELECT * FROM texts 
-            WHERE client_id = %s AND ({tags_query_part})
-            ORDER BY usage_count ASC, RAND() 
-            LIMIT 1
+        Encuentra un par de texto e imagen coherentes y menos usados para este cliente.
+        La elección se hace en memoria con el ContentSelector cargado al inicio de la ejecución.
         """
-        text_params = (self.client_id,) + params_like
-        text = db_manager.fetch_one(text_query, text_params)
+        text, image, match = selector.pick_pair()
 
         if not text:
             self.log_to_panel("No se encontraron textos que coincidan con las etiquetas.", "warning")
             return None, None
 
-        # 5. Ahora, buscar una imagen coherente usando las etiquetas del texto encontrado.
-        #    Esto asegura una mayor coherencia. Usamos las etiquetas IA del texto.
-        image_tags_str = text.get('ai_tags', '')
-        image_tags = [tag.strip() for tag in image_tags_str.split(',') if tag.strip()]
-    
-        if not image_tags:
-            self.log_to_panel(f"El texto ID {text['id']} no tiene etiquetas IA para buscar una imagen. Buscando imagen aleatoria.", "warning")
-            # Plan B: Si el texto no tiene etiquetas, busca una imagen aleatoria.
-            image = db_manager.fetch_one("SELECT * FROM images WHERE client_id = %s ORDER BY RAND() LIMIT 1", (self.client_id,))
-        else:
-            image_tags_query_part = " OR ".join(["manual_tags LIKE %s" for _ in image_tags])
-            image_params_like = tuple([f"%{tag}%" for tag in image_tags])
-        
-            image_query = f"""
-                SELECT * FROM images 
-                WHERE client_id = %s AND ({image_tags_query_part})
-                ORDER BY RAND() 
-                LIMIT 1
-            """
-            image_params = (self.client_id,) + image_params_like
-            image = db_manager.fetch_one(image_query, image_params)
-
-        if not image:
-            self.log_to_panel("No se encontró una imagen coherente. Buscando cualquier imagen disponible como último recurso.", "warning")
-            # Plan C: Si no hay imagen coherente, busca CUALQUIER imagen del cliente.
-            image = db_manager.fetch_one("SELECT * FROM images WHERE client_id = %s ORDER BY RAND() LIMIT 1", (self.client_id,))
+        if match == 'any':
+            self.log_to_panel("No se encontró una imagen coherente. Usando la imagen menos usada disponible como último recurso.", "warning")
 
         if text and image:
             self.log_to_panel(f"Par de contenido encontrado: Texto ID {text['id']}, Imagen ID {image['id']}", "info")
             return text, image
-    
+
+        # Sin imagen, el texto reservado vuelve al selector para otro grupo.
+        selector.release(text['id'])
         self.log_to_panel("Fallo al encontrar un par de contenido válido (Texto o Imagen no disponibles).", "error")
         return None, None
 
-    def _group_publishing_process(self, group_tags, content_tags):
+    def _prepare_pair(self, selector):
         """
-        Proceso completo de publicación en grupos para este cliente.
+        Elige el par de contenido del próximo grupo y comprueba su imagen en disco. Se ejecuta en
+        segundo plano mientras el navegador publica en el grupo anterior.
+        Returns:
+            tuple: (texto, imagen, ruta absoluta de la imagen o None si no es válida); (None, None, None) sin contenido.
         """
+        text, image = self._find_coherent_pair_for_group(selector)
+        if not text or not image:
+            return None, None, None
+        image_validation = self._validate_image_path(self._resolve_image_path(image['path']))
+        if not image_validation["valid"]:
+            self.log_to_panel(f"IMAGEN INVÁLIDA: {image_validation['error']}. Se publicará solo texto.", "warning")
+        return text, image, image_validation["path"] if image_validation["valid"] else None
+
+    def _reserve_publication(self):
+        """Reserva una publicación del plan del cliente. Devuelve False si ya no le quedan este mes."""
+        client = db_manager.get_client(self.client_id)
+        plan_limit = PLANS.get(client['plan'], {}).get('limit', 0) if client else 0
+        return quota_manager.reserve(self.client_id, plan_limit)
+
+    def _group_publishing_process(self, campaign_id):
+        """
+        Publica en los grupos pendientes que le tocan a este navegador (shard) en una campaña
+        (ver campaigns.CampaignPlanner). Cada grupo queda marcado como hecho o fallido, así que si el
+        trabajo se reinicia continúa con los que faltan.
+        El trabajo de BD y disco va por delante del navegador en un hilo auxiliar: los grupos y el
+        contenido se cargan mientras arranca Chrome, y el par de cada grupo se prepara mientras se
+        publica en el anterior.
+        """
+        campaign = campaign_planner.get(campaign_id)
+        if not campaign or campaign['status'] != 'running':
+            return
         self.is_publishing = True
-        if not self.init_browser():
+        prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"prefetch_{self.client_id}_{self.shard}")
+        # Los candidatos de contenido se cargan una sola vez; cada grupo elige en memoria.
+        selector = ContentSelector(self.client_id, campaign['content_tags'])
+        groups_future = prefetcher.submit(campaign_planner.pending_targets, campaign_id, self.shard)
+        content_future = prefetcher.submit(selector.load) if selector.content_tags else None
+        browser = self.acquire_browser()
+        if browser is None:
+            prefetcher.shutdown(wait=False)
             self.is_publishing = False
-            self.socketio.emit('publishing_status', {'isPublishing': False}, room=self.client_id)
             return
 
         try:
-            # Consulta adaptada para multi-inquilino y sintaxis de MariaDB/MySQL
-            query_tags = [f"tags LIKE %s" for tag in group_tags.split(',')]
-            query = f"SELECT * FROM groups WHERE client_id = %s AND ({' OR '.join(query_tags)})"
-            params = (self.client_id,) + tuple([f"%{tag.strip()}%" for tag in group_tags.split(',')])
-            groups_to_publish = db_manager.fetch_all(query, params)
-            
-            self.log_to_panel(f"Publicación iniciada. {len(groups_to_publish)} grupos encontrados para las etiquetas seleccionadas.")
-            
+            groups_to_publish = groups_future.result()
+            self.log_to_panel(f"Publicación iniciada. {len(groups_to_publish)} grupos pendientes para este navegador.")
+
+            if content_future is None:
+                self.log_to_panel("No se proporcionaron etiquetas de contenido válidas para la búsqueda.", "warning")
+                return
+            self.log_to_panel(f"Buscando contenido con etiquetas: {', '.join(selector.content_tags)}...")
+            total_texts, total_images = content_future.result()
+            self.log_to_panel(f"{total_texts} textos y {total_images} imágenes disponibles para esta ejecución.")
+
+            next_pair = prefetcher.submit(self._prepare_pair, selector) if groups_to_publish else None
             for i, group in enumerate(groups_to_publish):
                 if not self.is_publishing:
                     self.log_to_panel("Proceso detenido por el usuario.", "warning")
                     break
                 
                 self.log_to_panel(f"--- ({i+1}/{len(groups_to_publish)}) Procesando grupo: {group['url']} ---")
-                text, image = self._find_coherent_pair_for_group(content_tags)
+                text, image, image_path = next_pair.result()
+                # El par del siguiente grupo se prepara mientras el navegador trabaja en este.
+                next_pair = prefetcher.submit(self._prepare_pair, selector) if i < len(groups_to_publish) - 1 else None
                 
                 if not text or not image:
                     self.log_to_panel("No se encontró un par de contenido coherente y disponible. Saltando grupo.", "warning")
                     time.sleep(random.uniform(5, 10))
                     continue
 
+                if not self._reserve_publication():
+                    selector.release(text['id'])
+                    self.log_to_panel("Has alcanzado el límite de publicaciones de tu plan para este mes.", "warning")
+                    break
+
+                # Se marca antes de publicar: si el proceso cae a mitad, al reanudar no se repite.
+                campaign_planner.mark_target(campaign_id, group['id'], 'posting')
+                published = False
+                error = None
                 try:
-                    self.driver.get(group['url'])
-                    time.sleep(random.uniform(5, 8))
+                    browser.driver.get(group['url'])
+                    selector_engine.wait_page_ready(browser.driver)
                     
-                    result = self._create_post_on_facebook(text['content'], image['path'])
+                    result = self._create_post_on_facebook(browser.driver, text['content'], image_path, image_checked=True)
                     
-                    # Registrar en el log de publicaciones
-                    db_manager.execute_query(
-                        """INSERT INTO publication_log (client_id, timestamp, status, target_type, target_url, text_content, image_path, published_post_url, error_details)
-                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                    # Registrar la publicación: log y contadores se escriben juntos en diferido
+                    db_manager.record_publication(
+                        self.client_id,
                         (self.client_id, datetime.utcnow(), 'Success' if result['success'] else 'Failed', 'group', group['url'], text['content'], image['path'], result.get('post_url'), None if result['success'] else result.get('error')),
-                        commit=True
+                        result['success'], text_id=text['id']
                     )
 
+                    published = result['success']
                     if result['success']:
+                        selector.mark_used(text['id'])
                         self.log_to_panel(f"✅ Publicación exitosa en {group['url']}", 'success')
-                        # Incrementar contadores de uso
-                        db_manager.execute_query("UPDATE texts SET usage_count = usage_count + 1 WHERE id = %s AND client_id = %s", (text['id'], self.client_id), commit=True)
-                        # Incrementar contador de publicaciones del mes si fue exitosa
-                        db_manager.execute_query(
-                            "UPDATE clients SET publications_this_month = publications_this_month + 1 WHERE id = %s",
-                            (self.client_id,), commit=True
-                        )
                     else:
+                        error = result.get('error')
+                        selector.release(text['id'])
                         self.log_to_panel(f"❌ Falló la publicación en {group['url']}: {result.get('error')}", "error")
 
                 except Exception as e:
+                    error = str(e)
+                    selector.release(text['id'])
                     self.log_to_panel(f"❌ Error inesperado procesando el grupo {group['url']}: {e}", "error")
-
-                # Pausa entre publicaciones
+                finally:
+                    # Las publicaciones fallidas no consumen plan.
+                    if not published:
+                        quota_manager.refund(self.client_id)
+                    prefetcher.submit(campaign_planner.mark_target, campaign_id, group['id'], 'done' if published else 'failed', error)
+
+                # Pausa entre publicaciones (el navegador hiberna si es larga)
+                if i == len(groups_to_publish) - 1:
+                    break
                 wait_time = random.randint(60, 120)
                 self.log_to_panel(f"Esperando {wait_time} segundos antes del siguiente grupo...")
-                time.sleep(wait_time)
+                browser = self._pause_between_posts(browser, wait_time)
+                if browser is None:
+                    if self.is_publishing:
+                        self.log_to_panel("No se pudo reabrir el navegador tras la pausa.", "error")
+                    break
 
         finally:
-            self.close_browser()
+            prefetcher.shutdown(wait=False)
+            self.release_browser(browser)
+            quota_manager.release(self.client_id)
+            db_manager.flush_publications()
             self.is_publishing = False
             self.log_to_panel("Proceso de publicación finalizado.")
-            self.socketio.emit('publishing_status', {'isPublishing': False}, room=self.client_id)
 
 
 
+    def _scheduled_post_process(self, scheduled_post_id):
+        """
+        Publica en una página una publicación programada ya reclamada por PostScheduler.
+        """
+        post = db_manager.fetch_one(
+            """SELECT sp.*, p.page_url, i.path AS image_path
+               FROM scheduled_posts sp
+               LEFT JOIN pages p ON p.id = sp.page_id
+               LEFT JOIN images i ON i.id = sp.image_id
+               WHERE sp.id = %s AND sp.client_id = %s""",
+            (scheduled_post_id, self.client_id)
+        )
+        if not post:
+            return
+        if post['status'] == 'processing' and datetime.utcnow() - post['publish_at'] > post_scheduler.max_lateness:
+            # El trabajo esperó en la cola más de lo tolerado: no se publica fuera de hora.
+            db_manager.execute_query(
+                "UPDATE scheduled_posts SET status = 'expired' WHERE id = %s AND status = 'processing'",
+                (scheduled_post_id,), commit=True
+            )
+            self.log_to_panel(f"⚠️ Publicación programada {scheduled_post_id} caducada mientras esperaba un worker.", "warning")
+            return
+        if post['status'] == 'publishing':
+            # Reintento tras una caída a mitad de publicación: puede que ya se publicara, así que no se repite.
+            db_manager.execute_query(
+                "UPDATE scheduled_posts SET status = 'failed', error_details = %s WHERE id = %s AND status = 'publishing'",
+                ("Interrumpida durante la publicación; no se reintenta para no duplicarla.", scheduled_post_id), commit=True
+            )
+            return
+        # Solo un trabajo pasa de 'processing' a 'publishing': un duplicado de la cola no vuelve a publicar.
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                "UPDATE scheduled_posts SET status = 'publishing' WHERE id = %s AND status = 'processing'", (scheduled_post_id,)
+            )
+            claimed = cursor.rowcount == 1
+        if not claimed:
+            return
+        if not post['page_url']:
+            db_manager.execute_query(
+                "UPDATE scheduled_posts SET status = 'failed', error_details = %s WHERE id = %s",
+                ("La página de destino ya no existe.", scheduled_post_id), commit=True
+            )
+            return
+
+        if not self._reserve_publication():
+            db_manager.execute_query(
+                "UPDATE scheduled_posts SET status = 'failed', error_details = %s WHERE id = %s",
+                ("Límite de publicaciones del plan alcanzado.", scheduled_post_id), commit=True
+            )
+            self.log_to_panel(f"❌ Publicación programada {scheduled_post_id} cancelada: límite del plan alcanzado.", "error")
+            return
+
+        self.log_to_panel(f"⏰ Ejecutando publicación programada {scheduled_post_id} en {post['page_url']}")
+        browser = self.acquire_browser(cancelled=lambda: False)
+        if browser is None:
+            quota_manager.refund(self.client_id)
+            quota_manager.release(self.client_id)
+            db_manager.execute_query(
+                "UPDATE scheduled_posts SET status = 'failed', error_details = %s WHERE id = %s",
+                ("No se pudo iniciar el navegador.", scheduled_post_id), commit=True
+            )
+            return
+
+        result = {"success": False, "error": "Error inesperado."}
+        try:
+            browser.driver.get(post['page_url'])
+            selector_engine.wait_page_ready(browser.driver)
+            result = self._create_post_on_facebook(browser.driver, post['text_content'], self._resolve_image_path(post['image_path']))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+            self.log_to_panel(f"❌ Error inesperado en la publicación programada {scheduled_post_id}: {e}", "error")
+        finally:
+            self.release_browser(browser)
+            if not result['success']:
+                quota_manager.refund(self.client_id)
+            quota_manager.release(self.client_id)
+
+        db_manager.execute_query(
+            "UPDATE scheduled_posts SET status = %s, error_details = %s WHERE id = %s",
+            ('completed' if result['success'] else 'failed', result.get('error'), scheduled_post_id), commit=True
+        )
+        db_manager.record_publication(
+            self.client_id,
+            (self.client_id, datetime.utcnow(), 'Success' if result['success'] else 'Failed', 'page', post['page_url'], post['text_content'], post['image_path'], result.get('post_url'), None if result['success'] else result.get('error')),
+            result['success']
+        )
+        db_manager.flush_publications()
+        if result['success']:
+            self.log_to_panel(f"✅ Publicación programada {scheduled_post_id} publicada.", 'success')
+        else:
+            self.log_to_panel(f"❌ Falló la publicación programada {scheduled_post_id}: {result.get('error')}", "error")
+
+
 class InstanceManager:
     """Gestiona una instancia de AppLogic para cada cliente, evitando crear duplicados."""
     def __init__(self):
         self.instances = {}
         self.lock = threading.Lock()
 
-    def get_logic(self, client_id):
+    def get_logic(self, client_id, shard=0):
         with self.lock:
-            if client_id not in self.instances:
-                self.instances[client_id] = AppLogic(client_id, socketio)
-            return self.instances[client_id]
+            if (client_id, shard) not in self.instances:
+                self.instances[(client_id, shard)] = AppLogic(client_id, socketio, shard)
+            return self.instances[(client_id, shard)]
 
 # La instanciación ocurre AQUÍ, después de que la clase ha sido definida.
 instance_manager = InstanceManager()
@@ -512,14 +786,8 @@ def check_subscription_limit(fn):
     """
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        # Obtenemos el ID del cliente directamente del token JWT.
-        client_id = get_jwt()['sub']
-
-        # Buscamos la información del plan del cliente en la base de datos.
-        client = db_manager.fetch_one(
-            "SELECT plan, trial_expires_at, publications_this_month FROM clients WHERE id = %s", 
-            (client_id,)
-        )
+        # La fila del cliente ya la cargó @jwt_required() para esta petición.
+        client = get_current_user()
         
         # Si por alguna razón el cliente no existe, denegar acceso.
         if not client:
@@ -533,8 +801,9 @@ def check_subscription_limit(fn):
         # Obtener el límite de publicaciones del plan actual.
         plan_limit = PLANS.get(client['plan'], {'limit': 0}).get('limit', 0)
         
-        # Comparar el uso actual con el límite del plan.
-        if client['publications_this_month'] >= plan_limit:
+        # Comprobación rápida para no encolar trabajos sin cupo; el límite real se aplica
+        # reservando cada publicación antes de hacerla (quota_manager.reserve).
+        if quota_manager.remaining(client['id'], plan_limit) <= 0:
             return jsonify({
                 "msg": f"Has alcanzado el límite de {plan_limit} publicaciones de tu plan para este mes."
             }), 403
@@ -548,19 +817,79 @@ def check_subscription_limit(fn):
 instance_manager = InstanceManager()
 
 def job_worker():
-    """Procesa trabajos de la cola de forma secuencial para no sobrecargar la VM."""
+    """
+    Procesa trabajos de la cola. Cada trabajo pide su navegador a browser_scheduler,
+    que limita los Chrome simultáneos según los recursos libres de la VM.
+    """
     while True:
         job = job_queue.get()
         client_id = job.get('client_id')
         task_type = job.get('task_type')
         data = job.get('data')
-        logic_instance = instance_manager.get_logic(client_id)
-        
-        if task_type == 'publish_to_groups':
-            logic_instance._group_publishing_process(data['group_tags'], data['content_tags'])
-        # Aquí se podrían añadir otros tipos de trabajos pesados en el futuro
         
-        job_queue.task_done()
+        try:
+            if task_type == 'publish_to_groups':
+                if 'campaign_id' not in data:
+                    # Trabajos encolados antes de las campañas: se planifican con un solo navegador.
+                    campaign = campaign_planner.plan(client_id, data['group_tags'], data['content_tags'])
+                    data = {'campaign_id': campaign['id'], 'shard': 0} if campaign else None
+                if data:
+                    instance_manager.get_logic(client_id, data['shard'])._group_publishing_process(data['campaign_id'])
+            elif task_type == 'publish_scheduled_post':
+                instance_manager.get_logic(client_id)._scheduled_post_process(data['scheduled_post_id'])
+            elif task_type == 'notify_scheduled_post':
+                # Aviso de un proceso web: la publicación entra al montículo del programador de este proceso.
+                post_scheduler.notify(data['scheduled_post_id'], datetime.fromisoformat(data['publish_at']))
+            # Aquí se podrían añadir otros tipos de trabajos pesados en el futuro
+            job_queue.complete(job)
+        except Exception as e:
+            print(f"❌ Error procesando el trabajo {job.get('job_id')} ({task_type}):\n{traceback.format_exc()}")
+            job_queue.complete(job, error=str(e))
+        if task_type == 'publish_to_groups' and data and 'campaign_id' in data:
+            try:
+                finish_campaign_shard(client_id, data['campaign_id'])
+            except Exception as e:
+                print(f"⚠️ Error cerrando la campaña {data['campaign_id']}: {e}")
+
+def finish_campaign_shard(client_id, campaign_id):
+    """
+    Tras terminar un shard: si ya no queda ningún trabajo de la campaña en cola o en marcha (en ningún
+    proceso), la campaña se cierra y el panel deja de mostrar la publicación en curso. Se comprueba con
+    el estado de la cola, así que un shard que se reintenta tras una caída sigue contando como activo.
+    """
+    if job_queue.has_active(client_id, 'publish_to_groups', data={'campaign_id': campaign_id}):
+        return
+    campaign_planner.finish_if_done(campaign_id)
+    socketio.emit('publishing_status', {'isPublishing': False}, room=str(client_id))
+
+def cancel_running_job(job):
+    """La cola avisa de que se pidió detener un trabajo que se ejecuta en este proceso."""
+    if job['task_type'] == 'publish_to_groups':
+        logic = instance_manager.get_logic(job['client_id'], job['data'].get('shard', 0))
+        if logic.is_publishing:
+            logic.is_publishing = False
+            logic.log_to_panel("Solicitud de detención recibida. El proceso terminará después de la publicación actual.", "warning")
+
+job_queue.on_cancel = cancel_running_job
+
+def emit_text_tags(client_id, text):
+    """Envía al panel del cliente las etiquetas de un texto recién procesado por el pipeline de IA."""
+    socketio.emit('text_tags', {'id': text['id'], 'ai_tags': text['ai_tags'], 'tag_status': text['tag_status']}, room=str(client_id))
+
+# Las etiquetas de IA se generan en segundo plano; los textos se guardan con tag_status = 'pending'.
+tagging_pipeline = TaggingPipeline(ai_service, notify=emit_text_tags)
+
+def dispatch_scheduled_post(post, cursor=None):
+    """Envía a la cola de workers una publicación programada, en la transacción de PostScheduler que la reclama."""
+    job_queue.put({
+        'client_id': post['client_id'],
+        'task_type': 'publish_scheduled_post',
+        'data': {'scheduled_post_id': post['id']}
+    }, cursor=cursor)
+
+post_scheduler = PostScheduler(dispatch=dispatch_scheduled_post)
+# Las publicaciones programadas tienen hora: no esperan detrás de las campañas.
+job_queue.priority_task_types = ('publish_scheduled_post', 'notify_scheduled_post')
 
 # ==============================================================================
 # --- API ENDPOINTS COMPLETOS ---
@@ -589,19 +918,19 @@ def change_password():
     current_password = request.json.get("current_password")
     new_password = request.json.get("new_password")
 
-    client = db_manager.fetch_one("SELECT password_hash FROM clients WHERE id = %s", (client_id,))
+    client = get_current_user()
     if not client or not check_password_hash(client['password_hash'], current_password):
         return jsonify({"msg": "La contraseña actual es incorrecta"}), 401
     
     new_password_hash = generate_password_hash(new_password)
     db_manager.execute_query("UPDATE clients SET password_hash = %s WHERE id = %s", (new_password_hash, client_id), commit=True)
+    db_manager.invalidate_client(client_id)
     return jsonify({"msg": "Contraseña actualizada correctamente."})
 
 @app.route('/api/account/status', methods=['GET'])
 @jwt_required()
 def get_account_status():
-    client_id = get_jwt()['sub']
-    client = db_manager.fetch_one("SELECT name, email, plan, trial_expires_at, created_at, publications_this_month FROM clients WHERE id = %s", (client_id,))
+    client = get_current_user()
     
     plan_info = PLANS.get(client['plan'], {})
     client_status = {
@@ -612,7 +941,7 @@ def get_account_status():
         "created_at": client['created_at'].isoformat() if client.get('created_at') else None,
         "plan_name": plan_info.get('name'),
         "monthly_limit": plan_info.get('limit'),
-        "monthly_usage": client['publications_this_month']
+        "monthly_usage": quota_manager.usage(client['id'])
     }
     return jsonify(client_status)
 # --- Endpoints de Superusuario ---
@@ -646,12 +975,15 @@ def delete_client(client_id):
     """Elimina una cuenta de cliente y todos sus datos asociados."""
     # El `ON DELETE CASCADE` en la base de datos se encargará de borrar los datos en otras tablas.
     cursor = db_manager.execute_query("DELETE FROM clients WHERE id = %s", (client_id,), commit=True)
+    db_manager.invalidate_client(client_id)
     if cursor.rowcount == 0:
         return jsonify({"msg": "Cliente no encontrado"}), 404
     
     # Eliminar sus archivos y perfil de Chrome del servidor
     shutil.rmtree(f'client_uploads/client_{client_id}', ignore_errors=True)
-    shutil.rmtree(f'profiles/client_{client_id}', ignore_errors=True)
+    for profile_path in [client_profile_path(client_id)] + glob.glob(f"{client_profile_path(client_id)}_*"):
+        browser_pool.discard_profile(profile_path)
+        shutil.rmtree(profile_path, ignore_errors=True)
     
     return jsonify({"msg": f"Cliente {client_id} y todos sus datos han sido eliminados."})
 
@@ -667,24 +999,79 @@ def update_client_plan(client_id):
         "UPDATE clients SET plan = %s, trial_expires_at = NULL WHERE id = %s", 
         (new_plan, client_id), commit=True
     )
+    db_manager.invalidate_client(client_id)
     return jsonify({"msg": f"Cliente {client_id} actualizado al plan '{new_plan}'."})
 
+@app.route('/api/admin/db/pool', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    """Métricas del pool de conexiones de este proceso (esperas, conexiones en uso, agotamientos)."""
+    return jsonify(db_manager.pool.stats())
+
+@app.route('/api/admin/selectors', methods=['GET'])
+@admin_required
+def get_selector_stats():
+    """Selectores preferidos por paso e idioma, y cuántas veces se acertó a la primera, con alternativa o sin éxito."""
+    return jsonify(selector_engine.stats())
+
+@app.route('/api/admin/ai/tag-cache', methods=['GET'])
+@admin_required
+def get_tag_cache_stats():
+    """Aciertos y fallos de la caché de etiquetas de IA en este proceso."""
+    return jsonify(tag_cache.stats())
+
 # --- Endpoint para servir imágenes (con configuración Nginx recomendada) ---
 @app.route('/uploads/client_<int:client_id>/<path:filename>')
 def serve_uploaded_file(client_id, filename):
     """
-    Sirve los archivos subidos por un cliente. 
-    En producción, esto debe ser manejado por Nginx para mayor eficiencia.
-    EJEMPLO DE CONFIGURACIÓN NGINX (en /etc/nginx/sites-available/your_site):
-    location /uploads/ {
-        # Sirve archivos estáticos directamente, mucho más rápido que Flask.
+    Sirve los archivos subidos por un cliente.
+    - Solo con una URL firmada (`exp` y `sig`, ver /api/uploads/signature): los archivos son
+      privados de cada cliente aunque la URL se pueda cachear.
+    - ETag fuerte (hash del contenido) y Cache-Control inmutable de larga duración: el archivo de
+      una URL no cambia nunca. Responde 304 a If-None-Match y atiende peticiones Range.
+    - Con UPLOAD_SERVE_MODE = 'x-accel' o 'x-sendfile', Flask solo comprueba la firma y el servidor
+      web envía el archivo.
+    EJEMPLO DE CONFIGURACIÓN NGINX para 'x-accel' (en /etc/nginx/sites-available/your_site):
+    location /protected-uploads/ {
+        # Solo accesible vía X-Accel-Redirect, nunca desde fuera.
+        internal;
         alias /var/www/your_project/client_uploads/;
-        expires 30d;
-        add_header Cache-Control "public";
     }
     """
+    if not upload_signer.verify(client_id, request.args.get('exp'), request.args.get('sig')):
+        return jsonify({"msg": "Enlace caducado o no válido."}), 403
     directory = os.path.join(app.config['UPLOAD_FOLDER'], f'client_{client_id}')
-    return send_from_directory(directory, filename)
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"msg": "Archivo no encontrado."}), 404
+
+    etag = upload_etags.get(path)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    elif UPLOAD_SERVE_MODE == 'x-accel':
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = f"{UPLOAD_ACCEL_PREFIX}/client_{client_id}/{filename}"
+        response.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    else:
+        # send_file atiende Range e If-Range; con USE_X_SENDFILE deja el cuerpo al servidor web.
+        response = send_file(path, etag=etag, max_age=UPLOAD_CACHE_MAX_AGE)
+    response.set_etag(etag)
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.cache_control.max_age = UPLOAD_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/uploads/signature', methods=['GET'])
+@jwt_required()
+def get_upload_signature():
+    """Firma para las URLs de /uploads del cliente. El panel pide la siguiente al llegar `refresh_at`."""
+    client_id_raw = get_jwt().get('sub')
+    try:
+        client_id = int(client_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Token inválido."}), 401
+    return jsonify(upload_signer.sign(client_id))
 
 
 
@@ -692,12 +1079,54 @@ def serve_uploaded_file(client_id, filename):
 # ====== BLOQUE COMPLETO PARA REEMPLAZAR (get_initial_data) ======
 # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 
+# Solape del cursor de sincronización: cubre escrituras que confirman con un `updated_at`
+# ligeramente anterior al momento de la consulta. El panel fusiona por id, así que repetir filas es inocuo.
+SYNC_CURSOR_OVERLAP_SECONDS = int(os.getenv("SYNC_CURSOR_OVERLAP_SECONDS", 5))
+
+# Colecciones del panel: consulta base (alias `t`) y orden con el que se muestran.
+ITEM_SELECTS = {
+    "texts": "SELECT t.* FROM texts t",
+    "images": "SELECT t.* FROM images t",
+    "groups": "SELECT t.* FROM groups t",
+    "pages": "SELECT t.* FROM pages t",
+    "scheduled_posts": "SELECT t.*, p.name as page_name FROM scheduled_posts t LEFT JOIN pages p ON t.page_id = p.id",
+}
+ITEM_ORDER = {"scheduled_posts": "t.publish_at DESC"}
+# Columna que filtra el parámetro `status` de /api/items/<tabla>.
+ITEM_STATUS_COLUMNS = {"texts": "t.tag_status", "scheduled_posts": "t.status"}
+ITEM_PAGE_SIZE = int(os.getenv("ITEM_PAGE_SIZE", 100))
+
+def fetch_items(table, client_id, where="", params=(), order=None, limit=None):
+    """Filas de una colección del panel de un cliente. `where` añade condiciones sobre el alias `t`."""
+    query = f"{ITEM_SELECTS[table]} WHERE t.client_id = %s{where} ORDER BY {order or ITEM_ORDER.get(table, 't.id DESC')}"
+    params = (client_id,) + tuple(params)
+    if limit:
+        query += " LIMIT %s"
+        params += (limit,)
+    return db_manager.fetch_all(query, params)
+
+def mutation_response(table, client_id, item_ids=(), deleted=(), status=200, **extra):
+    """
+    Respuesta de los endpoints que modifican una colección: solo las filas creadas o actualizadas,
+    los ids borrados y la nueva versión de la colección (no la lista completa).
+    """
+    item_ids = [item_id for item_id in item_ids if item_id]
+    items = fetch_items(table, client_id, f" AND t.id IN ({', '.join(['%s'] * len(item_ids))})", item_ids) if item_ids else []
+    body = {"items": items, "deleted": list(deleted), "version": db_manager.table_version(client_id, table)}
+    body.update(extra)
+    return jsonify(body), status
+
 @app.route('/api/data/initial', methods=['GET'])
 @jwt_required() 
 def get_initial_data():
     """
-    Recopila y devuelve todos los datos iniciales necesarios para que el cliente
-    cargue su panel de control.
+    Recopila y devuelve los datos que el cliente necesita para cargar su panel de control.
+    - Sin parámetros devuelve todo (mode = 'full') junto con un `cursor`.
+    - Con `?since=<cursor>` devuelve solo las filas creadas o modificadas desde entonces y los
+      ids borrados en `deleted` (mode = 'delta'). Si el cursor es más antiguo que la retención
+      de tombstones, se responde con una carga completa.
+    - Responde 304 si el ETag (versión de cada tabla) coincide con If-None-Match. El ETag no
+      depende del cursor: el panel pide con el cursor nuevo y el ETag de la respuesta anterior.
     """
     # 1. Obtiene el ID del cliente de forma segura desde el token JWT validado.
     client_id_raw = get_jwt().get('sub')
@@ -705,36 +1134,59 @@ def get_initial_data():
         client_id = int(client_id_raw)
     except (TypeError, ValueError):
         return jsonify({"msg": "Token inválido."}), 401
-    
-    # 2. Obtiene la información básica del cliente.
-    client_info = db_manager.fetch_one("SELECT id, name FROM clients WHERE id=%s", (client_id,))
-    
-    # 3. Recopila todos los datos asociados a ese client_id.
-    #    Las consultas están completas y ordenadas para una mejor visualización.
-    data = {
-        "client_info": client_info,
-        "texts": db_manager.fetch_all(
-            "SELECT * FROM texts WHERE client_id = %s ORDER BY id DESC", (client_id,)
-        ),
-        "images": db_manager.fetch_all(
-            "SELECT * FROM images WHERE client_id = %s ORDER BY id DESC", (client_id,)
-        ),
-        "groups": db_manager.fetch_all(
-            "SELECT * FROM groups WHERE client_id = %s ORDER BY id DESC", (client_id,)
-        ),
-        "pages": db_manager.fetch_all(
-            "SELECT * FROM pages WHERE client_id = %s ORDER BY id DESC", (client_id,)
-        ),
-        "scheduled_posts": db_manager.fetch_all(
-            "SELECT sp.*, p.name as page_name FROM scheduled_posts sp LEFT JOIN pages p ON sp.page_id = p.id WHERE sp.client_id = %s ORDER BY sp.publish_at DESC", (client_id,)
-        ),
-        "publication_log": db_manager.fetch_all(
-            "SELECT * FROM publication_log WHERE client_id = %s ORDER BY timestamp DESC LIMIT 50", (client_id,)
+
+    # 2. El momento de la consulta (reloj de la BD) es la base del próximo cursor.
+    sync_started = db_manager.fetch_one("SELECT NOW(6) AS now")['now']
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({"msg": "Cursor de sincronización no válido."}), 400
+        # Los cursores que emite el servidor van sin zona, como las fechas de la BD con las que se comparan.
+        if since.tzinfo is not None:
+            return jsonify({"msg": "Cursor de sincronización no válido: no debe incluir zona horaria."}), 400
+        if since < sync_started - timedelta(days=db_manager.tombstone_retention_days):
+            since = None
+
+    # 3. Obtiene la información básica del cliente y la versión de cada tabla.
+    client = get_current_user()
+    client_info = {"id": client['id'], "name": client['name']}
+    versions = db_manager.data_versions(client_id)
+    # La firma de /uploads entra en el ETag: al cambiar de ventana el panel recibe la nueva.
+    uploads = upload_signer.sign(client_id)
+    etag = hashlib.sha1(json.dumps([client_info, versions, uploads], sort_keys=True).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    # 4. Recopila los datos del cliente: todos, o solo los cambiados desde el cursor.
+    where, params = ("", ()) if since is None else (" AND t.updated_at >= %s", (since,))
+    data = {"client_info": client_info, "uploads": uploads}
+    for table in SYNC_TABLES:
+        data[table] = fetch_items(table, client_id, where, params)
+    # El historial se envía siempre completo: son 50 filas y llegan con retraso por el buffer de escritura.
+    data["publication_log"] = db_manager.fetch_all(
+        "SELECT * FROM publication_log WHERE client_id = %s ORDER BY timestamp DESC, id DESC LIMIT 50", (client_id,)
+    )
+    # Las páginas anteriores del historial se piden a /api/publication_log con este cursor.
+    data["publication_log_cursor"] = publication_log_cursor(data["publication_log"][-1]) if len(data["publication_log"]) == 50 else None
+    if since is not None:
+        deleted = db_manager.fetch_all(
+            "SELECT table_name, item_id FROM deleted_items WHERE client_id = %s AND deleted_at >= %s", (client_id, since)
         )
-    }
+        data["deleted"] = {table: [row['item_id'] for row in deleted if row['table_name'] == table] for table in SYNC_TABLES}
+
+    data["mode"] = "full" if since is None else "delta"
+    data["versions"] = versions
+    data["cursor"] = (sync_started - timedelta(seconds=SYNC_CURSOR_OVERLAP_SECONDS)).isoformat()
 
-    # 4. Devuelve el paquete completo de datos al frontend.
-    return jsonify(data)
+    # 5. Devuelve el paquete de datos al frontend.
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/texts', methods=['POST'])
 @jwt_required()
@@ -747,19 +1199,11 @@ def add_text():
     content = request.json.get('content')
     if not content: return jsonify({"msg": "El contenido no puede estar vacío"}), 400
     
-    try:
-        tags = ai_service.generate_tags_for_text(content)
-        tags_str = ",".join(tags) if tags else ""
-    except Exception as e:
-        print(f"ADVERTENCIA: Falló la generación de etiquetas por IA: {e}")
-        tags_str = "" # Continuar sin etiquetas en caso de error de la IA
-
-    
-
-
-    db_manager.execute_query("INSERT INTO texts (client_id, content, ai_tags) VALUES (%s, %s, %s)", (client_id, content, tags_str), commit=True)
-    new_texts = db_manager.fetch_all("SELECT * FROM texts WHERE client_id = %s ORDER BY id DESC", (client_id,))
-    return jsonify(new_texts)
+    # Las etiquetas llegan después por WebSocket ('text_tags'), cuando el pipeline de IA las genera.
+    text_id = db_manager.execute_insert("INSERT INTO texts (client_id, content, ai_tags, tag_status) VALUES (%s, %s, '', 'pending')", (client_id, content))
+    if text_id:
+        tagging_pipeline.submit(client_id, text_id, content)
+    return mutation_response('texts', client_id, [text_id], status=201)
 
 @app.route('/api/images/upload', methods=['POST'])
 @jwt_required()
@@ -776,16 +1220,39 @@ def upload_images():
     client_upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'client_{client_id}')
     os.makedirs(client_upload_dir, exist_ok=True)
     
+    # 1. Cada archivo se copia a disco por bloques calculando su hash; las copias repetidas
+    #    dentro de la misma subida se descartan.
+    uploads = {}  # hash -> (ruta temporal, extensión)
     for file in files:
-        filename = secure_filename(file.filename)
-        unique_filename = f"{int(time.time())}_{filename}"
-        save_path = os.path.join(client_upload_dir, unique_filename)
-        file.save(save_path)
-        # Guardamos solo el nombre del archivo, no la ruta completa, es más seguro y portable
-        db_manager.execute_query("INSERT INTO images (client_id, path, manual_tags) VALUES (%s, %s, %s)", (client_id, unique_filename, tags), commit=True)
-        
-    new_images = db_manager.fetch_all("SELECT * FROM images WHERE client_id = %s ORDER BY id DESC", (client_id,))
-    return jsonify(new_images)
+        temp_path, content_hash, extension = save_upload(file, client_upload_dir)
+        if content_hash in uploads:
+            os.remove(temp_path)
+        else:
+            uploads[content_hash] = (temp_path, extension)
+
+    # 2. Las imágenes que el cliente ya tenía no se vuelven a guardar.
+    existing = set()
+    if uploads:
+        placeholders = ", ".join(["%s"] * len(uploads))
+        existing = {row['content_hash'] for row in db_manager.fetch_all(
+            f"SELECT content_hash FROM images WHERE client_id = %s AND content_hash IN ({placeholders})",
+            (client_id,) + tuple(uploads)
+        )}
+    new_files = {}
+    for content_hash, (temp_path, extension) in uploads.items():
+        if content_hash in existing:
+            os.remove(temp_path)
+        else:
+            # Guardamos solo el nombre del archivo, no la ruta completa, es más seguro y portable
+            new_files[content_hash] = promote_upload(temp_path, client_upload_dir, content_hash, extension)
+
+    # 3. Miniaturas en paralelo y un único INSERT para todas las filas.
+    thumbnails = thumbnail_pool.generate(client_upload_dir, list(new_files.values()))
+    rows = [(filename, tags, content_hash, thumbnails.get(filename)) for content_hash, filename in new_files.items()]
+    inserted = db_manager.bulk_insert(client_id, 'images', rows)
+
+    return mutation_response('images', client_id, [row['id'] for row in inserted], status=201,
+                             duplicates=len(files) - len(inserted))
 @app.route('/api/texts/<int:item_id>', methods=['PUT'])
 @jwt_required()
 def update_text(item_id):
@@ -795,20 +1262,15 @@ def update_text(item_id):
     except (TypeError, ValueError):
         return jsonify({"msg": "Token inválido."}), 401
     content = request.json.get('content')
-    text_obj = db_manager.fetch_one("SELECT id FROM texts WHERE id = %s AND client_id = %s", (item_id, client_id))
+    text_obj = db_manager.fetch_one("SELECT id, content FROM texts WHERE id = %s AND client_id = %s", (item_id, client_id))
     if not text_obj: return jsonify({"msg": "Texto no encontrado o no autorizado"}), 404
     
-    # tags = ai_service.generate_tags_for_text(content) # Descomenta si usas ai_service
-    try:
-        tags = ai_service.generate_tags_for_text(content)
-        tags_str = ",".join(tags) if tags else ""
-    except Exception as e:
-        print(f"ADVERTENCIA: Falló la generación de etiquetas por IA al actualizar: {e}")
-        tags_str = ""
-
-    db_manager.execute_query("UPDATE texts SET content = %s, ai_tags = %s WHERE id = %s", (content, tags_str, item_id), commit=True)
-    updated_texts = db_manager.fetch_all("SELECT * FROM texts WHERE client_id = %s ORDER BY id DESC", (client_id,))
-    return jsonify(updated_texts)
+    # Si el contenido no cambió no hay nada que re-etiquetar. Si cambió, se conservan las
+    # etiquetas anteriores hasta que el pipeline de IA genere las nuevas.
+    if content != text_obj['content']:
+        db_manager.execute_query("UPDATE texts SET content = %s, tag_status = 'pending' WHERE id = %s", (content, item_id), commit=True)
+        tagging_pipeline.submit(client_id, item_id, content)
+    return mutation_response('texts', client_id, [item_id])
 
 
 
@@ -841,28 +1303,23 @@ def generate_ai_texts():
 
         if not generated_texts:
             print(f"WARN: [Cliente {client_id}] OpenAI no devolvió textos. Terminando la operación sin cambios.")
-            # Devolvemos la lista actual para que el frontend no se rompa
-            current_texts = db_manager.fetch_all("SELECT * FROM texts WHERE client_id = %s ORDER BY id DESC", (client_id,))
-            return jsonify(current_texts)
+            # Respondemos sin filas nuevas para que el frontend no se rompa
+            return mutation_response('texts', client_id)
             
         print(f"INFO: [Cliente {client_id}] Guardando {len(generated_texts)} textos en la base de datos.")
+        text_ids = []
         for text_content in generated_texts:
-            try:
-                tags = ai_service.generate_tags_for_text(text_content)
-                tags_str = ",".join(tags) if tags else ""
-            except Exception as e_tags:
-                print(f"WARN: Falló la generación de etiquetas para un texto: {e_tags}")
-                tags_str = ""
-            
-            db_manager.execute_query(
-                "INSERT INTO texts (client_id, content, ai_tags) VALUES (%s, %s, %s)",
-                (client_id, text_content, tags_str),
-                commit=True
+            text_id = db_manager.execute_insert(
+                "INSERT INTO texts (client_id, content, ai_tags, tag_status) VALUES (%s, %s, '', 'pending')",
+                (client_id, text_content)
             )
+            # El pipeline agrupa los textos recién generados y los etiqueta en una sola llamada.
+            if text_id:
+                tagging_pipeline.submit(client_id, text_id, text_content)
+                text_ids.append(text_id)
         
-        print(f"INFO: [Cliente {client_id}] Textos guardados exitosamente. Devolviendo lista actualizada.")
-        new_texts = db_manager.fetch_all("SELECT * FROM texts WHERE client_id = %s ORDER BY id DESC", (client_id,))
-        return jsonify(new_texts)
+        print(f"INFO: [Cliente {client_id}] Textos guardados exitosamente. Devolviendo los textos nuevos.")
+        return mutation_response('texts', client_id, text_ids, status=201)
 
     except Exception as e:
         # Este log es crucial para ver si hay un error inesperado
@@ -883,31 +1340,136 @@ def delete_item(table, item_id):
         return jsonify({"msg": "Operación no permitida"}), 400
 
     if table == 'images':
-        image_record = db_manager.fetch_one("SELECT path FROM images WHERE id = %s AND client_id = %s", (item_id, client_id))
+        image_record = db_manager.fetch_one("SELECT path, thumb_path FROM images WHERE id = %s AND client_id = %s", (item_id, client_id))
         if image_record:
-            # Construye la ruta completa para borrar el archivo
-            full_path = os.path.join(app.config['UPLOAD_FOLDER'], f'client_{client_id}', image_record['path'])
-            if os.path.exists(full_path):
-                os.remove(full_path)
-
-    query = f"DELETE FROM {table} WHERE id = %s AND client_id = %s"
-    cursor = db_manager.execute_query(query, (item_id, client_id), commit=True)
-    
-    if cursor.rowcount == 0:
+            # Construye la ruta completa para borrar el archivo y su miniatura
+            for relative_path in filter(None, (image_record['path'], image_record['thumb_path'])):
+                full_path = os.path.join(app.config['UPLOAD_FOLDER'], f'client_{client_id}', relative_path)
+                if os.path.exists(full_path):
+                    os.remove(full_path)
+
+    # El borrado deja un tombstone para los paneles que sincronizan de forma incremental.
+    if not db_manager.delete_item(client_id, table, item_id):
         return jsonify({"msg": "Elemento no encontrado o no autorizado"}), 404
 
-    # Devuelve la lista actualizada del tipo de dato correspondiente
-    updated_data = db_manager.fetch_all(f"SELECT * FROM {table} WHERE client_id = %s ORDER BY id DESC", (client_id,))
-    return jsonify({"success": True, "msg": f"Elemento eliminado.", "updated_data": updated_data})
+    # Devuelve el id borrado y la nueva versión de la colección
+    return mutation_response(table, client_id, deleted=[item_id], success=True, msg="Elemento eliminado.")
+
 
+# --- Importación masiva ---
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", 500))
+BULK_IMPORT_MAX_ROWS = int(os.getenv("BULK_IMPORT_MAX_ROWS", 50000))
+# Campo principal de cada colección: es el que puede venir como string suelto en JSON o listas simples.
+BULK_IMPORT_MAIN_FIELD = {'texts': 'content', 'groups': 'url', 'pages': 'page_url'}
+
+def iter_import_records(table):
+    """
+    Genera los registros (dicts) de una importación masiva sin cargar el archivo entero:
+    - Archivo 'file' .csv (con cabecera) o .ndjson/.jsonl: se lee línea a línea.
+    - Archivo .json o cuerpo JSON: lista de objetos o de strings (`items`, o `urls` / `texts`).
+    """
+    upload = request.files.get('file')
+    if upload:
+        extension = os.path.splitext(upload.filename or '')[1].lower()
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        if extension == '.csv':
+            yield from csv.DictReader(stream)
+        elif extension in ('.ndjson', '.jsonl'):
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+        elif extension == '.json':
+            yield from json.load(stream)
+        else:
+            raise ValueError("Formato no soportado. Usa .csv, .json o .ndjson.")
+        return
+    body = request.get_json(silent=True) or {}
+    yield from body.get('items') or body.get('urls') or body.get('texts') or body.get('pages') or []
+
+def import_row(table, record, default_tags):
+    """Convierte un registro importado en la tupla de BULK_INSERTS[table], o None si no es válido."""
+    if isinstance(record, str):
+        record = {BULK_IMPORT_MAIN_FIELD[table]: record}
+    if not isinstance(record, dict):
+        return None
+    if table == 'texts':
+        content = (record.get('content') or record.get('text') or '').strip()
+        return (content,) if content else None
+    if table == 'groups':
+        url = (record.get('url') or '').strip()
+        tags = ",".join(normalize_tags(record.get('tags') or default_tags))
+        return (url, tags) if url.startswith(('http://', 'https://')) else None
+    url = (record.get('page_url') or record.get('url') or '').strip()
+    name = (record.get('name') or url).strip()[:255]
+    return (name, url) if url.startswith(('http://', 'https://')) else None
+
+@app.route('/api/<any(texts, groups, pages):table>/bulk', methods=['POST'])
+@jwt_required()
+def bulk_import(table):
+    """
+    Importación masiva de textos, grupos o páginas (ver iter_import_records para los formatos).
+    Inserta por lotes de BULK_IMPORT_CHUNK_SIZE filas, una transacción por lote; los grupos y
+    páginas ya existentes (misma URL) se cuentan como duplicados. Los textos nuevos se encolan
+    juntos en el pipeline de etiquetado de IA. Si el archivo pasa de BULK_IMPORT_MAX_ROWS filas,
+    se importan las primeras y se responde 413 con cuántas se insertaron.
+    """
+    client_id_raw = get_jwt().get('sub')
+    try:
+        client_id = int(client_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Token inválido."}), 401
+    default_tags = request.form.get('tags') or (request.get_json(silent=True) or {}).get('tags', '')
+
+    received = inserted = invalid = 0
+    chunk = []
+    try:
+        for record in iter_import_records(table):
+            received += 1
+            if received > BULK_IMPORT_MAX_ROWS:
+                # Los lotes anteriores ya están confirmados: se importan las primeras filas y se informa.
+                inserted += bulk_insert_chunk(client_id, table, chunk)
+                return jsonify({
+                    "msg": f"La importación supera el máximo de {BULK_IMPORT_MAX_ROWS} filas: solo se importaron las primeras {BULK_IMPORT_MAX_ROWS}.",
+                    "inserted": inserted,
+                    "version": db_manager.table_version(client_id, table)
+                }), 413
+            row = import_row(table, record, default_tags)
+            if row is None:
+                invalid += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= BULK_IMPORT_CHUNK_SIZE:
+                inserted += bulk_insert_chunk(client_id, table, chunk)
+                chunk = []
+        inserted += bulk_insert_chunk(client_id, table, chunk)
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        return jsonify({"msg": f"No se pudo leer el archivo: {e}", "inserted": inserted}), 400
+
+    valid = received - invalid
+    return jsonify({
+        "inserted": inserted,
+        "duplicates": valid - inserted,
+        "invalid": invalid,
+        "version": db_manager.table_version(client_id, table)
+    }), 201
+
+def bulk_insert_chunk(client_id, table, rows):
+    """Inserta un lote y, si son textos, los encola para etiquetar. Devuelve cuántas filas se insertaron."""
+    inserted = db_manager.bulk_insert(client_id, table, rows)
+    if table == 'texts':
+        for row in inserted:
+            tagging_pipeline.submit(client_id, row['id'], row['content'])
+    return len(inserted)
 
 @app.route('/api/groups', methods=['POST'])
 @jwt_required()
 def add_group():
     client_id = get_jwt()['sub']
     data = request.get_json()
-    db_manager.execute_query("INSERT INTO groups (client_id, url, tags) VALUES (%s, %s, %s)", (client_id, data['url'], data['tags']), commit=True)
-    return jsonify(db_manager.fetch_all("SELECT * FROM groups WHERE client_id = %s ORDER BY id DESC", (client_id,)))
+    group_id = db_manager.execute_insert("INSERT INTO groups (client_id, url, tags) VALUES (%s, %s, %s)", (client_id, data['url'], data['tags']))
+    if group_id:
+        db_manager.sync_tags(client_id, 'groups', group_id, data['tags'])
+    return mutation_response('groups', client_id, [group_id], status=201)
 
 @app.route('/api/pages', methods=['POST'])
 @jwt_required()
@@ -918,8 +1480,15 @@ def add_page():
     except (TypeError, ValueError):
         return jsonify({"msg": "Token inválido."}), 401
     data = request.get_json()
-    db_manager.execute_query("INSERT INTO pages (client_id, name, page_url) VALUES (%s, %s, %s)", (client_id, data['name'], data['page_url']), commit=True)
-    return jsonify(db_manager.fetch_all("SELECT * FROM pages WHERE client_id = %s ORDER BY id DESC", (client_id,)))
+    page_id = db_manager.execute_insert("INSERT INTO pages (client_id, name, page_url) VALUES (%s, %s, %s)", (client_id, data['name'], data['page_url']))
+    return mutation_response('pages', client_id, [page_id], status=201)
+
+def parse_utc_datetime(value):
+    """Convierte una fecha ISO del frontend (p. ej. '2025-01-01T10:00:00.000Z') a datetime UTC sin zona."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 @app.route('/api/scheduled_posts', methods=['POST'])
 @jwt_required()
@@ -930,8 +1499,137 @@ def add_scheduled_post():
     except (TypeError, ValueError):
         return jsonify({"msg": "Token inválido."}), 401
     data = request.get_json()
-    db_manager.execute_query("INSERT INTO scheduled_posts (client_id, page_id, publish_at, text_content, image_id) VALUES (%s, %s, %s, %s, %s)", (client_id, data['page_id'], data['publish_at'], data['text_content'], data.get('image_id')), commit=True)
-    return jsonify(db_manager.fetch_all("SELECT sp.*, p.name as page_name FROM scheduled_posts sp LEFT JOIN pages p ON sp.page_id = p.id WHERE sp.client_id = %s ORDER BY sp.publish_at DESC", (client_id,)))
+    try:
+        publish_at = parse_utc_datetime(data['publish_at'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"msg": "Fecha de publicación no válida."}), 400
+    post_id = db_manager.execute_insert("INSERT INTO scheduled_posts (client_id, page_id, publish_at, text_content, image_id) VALUES (%s, %s, %s, %s, %s)", (client_id, data['page_id'], publish_at, data['text_content'], data.get('image_id')))
+    if post_id:
+        if APP_ROLE == 'web':
+            # El programador corre en los workers: se le avisa por la cola si la hora cae dentro de su horizonte.
+            if publish_at <= datetime.utcnow() + post_scheduler.horizon:
+                job_queue.put({
+                    'client_id': client_id,
+                    'task_type': 'notify_scheduled_post',
+                    'data': {'scheduled_post_id': post_id, 'publish_at': publish_at.isoformat()}
+                })
+        else:
+            post_scheduler.notify(post_id, publish_at)
+    return mutation_response('scheduled_posts', client_id, [post_id], status=201)
+
+@app.route('/api/items/<table>', methods=['GET'])
+@jwt_required()
+def list_items(table):
+    """
+    Lista paginada de una colección del panel, del id más reciente al más antiguo.
+    Parámetros:
+    - `limit` (máx. ITEM_PAGE_SIZE) y `before_id` (el `next_cursor` de la página anterior).
+    - `tags`: etiquetas separadas por comas (textos, imágenes y grupos); basta con que coincida una.
+    - `status`: tag_status de los textos o estado de las publicaciones programadas.
+    """
+    client_id_raw = get_jwt().get('sub')
+    try:
+        client_id = int(client_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Token inválido."}), 401
+    if table not in SYNC_TABLES:
+        return jsonify({"msg": "Operación no permitida"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', ITEM_PAGE_SIZE)), 1), ITEM_PAGE_SIZE)
+        before_id = int(request.args['before_id']) if request.args.get('before_id') else None
+    except ValueError:
+        return jsonify({"msg": "Parámetros de paginación no válidos."}), 400
+
+    # Paginación por clave (id < cursor) en lugar de OFFSET: cada página cuesta lo mismo.
+    where, params = "", ()
+    if before_id is not None:
+        where, params = where + " AND t.id < %s", params + (before_id,)
+    if request.args.get('tags'):
+        if table not in TAG_LINKS:
+            return jsonify({"msg": f"La colección '{table}' no admite filtro por etiquetas."}), 400
+        clause, clause_params = tag_match_clause(table, "t.id", client_id, normalize_tags(request.args['tags']))
+        where, params = where + f" AND {clause}", params + clause_params
+    if request.args.get('status'):
+        if table not in ITEM_STATUS_COLUMNS:
+            return jsonify({"msg": f"La colección '{table}' no admite filtro por estado."}), 400
+        where, params = where + f" AND {ITEM_STATUS_COLUMNS[table]} = %s", params + (request.args['status'],)
+    items = fetch_items(table, client_id, where, params, order="t.id DESC", limit=limit + 1)
+    next_cursor = items[limit - 1]['id'] if len(items) > limit else None
+    return jsonify({
+        "items": items[:limit],
+        "next_cursor": next_cursor,
+        "version": db_manager.table_version(client_id, table)
+    })
+
+@app.route('/api/publication_log', methods=['GET'])
+@jwt_required()
+def list_publication_log():
+    """
+    Historial de publicaciones paginado por clave (timestamp, id), del más reciente al más antiguo.
+    Parámetros: `limit` (máx. ITEM_PAGE_SIZE), `before` (el `next_cursor` de la página anterior),
+    `status` ('Success' o 'Failed') y `target_type` ('group' o 'page').
+    """
+    client_id_raw = get_jwt().get('sub')
+    try:
+        client_id = int(client_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Token inválido."}), 401
+    try:
+        limit = min(max(int(request.args.get('limit', ITEM_PAGE_SIZE)), 1), ITEM_PAGE_SIZE)
+        before = None
+        if request.args.get('before'):
+            before_ts, before_id = request.args['before'].rsplit('|', 1)
+            before = (datetime.fromisoformat(before_ts), int(before_id))
+    except ValueError:
+        return jsonify({"msg": "Parámetros de paginación no válidos."}), 400
+
+    where, params = "", ()
+    for column in ('status', 'target_type'):
+        if request.args.get(column):
+            where, params = where + f" AND {column} = %s", params + (request.args[column],)
+    if before:
+        where, params = where + " AND (timestamp < %s OR (timestamp = %s AND id < %s))", params + (before[0], before[0], before[1])
+    rows = db_manager.fetch_all(
+        f"SELECT * FROM publication_log WHERE client_id = %s{where} ORDER BY timestamp DESC, id DESC LIMIT %s",
+        (client_id,) + params + (limit + 1,)
+    )
+    next_cursor = publication_log_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return jsonify({"items": rows[:limit], "next_cursor": next_cursor})
+
+@app.route('/api/export/<table>', methods=['GET'])
+@jwt_required()
+def export_items(table):
+    """
+    Exporta una colección completa del cliente como NDJSON (un objeto JSON por línea).
+    Las filas se leen con un cursor en streaming y se envían a medida que llegan, así que la
+    memoria usada no depende del tamaño de la colección.
+    """
+    client_id_raw = get_jwt().get('sub')
+    try:
+        client_id = int(client_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Token inválido."}), 401
+    if table not in SYNC_TABLES + ('publication_log',):
+        return jsonify({"msg": "Operación no permitida"}), 400
+
+    def generate():
+        rows = db_manager.iter_rows(f"SELECT * FROM {table} WHERE client_id = %s ORDER BY id", (client_id,), chunk_size=500)
+        for chunk in rows:
+            yield "".join(json.dumps(row, default=json_default, ensure_ascii=False) + "\n" for row in chunk)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{table}.ndjson"'}
+    )
+
+def json_default(value):
+    """Serializa fechas en ISO 8601 (y lo demás como texto) al exportar filas."""
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+def publication_log_cursor(row):
+    """Cursor opaco (timestamp|id) que apunta a la fila siguiente a `row` en el historial."""
+    return f"{row['timestamp'].isoformat()}|{row['id']}"
 
 
 # main.py
@@ -954,31 +1652,63 @@ def start_publishing():
     # El método .get_logic() se encarga de crearla si no existe.
     logic = instance_manager.get_logic(client_id)
 
-    # Evitamos que se encolen múltiples trabajos para el mismo cliente.
-    if logic.is_publishing:
+    # Evitamos que se encolen múltiples trabajos para el mismo cliente (en cualquier proceso).
+    if job_queue.has_active(client_id, 'publish_to_groups'):
         return jsonify({"msg": "Un proceso de publicación ya está en ejecución para ti."}), 409
         
     data = request.get_json()
     if not data or 'group_tags' not in data or 'content_tags' not in data:
         return jsonify({"msg": "Faltan etiquetas de grupos o de contenido."}), 400
 
-    # Creamos el trabajo y lo añadimos a la cola.
-    job = {
-        'client_id': client_id, 
-        'task_type': 'publish_to_groups', 
-        'data': {
-            'group_tags': data['group_tags'],
-            'content_tags': data['content_tags']
-        }
-    }
-    job_queue.put(job)
+    # La campaña fija los grupos (sin duplicados) y cuántos navegadores los reparten; si hay una
+    # a medias con las mismas etiquetas, se reanuda.
+    parallel_browsers = PLANS.get(get_current_user()['plan'], {}).get('parallel_browsers', 1)
+    campaign = campaign_planner.plan(client_id, data['group_tags'], data['content_tags'], parallel_browsers)
+    if not campaign:
+        return jsonify({"msg": "Ningún grupo coincide con las etiquetas seleccionadas."}), 400
+
+    # Un trabajo por navegador de la campaña.
+    for shard in range(campaign['shards']):
+        job_queue.put({
+            'client_id': client_id,
+            'task_type': 'publish_to_groups',
+            'data': {'campaign_id': campaign['id'], 'shard': shard}
+        })
     
-    # Actualizamos el estado y notificamos al frontend.
-    logic.is_publishing = True
-    logic.log_to_panel("✅ Tu solicitud de publicación ha sido añadida a la cola.")
+    # Si los workers corren en este proceso y hay recursos libres, se arrancan ya sus navegadores
+    # para que estén listos cuando un worker tome los trabajos.
+    slots = browser_scheduler.status()
+    if APP_ROLE == 'all':
+        for shard in range(min(campaign['shards'], slots["capacity"] - slots["in_use"])):
+            shard_logic = instance_manager.get_logic(client_id, shard)
+            # El perfil de un navegador paralelo se copia al empezar su trabajo; hasta entonces no se precalienta.
+            if shard and not os.path.isdir(shard_logic.profile_path):
+                continue
+            browser_pool.prewarm(shard_logic.profile_path, shard_logic.get_chrome_options())
+
+    # Notificamos al frontend.
+    if campaign['resumed']:
+        logic.log_to_panel(f"✅ Campaña reanudada: quedan {campaign['pending']} grupos, en {campaign['shards']} navegador(es).")
+    else:
+        duplicates = f" ({campaign['duplicates']} URLs duplicadas descartadas)" if campaign['duplicates'] else ""
+        logic.log_to_panel(f"✅ Tu solicitud de publicación ha sido añadida a la cola: {campaign['pending']} grupos{duplicates}, en {campaign['shards']} navegador(es).")
     socketio.emit('publishing_status', {'isPublishing': True}, room=str(client_id))
     
-    return jsonify({"msg": "Proceso de publicación encolado."})
+    return jsonify({
+        "msg": "Proceso de publicación encolado.",
+        "campaign_id": campaign['id'], "shards": campaign['shards'], "pending": campaign['pending'], "resumed": campaign['resumed']
+    })
+
+@app.route('/api/publishing/campaign', methods=['GET'])
+@jwt_required()
+def get_campaign_progress():
+    """Progreso de la última campaña de grupos del cliente (grupos por estado, en total y por navegador)."""
+    client_id_raw = get_jwt().get('sub')
+    try:
+        client_id = int(client_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Token inválido."}), 401
+    return jsonify({"campaign": campaign_planner.progress(client_id)})
 
 
 @app.route('/api/publishing/stop', methods=['POST'])
@@ -990,13 +1720,11 @@ def stop_publishing():
     except (TypeError, ValueError):
         return jsonify({"msg": "Token inválido."}), 401
 
-    # --- LÍNEA CORREGIDA (para consistencia) ---
-    # Aquí también usamos el método get_logic para ser consistentes.
-    logic = instance_manager.get_logic(client_id)
-    
-    if logic.is_publishing:
-        logic.is_publishing = False
-        logic.log_to_panel("Solicitud de detención recibida. El proceso terminará después de la publicación actual.", "warning")
+    # El trabajo puede estar en cola o ejecutándose en otro proceso: la cola lo cancela
+    # o avisa al proceso que lo tiene (ver cancel_running_job).
+    if job_queue.has_active(client_id, 'publish_to_groups'):
+        if not job_queue.request_cancel(client_id, 'publish_to_groups'):
+            socketio.emit('publishing_status', {'isPublishing': False}, room=str(client_id))
         return jsonify({"msg": "Se ha solicitado la detención del proceso."})
     
     return jsonify({"msg": "No hay ningún proceso en ejecución para detener."})
@@ -1009,7 +1737,10 @@ def stop_publishing():
 
 @socketio.on('join')
 def on_join(data):
-    """Un cliente se une a su sala privada para recibir logs, validando su token JWT."""
+    """
+    Un cliente se une a su sala privada para recibir logs, validando su token JWT.
+    Al unirse recibe ('log_history') las líneas recientes que aún no tenía: `after` es el último seq de cada origen.
+    """
     token = data.get('token')
     client_id = data.get('client_id')
     if not token:
@@ -1021,7 +1752,8 @@ def on_join(data):
         decoded_token = decode_token(token)
         token_client_id = decoded_token['sub']
         if token_client_id == client_id:
-            join_room(client_id)
+            join_room(str(client_id))
+            emit('log_history', {'lines': log_streamer.history(client_id, data.get('after'))})
             instance_manager.get_logic(client_id).log_to_panel("Conectado a la consola.")
         else:
             # Si el token es válido pero para otro usuario, se desconecta por seguridad
@@ -1038,12 +1770,47 @@ def on_connect():
 def on_disconnect():
     print("Cliente desconectado de WebSocket.")
 
-if __name__ == "__main__":
-    for i in range(MAX_CONCURRENT_BROWSERS):
-        worker_thread = threading.Thread(target=job_worker, daemon=True)
-        worker_thread.start()
+def serve(run_web=None):
+    """
+    Arranca los servicios del rol del proceso (APP_ROLE) y, salvo en los workers, el servidor web.
+    Args:
+        run_web (callable): Sustituye a socketio.run; server.py arranca así su servidor cooperativo.
+    """
+    # SIGTERM (systemd, docker stop) pasa por sys.exit para que atexit vuelque los buffers pendientes.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Los procesos de miniaturas se crean con fork: tiene que ser antes de arrancar cualquier hilo.
+    if APP_ROLE in ('all', 'web'):
+        thumbnail_pool.start()
+
+    if APP_ROLE in ('all', 'worker'):
+        # chromedriver se resuelve una sola vez al arrancar; los navegadores ociosos del pool
+        # se cierran cuando el planificador necesita RAM para nuevos trabajos.
+        browser_pool.resolve_driver_path()
+        browser_scheduler.add_reclaimer(browser_pool.evict_idle)
+        atexit.register(browser_pool.close_all)
+
+        post_scheduler.start()
+
+        for i in range(MAX_WORKER_THREADS):
+            worker_thread = threading.Thread(target=job_worker, daemon=True)
+            worker_thread.start()
+
+    if APP_ROLE in ('all', 'web'):
+        tagging_pipeline.start()
+
+    if APP_ROLE == 'worker':
+        print(f"👷 Proceso worker iniciado ({MAX_WORKER_THREADS} hilos).")
+        while True:
+            time.sleep(3600)
+    else:
+        print(f"🚀 Iniciando servidor Flask en modo Multi-Inquilino ({SERVER_MODE})...")
+        # En producción: `python server.py` (eventlet o gevent); ver server.py.
+        if run_web:
+            run_web()
+        else:
+            socketio.run(app, debug=False, host=os.getenv("HOST", '0.0.0.0'), port=int(os.getenv("PORT", 5001)))
 
-    print(f"🚀 Iniciando servidor Flask en modo Multi-Inquilino...")
-    # Usar eventlet o gevent es recomendado para producción con SocketIO
-    socketio.run(app, debug=False, host='0.0.0.0', port=5001)
+if __name__ == "__main__":
+    serve()
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import os
+import heapq
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from database import db_manager
+
+
+class PostScheduler:
+    """
+    Motor que ejecuta las publicaciones programadas (`scheduled_posts`) a su hora.
+    - Mantiene en memoria un montículo (publish_at, id) con las publicaciones pendientes del
+      horizonte próximo; se rellena con consultas por rango sobre el índice (status, publish_at),
+      nunca recorriendo toda la tabla, y se reconstruye desde la BD al arrancar.
+    - Cada publicación vencida se reclama con un UPDATE condicional (`status = 'pending'`), de modo
+      que si hay varios procesos solo uno la despacha.
+    - Las publicaciones que llevan demasiado tiempo vencidas se marcan como 'expired' en lugar de
+      publicarse tarde.
+    - Una publicación reclamada ('processing') no vuelve nunca a 'pending': su trabajo se encola en la
+      misma transacción que la reclama, así que no puede quedar reclamada sin trabajo. La cola
+      persistente lo reintenta si el worker muere (ver jobs.DatabaseJobQueue), y el worker la pasa a
+      'publishing' con otro UPDATE condicional antes de abrir el navegador.
+    """
+    def __init__(self, dispatch):
+        """
+        Args:
+            dispatch (callable): Recibe la fila reclamada y el cursor de la transacción que la reclama,
+                y encola su trabajo con ese cursor.
+        """
+        self.dispatch = dispatch
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.horizon = timedelta(seconds=int(os.getenv("SCHEDULER_HORIZON_SECONDS", 600)))
+        self.max_lateness = timedelta(seconds=int(os.getenv("SCHEDULER_MAX_LATENESS_SECONDS", 3600)))
+        self.batch_size = int(os.getenv("SCHEDULER_BATCH_SIZE", 1000))
+        self.heap = []
+        self.queued_ids = set()
+        self.loaded_until = None  # Todo lo pendiente con publish_at <= loaded_until está en el montículo.
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def notify(self, post_id, publish_at):
+        """Avisa de una publicación nueva; entra al montículo si cae dentro del horizonte ya cargado."""
+        with self.lock:
+            if self.loaded_until is not None and publish_at <= self.loaded_until and post_id not in self.queued_ids:
+                heapq.heappush(self.heap, (publish_at, post_id))
+                self.queued_ids.add(post_id)
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                now = datetime.utcnow()
+                if self.loaded_until is None or now + self.horizon / 2 >= self.loaded_until:
+                    self._refill(now)
+                for post_id, publish_at in self._pop_due(now):
+                    self._claim_and_dispatch(post_id, publish_at, now)
+            except Exception as e:
+                print(f"❌ Error en el programador de publicaciones: {e}")
+            self.wake.wait(self._seconds_until_next_event())
+            self.wake.clear()
+
+    def _refill(self, now):
+        """Carga las publicaciones pendientes hasta `now + horizonte` (consulta por rango indexada)."""
+        until = now + self.horizon
+        rows = db_manager.fetch_all(
+            """SELECT id, publish_at FROM scheduled_posts
+               WHERE status = 'pending' AND publish_at <= %s
+               ORDER BY publish_at LIMIT %s""",
+            (until, self.batch_size)
+        )
+        with self.lock:
+            for row in rows:
+                if row['id'] not in self.queued_ids:
+                    heapq.heappush(self.heap, (row['publish_at'], row['id']))
+                    self.queued_ids.add(row['id'])
+            # Si el lote vino lleno, solo se garantiza lo cargado hasta la última fila recibida.
+            self.loaded_until = rows[-1]['publish_at'] if len(rows) >= self.batch_size else until
+
+    def _pop_due(self, now):
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                publish_at, post_id = heapq.heappop(self.heap)
+                self.queued_ids.discard(post_id)
+                due.append((post_id, publish_at))
+        return due
+
+    def _claim_and_dispatch(self, post_id, publish_at, now):
+        expired = now - publish_at > self.max_lateness
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                """UPDATE scheduled_posts SET status = %s, claimed_by = %s, claimed_at = %s
+                   WHERE id = %s AND status = 'pending'""",
+                ('expired' if expired else 'processing', self.worker_id, now, post_id)
+            )
+            if cursor.rowcount != 1:
+                return  # Otro proceso la reclamó, o se borró.
+            if not expired:
+                cursor.execute("SELECT id, client_id FROM scheduled_posts WHERE id = %s", (post_id,))
+                self.dispatch(cursor.fetchone(), cursor)
+        if expired:
+            print(f"⚠️ Publicación programada {post_id} vencida hace más de {self.max_lateness}; marcada como 'expired'.")
+
+    def _seconds_until_next_event(self):
+        now = datetime.utcnow()
+        with self.lock:
+            next_due = self.heap[0][0] if self.heap else None
+            next_refill = self.loaded_until - self.horizon / 2 if self.loaded_until else now
+        next_event = min(next_due, next_refill) if next_due else next_refill
+        return min(max((next_event - now).total_seconds(), 0.5), 60)
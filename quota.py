@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import os
+import math
+import time
+import atexit
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from database import db_manager
+
+
+def current_period():
+    """Periodo de facturación actual ('YYYY-MM', en UTC)."""
+    return datetime.utcnow().strftime('%Y-%m')
+
+
+class QuotaManager:
+    """
+    Contabilidad de publicaciones por plan sobre `client_usage(client_id, period, used)`.
+    - Cada publicación se reserva ANTES de hacerse con un UPDATE condicional (`used + n <= límite`),
+      así que ni varias ejecuciones ni varios procesos a la vez pueden pasarse del plan.
+    - Para no ir a la BD en cada publicación, el proceso reserva bloques de `block_size` y los
+      reparte desde memoria; lo que no se gasta se devuelve al terminar la ejecución (release).
+    - Lo reservado y sin gastar queda anotado en `quota_leases` a nombre del proceso, con un
+      arrendamiento que renueva un hilo de latido. Si el proceso muere, al caducar el arrendamiento
+      otro proceso devuelve esas reservas a `client_usage` en lugar de dejarlas gastadas todo el mes.
+    - Las publicaciones fallidas se reembolsan al bloque local.
+    - Los planes sin límite (`float('inf')`) se contabilizan igual, pero sin condición de límite.
+    - Cada mes es una fila nueva: el cambio de periodo no necesita ningún reseteo de la tabla.
+    """
+    def __init__(self):
+        self.block_size = max(1, int(os.getenv("QUOTA_BLOCK_SIZE", 5)))
+        self.lease_seconds = int(os.getenv("QUOTA_LEASE_SECONDS", 300))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+        self.tokens = {}  # client_id -> (periodo, publicaciones reservadas en la BD y aún sin gastar)
+        self.spent = {}  # (client_id, periodo) -> gastadas del bloque local desde el último latido
+        self._heartbeat = None
+        atexit.register(self.release_all)
+
+    def reserve(self, client_id, limit):
+        """
+        Reserva una publicación del periodo actual. Devuelve True si cabe en el límite del plan.
+        """
+        period = current_period()
+        with self.lock:
+            held_period, held = self.tokens.get(client_id, (period, 0))
+            if held_period == period and held > 0:
+                self.tokens[client_id] = (period, held - 1)
+                self._add_spent(client_id, period, 1)
+                return True
+            if held_period != period:
+                # Cambio de mes: las reservas del periodo anterior se devuelven a su fila.
+                del self.tokens[client_id]
+        if held_period != period and held:
+            self._return_to_db(client_id, held_period, held)
+
+        granted = self._reserve_block(client_id, period, limit)
+        if not granted:
+            return False
+        with self.lock:
+            held_period, held = self.tokens.get(client_id, (period, 0))
+            self.tokens[client_id] = (period, (held if held_period == period else 0) + granted - 1)
+            self._add_spent(client_id, period, 1)
+        return True
+
+    def refund(self, client_id):
+        """Devuelve al bloque local una publicación reservada que no llegó a hacerse."""
+        period = current_period()
+        with self.lock:
+            held_period, held = self.tokens.get(client_id, (period, 0))
+            if held_period == period:
+                self.tokens[client_id] = (period, held + 1)
+                self._add_spent(client_id, period, -1)
+                return
+        # La reserva era del mes anterior: ya no sirve para nada.
+
+    def release(self, client_id):
+        """Devuelve a la BD las reservas sin gastar del cliente (llamar al terminar cada ejecución)."""
+        with self.lock:
+            period, held = self.tokens.pop(client_id, (None, 0))
+        if held:
+            self._return_to_db(client_id, period, held)
+
+    def release_all(self):
+        for client_id in list(self.tokens):
+            self.release(client_id)
+
+    def usage(self, client_id):
+        """Publicaciones gastadas este periodo (sin contar las reservadas y aún no usadas en este proceso)."""
+        period = current_period()
+        row = db_manager.fetch_one(
+            "SELECT used FROM client_usage WHERE client_id = %s AND period = %s", (client_id, period)
+        )
+        with self.lock:
+            held_period, held = self.tokens.get(client_id, (period, 0))
+        return max((row['used'] if row else 0) - (held if held_period == period else 0), 0)
+
+    def remaining(self, client_id, limit):
+        return max(limit - self.usage(client_id), 0)
+
+    # --- Internos ---
+
+    def _reserve_block(self, client_id, period, limit):
+        """Reserva en la BD hasta `block_size` publicaciones. Devuelve cuántas consiguió (0 si no quedan)."""
+        # Sin límite finito la condición se anula con NULL (un `inf` no es un valor SQL válido).
+        limit = int(limit) if limit is not None and math.isfinite(limit) else None
+        db_manager.execute_query(
+            "INSERT IGNORE INTO client_usage (client_id, period, used) VALUES (%s, %s, 0)",
+            (client_id, period), commit=True
+        )
+        self._reclaim_expired(client_id, period)
+        size = self.block_size
+        while size > 0:
+            with db_manager.transaction() as cursor:
+                cursor.execute(
+                    """UPDATE client_usage SET used = used + %s
+                       WHERE client_id = %s AND period = %s AND (%s IS NULL OR used + %s <= %s)""",
+                    (size, client_id, period, limit, size, limit)
+                )
+                if cursor.rowcount == 1:
+                    cursor.execute(
+                        """INSERT INTO quota_leases (client_id, period, owner, held, expires_at) VALUES (%s, %s, %s, %s, %s)
+                           ON DUPLICATE KEY UPDATE held = held + VALUES(held), expires_at = VALUES(expires_at)""",
+                        (client_id, period, self.owner, size, self._lease_until())
+                    )
+                    self._start_heartbeat()
+                    return size
+                if limit is None:
+                    return 0  # El cliente ya no existe.
+                # No cabe el bloque entero: se intenta con lo que queda (otro proceso puede adelantarse).
+                cursor.execute(
+                    "SELECT used FROM client_usage WHERE client_id = %s AND period = %s", (client_id, period)
+                )
+                row = cursor.fetchone()
+            size = min(size - 1, limit - (row['used'] if row else limit))
+        return 0
+
+    def _return_to_db(self, client_id, period, count):
+        try:
+            with db_manager.transaction() as cursor:
+                cursor.execute(
+                    "UPDATE client_usage SET used = GREATEST(used - %s, 0) WHERE client_id = %s AND period = %s",
+                    (count, client_id, period)
+                )
+                cursor.execute(
+                    "UPDATE quota_leases SET held = GREATEST(held - %s, 0) WHERE client_id = %s AND period = %s AND owner = %s",
+                    (count, client_id, period, self.owner)
+                )
+        except Exception as e:
+            print(f"⚠️ No se pudieron devolver {count} reservas de cuota del cliente {client_id}: {e}")
+
+    def _reclaim_expired(self, client_id, period):
+        """Devuelve a `client_usage` lo que tenían sin gastar los procesos cuyo arrendamiento caducó."""
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                """SELECT owner, held FROM quota_leases
+                   WHERE client_id = %s AND period = %s AND expires_at < %s FOR UPDATE""",
+                (client_id, period, datetime.utcnow())
+            )
+            expired = cursor.fetchall()
+            if not expired:
+                return
+            cursor.execute(
+                "UPDATE client_usage SET used = GREATEST(used - %s, 0) WHERE client_id = %s AND period = %s",
+                (sum(row['held'] for row in expired), client_id, period)
+            )
+            cursor.executemany(
+                "DELETE FROM quota_leases WHERE client_id = %s AND period = %s AND owner = %s",
+                [(client_id, period, row['owner']) for row in expired]
+            )
+        for row in expired:
+            print(f"♻️ Recuperadas {row['held']} reservas de cuota del cliente {client_id} abandonadas por {row['owner']}.")
+
+    def _add_spent(self, client_id, period, count):
+        """Anota (con self.lock tomado) lo gastado del bloque local, para descontarlo del arrendamiento."""
+        key = (client_id, period)
+        self.spent[key] = self.spent.get(key, 0) + count
+
+    def _lease_until(self):
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def _start_heartbeat(self):
+        with self.lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        """
+        Renueva los arrendamientos de este proceso y descuenta de ellos lo gastado desde el último
+        latido, de modo que `held` sea lo que se devolvería si el proceso muriese. Se escribe como
+        diferencia (`held - gastadas`), nunca como valor absoluto: así no pisa los bloques que
+        reserve() o release() anotan en el arrendamiento mientras tanto. Si otro proceso ya recuperó
+        un arrendamiento (este estuvo parado más de `lease_seconds`), las reservas locales se
+        descartan: ya se devolvieron.
+        """
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self.lock:
+                spent, self.spent = self.spent, {}
+                leases = set(spent) | {(client_id, period) for client_id, (period, _) in self.tokens.items()}
+            for client_id, period in leases:
+                count = spent.get((client_id, period), 0)
+                try:
+                    with db_manager.transaction() as cursor:
+                        cursor.execute(
+                            """UPDATE quota_leases SET held = GREATEST(held - %s, 0), expires_at = %s
+                               WHERE client_id = %s AND period = %s AND owner = %s""",
+                            (count, self._lease_until(), client_id, period, self.owner)
+                        )
+                        lost = cursor.rowcount == 0
+                    if lost:
+                        with self.lock:
+                            if self.tokens.get(client_id, (None, 0))[0] == period:
+                                del self.tokens[client_id]
+                except Exception as e:
+                    with self.lock:
+                        self._add_spent(client_id, period, count)  # Se descontará en el próximo latido
+                    print(f"⚠️ Error renovando el arrendamiento de cuota del cliente {client_id}: {e}")
+
+
+# Instancia global
+quota_manager = QuotaManager()
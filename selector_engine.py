@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from collections import Counter
+
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+
+# Evalúa los XPath en orden dentro del navegador y devuelve [índice, elemento] del primero que
+# tenga un elemento visible (y no deshabilitado si se pide clicable): un solo viaje a chromedriver
+# por sondeo, tenga el paso los selectores que tenga.
+_FIND_FIRST_SCRIPT = """
+const [selectors, clickable] = arguments;
+for (let i = 0; i < selectors.length; i++) {
+    const found = document.evaluate(selectors[i], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (let j = 0; j < found.snapshotLength; j++) {
+        const element = found.snapshotItem(j);
+        // Visible en ambos modos (como visibility_of_element_located); con clickable, además habilitado.
+        if (!element.getClientRects().length) continue;
+        if (!clickable || (!element.disabled && element.getAttribute('aria-disabled') !== 'true')) return [i, element];
+    }
+}
+return null;
+"""
+
+
+class SelectorEngine:
+    """
+    Localiza elementos de páginas cuyo marcado cambia según idioma y versión del diseño.
+    - Todos los selectores de un paso se sondean juntos en una única espera, en lugar de una
+      espera completa por selector.
+    - Recuerda qué selector funcionó la última vez para cada (paso, idioma de la página) y lo
+      prueba primero.
+    - Ofrece esperas por condición para sustituir las pausas fijas.
+    """
+    def __init__(self):
+        self.timeout = float(os.getenv("SELECTOR_TIMEOUT_SECONDS", 10))
+        self.poll_interval = float(os.getenv("SELECTOR_POLL_SECONDS", 0.25))
+        self.preferred = {}  # (paso, idioma) -> selector que funcionó la última vez
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+    def find(self, driver, step, selectors, clickable=True, timeout=None):
+        """
+        Espera a que alguno de `selectors` (XPath) encuentre un elemento visible y lo devuelve.
+        Con `clickable` (por defecto) además tiene que estar habilitado.
+        Lanza TimeoutException si ninguno aparece en `timeout` segundos.
+        """
+        key = (step, self._layout(driver))
+        with self.lock:
+            preferred = self.preferred.get(key)
+        ordered = [preferred] + [selector for selector in selectors if selector != preferred] if preferred in selectors else list(selectors)
+
+        try:
+            index, element = self._wait(driver, timeout).until(
+                lambda d: d.execute_script(_FIND_FIRST_SCRIPT, ordered, clickable),
+                f"Ningún selector encontró '{step}'."
+            )
+        except TimeoutException:
+            with self.lock:
+                self.counters[f"{step}:timeout"] += 1
+            raise
+        with self.lock:
+            self.preferred[key] = ordered[index]
+            self.counters[f"{step}:{'preferred' if index == 0 and preferred else 'fallback'}"] += 1
+        return element
+
+    def wait_page_ready(self, driver, timeout=None):
+        """
+        Espera a que el documento termine de cargar (sustituye a las pausas tras driver.get).
+        Devuelve False si no terminó a tiempo; el siguiente find() sigue esperando a su elemento.
+        """
+        try:
+            self._wait(driver, timeout).until(lambda d: d.execute_script("return document.readyState") == 'complete')
+            return True
+        except TimeoutException:
+            return False
+
+    def wait_focused_textbox(self, driver, timeout=None):
+        """Espera a que el foco esté en un cuadro de texto editable y lo devuelve."""
+        return self._wait(driver, timeout).until(lambda d: d.execute_script(
+            "const e = document.activeElement;"
+            "return e && (e.isContentEditable || e.getAttribute('role') === 'textbox' || e.tagName === 'TEXTAREA') ? e : null;"
+        ))
+
+    def wait_absent(self, driver, selectors, timeout=None):
+        """Espera a que ninguno de `selectors` tenga elementos. Devuelve False si sigue habiéndolos."""
+        try:
+            self._wait(driver, timeout).until(lambda d: d.execute_script(_FIND_FIRST_SCRIPT, list(selectors), False) is None)
+            return True
+        except TimeoutException:
+            return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "preferred": {f"{step}@{layout}": selector for (step, layout), selector in self.preferred.items()},
+            }
+
+    # --- Internos ---
+
+    def _wait(self, driver, timeout):
+        return WebDriverWait(
+            driver, self.timeout if timeout is None else timeout,
+            poll_frequency=self.poll_interval, ignored_exceptions=(StaleElementReferenceException,)
+        )
+
+    def _layout(self, driver):
+        try:
+            return driver.execute_script("return document.documentElement.lang") or 'default'
+        except Exception:
+            return 'default'
+
+
+# Instancia global
+selector_engine = SelectorEngine()
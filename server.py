@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Arranque de producción del servidor web con E/S cooperativa (eventlet o gevent):
+
+    SERVER_MODE=eventlet python server.py      (o SERVER_MODE=gevent)
+
+Cada WebSocket o petición lenta ocupa una green thread en lugar de un hilo del sistema, así que
+miles de paneles conectados sin actividad no agotan los hilos del proceso.
+- La biblioteca estándar se parchea antes de importar nada más; por eso este arranque está aparte
+  de main.py, que sigue sirviendo para el modo 'threading' y para los workers.
+- Solo se admite APP_ROLE=web: los workers de navegador (Selenium, pool de miniaturas por fork)
+  corren en su propio proceso con `APP_ROLE=worker python main.py`, y los eventos se reparten entre
+  procesos con SOCKETIO_MESSAGE_QUEUE.
+- El conector de MariaDB se usa en su versión pura (DB_USE_PURE) para que ceda el bucle de eventos;
+  el pool de conexiones espera con los primitivos ya parcheados.
+- Las miniaturas, que son CPU, se generan en el pool de hilos reales del bucle de eventos.
+- El servidor se arranca aquí y no con socketio.run, que deja los valores de eventlet: cola de
+  aceptación de 50 (con ráfagas de reconexiones los SYN se pierden y el cliente reintenta al cabo de
+  1, 3, 7... s) y como mucho 1024 conexiones a la vez. SERVER_BACKLOG y SERVER_MAX_CONNECTIONS.
+Para medirlo: bench_sockets.py.
+"""
+import os
+
+SERVER_MODE = os.getenv("SERVER_MODE", "eventlet").lower()
+if SERVER_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SERVER_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+else:
+    raise SystemExit(f"❌ SERVER_MODE '{SERVER_MODE}' no válido para server.py: usa 'eventlet' o 'gevent'.")
+
+from dotenv import load_dotenv  # noqa: E402  (después del parcheo)
+load_dotenv()
+
+os.environ["SERVER_MODE"] = SERVER_MODE
+os.environ.setdefault("APP_ROLE", "web")
+os.environ.setdefault("DB_USE_PURE", "1")
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 5001))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048))
+SERVER_MAX_CONNECTIONS = int(os.getenv("SERVER_MAX_CONNECTIONS", 10000))
+if os.environ["APP_ROLE"] != 'web':
+    raise SystemExit("❌ server.py solo ejecuta el rol web (APP_ROLE=web); los workers van con `APP_ROLE=worker python main.py`.")
+
+import main  # noqa: E402
+
+if SERVER_MODE == 'eventlet':
+    from eventlet import tpool
+    main.thumbnail_pool.offload = tpool.execute
+else:
+    import gevent
+    main.thumbnail_pool.offload = lambda fn, *args: gevent.get_hub().threadpool.apply(fn, args)
+main.thumbnail_pool.workers = 0
+
+
+def run_web():
+    """Sirve la app con la cola de aceptación y el máximo de conexiones configurados (sin log por petición)."""
+    if SERVER_MODE == 'eventlet':
+        import eventlet.wsgi
+        listener = eventlet.listen((HOST, PORT), backlog=SERVER_BACKLOG)
+        eventlet.wsgi.server(listener, main.app, max_size=SERVER_MAX_CONNECTIONS, log_output=False)
+    else:
+        from gevent.pool import Pool
+        main.socketio.run(main.app, host=HOST, port=PORT, log_output=False,
+                          backlog=SERVER_BACKLOG, spawn=Pool(SERVER_MAX_CONNECTIONS))
+
+
+if __name__ == "__main__":
+    main.serve(run_web)
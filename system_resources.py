@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Lecturas baratas de recursos del sistema (RAM libre, CPU, carga).
+Se leen directamente de /proc en Linux para no añadir dependencias; en otros
+sistemas devuelven None y quien las usa aplica sus valores por defecto.
+"""
+import os
+
+
+def available_memory_mb():
+    """Memoria disponible (MemAvailable) en MB, o None si no se puede medir."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def cpu_count():
+    """Número de CPUs que este proceso puede usar."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def load_average():
+    """Carga media del último minuto, o None si el sistema no la expone."""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def process_tree_rss_mb(pid):
+    """
+    Memoria residente (RSS) en MB de un proceso y todos sus descendientes, p. ej. chromedriver
+    y los procesos de Chrome que lanza. Devuelve None si no se puede medir.
+    """
+    children = {}
+    rss_kb = {}
+    try:
+        page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    # El nombre del proceso va entre paréntesis y puede contener espacios.
+                    fields = stat.read().rsplit(')', 1)[1].split()
+                with open(f'/proc/{entry}/statm') as statm:
+                    resident_pages = int(statm.read().split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(int(fields[1]), []).append(int(entry))
+            rss_kb[int(entry)] = resident_pages * page_kb
+    except (OSError, ValueError, AttributeError):
+        return None
+    if pid not in rss_kb:
+        return None
+
+    total_kb, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total_kb += rss_kb.get(current, 0)
+        pending.extend(children.get(current, []))
+    return total_kb // 1024
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+from database import db_manager
+
+
+def content_hash(text):
+    """
+    Hash del contenido normalizado (Unicode NFKC, minúsculas, espacios colapsados), de modo que
+    textos que solo difieren en mayúsculas o espaciado comparten entrada.
+    """
+    normalized = " ".join(unicodedata.normalize('NFKC', text or '').lower().split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class TagCache:
+    """
+    Caché persistente de etiquetas generadas por IA, en la tabla `ai_tag_cache`.
+    - Delante de la tabla hay un LRU en memoria para no ir a la BD con los textos recientes.
+    - La tabla se recorta a `max_rows` borrando las entradas usadas hace más tiempo. Los aciertos no
+      escriben en la BD: se anotan en memoria y se vuelcan juntos (`hits`, `last_used_at`) cada
+      `touch_batch` entradas distintas y antes de cada recorte.
+    - Cuenta aciertos y fallos para poder medir el ahorro de llamadas a OpenAI.
+    """
+    def __init__(self):
+        self.memory_items = int(os.getenv("TAG_CACHE_MEMORY_ITEMS", 2000))
+        self.max_rows = int(os.getenv("TAG_CACHE_MAX_ROWS", 100000))
+        self.evict_every = int(os.getenv("TAG_CACHE_EVICT_EVERY", 100))
+        self.touch_batch = max(1, int(os.getenv("TAG_CACHE_TOUCH_BATCH", 100)))
+        self.lru = OrderedDict()  # content_hash -> lista de etiquetas
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._touched = {}  # content_hash -> aciertos aún no volcados a la tabla
+
+    def get(self, text):
+        """Devuelve las etiquetas guardadas para el texto, o None si no están en la caché."""
+        key = content_hash(text)
+        with self.lock:
+            tags = self.lru.get(key)
+            if tags is not None:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                flush = self._touch(key)
+        if tags is not None:
+            if flush:
+                self._flush_touched()
+            return list(tags)
+        try:
+            row = db_manager.fetch_one("SELECT tags FROM ai_tag_cache WHERE content_hash = %s", (key,))
+        except Exception as e:
+            print(f"⚠️ Error leyendo la caché de etiquetas: {e}")
+            row = None
+        with self.lock:
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            tags = [tag for tag in row['tags'].split(',') if tag]
+            self._remember(key, tags)
+            flush = self._touch(key)
+        if flush:
+            self._flush_touched()
+        return list(tags)
+
+    def put(self, text, tags):
+        """Guarda las etiquetas de un texto. Las respuestas vacías no se cachean (suelen ser errores)."""
+        if not tags:
+            return
+        key = content_hash(text)
+        with self.lock:
+            self._remember(key, list(tags))
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        try:
+            db_manager.execute_query(
+                """INSERT INTO ai_tag_cache (content_hash, tags, last_used_at) VALUES (%s, %s, %s)
+                   ON DUPLICATE KEY UPDATE tags = VALUES(tags), last_used_at = VALUES(last_used_at)""",
+                (key, ",".join(tags), datetime.utcnow()), commit=True
+            )
+            if evict:
+                self._evict()
+        except Exception as e:
+            print(f"⚠️ Error guardando en la caché de etiquetas: {e}")
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "memory_items": len(self.lru),
+            }
+
+    # --- Internos ---
+
+    def _remember(self, key, tags):
+        """Inserta en el LRU en memoria. Llamar con el lock tomado."""
+        self.lru[key] = tags
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.memory_items:
+            self.lru.popitem(last=False)
+
+    def _touch(self, key):
+        """Anota un acierto para volcarlo después. Llamar con el lock tomado; devuelve True si toca volcar."""
+        self._touched[key] = self._touched.get(key, 0) + 1
+        return len(self._touched) >= self.touch_batch
+
+    def _flush_touched(self):
+        """Vuelca en una sola escritura los aciertos anotados (contador y última vez usada)."""
+        with self.lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        now = datetime.utcnow()
+        try:
+            db_manager.execute_many(
+                "UPDATE ai_tag_cache SET hits = hits + %s, last_used_at = %s WHERE content_hash = %s",
+                [(count, now, key) for key, count in touched.items()]
+            )
+        except Exception as e:
+            print(f"⚠️ Error actualizando el uso de la caché de etiquetas: {e}")
+
+    def _evict(self):
+        """Borra de la tabla las entradas menos usadas recientemente que exceden `max_rows`."""
+        self._flush_touched()  # Que el recorte vea la última vez que se usó cada entrada
+        row = db_manager.fetch_one("SELECT COUNT(*) AS total FROM ai_tag_cache")
+        excess = (row['total'] if row else 0) - self.max_rows
+        if excess > 0:
+            db_manager.execute_query("DELETE FROM ai_tag_cache ORDER BY last_used_at LIMIT %s", (excess,), commit=True)
+
+
+# Instancia global
+tag_cache = TagCache()
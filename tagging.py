@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import socket
+import threading
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+
+from database import db_manager, normalize_tags
+
+
+class TaggingPipeline:
+    """
+    Etiqueta textos con IA en segundo plano para que las peticiones HTTP no esperen a OpenAI.
+    - Los textos se guardan al momento con `tag_status = 'pending'` y se encolan aquí.
+    - Un hilo agrupa lo encolado en lotes (varios textos por prompt) y los envía a un pool de
+      hilos acotado, así que nunca hay más de `max_concurrency` llamadas a la API a la vez.
+    - Antes de llamar a la API cada texto se reclama ('pending' -> 'tagging', con el proceso y la
+      hora): si varios procesos lo tienen encolado, solo uno lo etiqueta.
+    - Al terminar cada texto se guardan sus etiquetas y se avisa con `notify(client_id, text)`. Un
+      texto que falla no arrastra al resto de su lote.
+    - Al arrancar, y después cada `claim_timeout` segundos, se reencolan los textos pendientes que
+      nadie ha tomado y los reclamados por un proceso que no terminó a tiempo (p. ej. se cayó).
+    """
+    def __init__(self, tagger, notify=None):
+        """
+        Args:
+            tagger: Servicio con generate_tags_for_texts(textos) y generate_tags_for_text(texto).
+            notify (callable): Recibe (client_id, fila del texto actualizada).
+        """
+        self.tagger = tagger
+        self.notify = notify
+        self.batch_size = int(os.getenv("TAGGING_BATCH_SIZE", 10))
+        self.batch_wait_seconds = float(os.getenv("TAGGING_BATCH_WAIT_SECONDS", 0.5))
+        self.max_concurrency = int(os.getenv("TAGGING_MAX_CONCURRENCY", 4))
+        self.claim_timeout = int(os.getenv("TAGGING_CLAIM_TIMEOUT_SECONDS", 600))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.queue = Queue()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="tagging")
+        # Limita también los lotes encolados en el executor, para que los textos esperen en self.queue.
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            threading.Thread(target=self._recover_loop, daemon=True).start()
+
+    def submit(self, client_id, text_id, content):
+        """Encola un texto ya guardado con tag_status = 'pending'."""
+        self.queue.put((client_id, text_id, content))
+
+    def recover_pending(self, min_age=0):
+        """
+        Vuelve a encolar los textos sin etiquetar: los 'pending' de hace más de `min_age` segundos
+        (los recientes ya están en la cola de quien los creó) y los 'tagging' cuyo reclamo caducó.
+        """
+        rows = db_manager.fetch_all(
+            """SELECT id, client_id, content FROM texts
+               WHERE (tag_status = 'pending' AND updated_at < NOW() - INTERVAL %s SECOND)
+                  OR (tag_status = 'tagging' AND tagging_started_at < NOW() - INTERVAL %s SECOND)
+               ORDER BY id""",
+            (min_age, self.claim_timeout)
+        )
+        for row in rows:
+            self.submit(row['client_id'], row['id'], row['content'])
+        if rows:
+            print(f"🏷️ {len(rows)} textos pendientes de etiquetar reencolados.")
+
+    def _recover_loop(self):
+        min_age = 0  # Al arrancar se reencola todo lo pendiente.
+        while True:
+            try:
+                self.recover_pending(min_age)
+            except Exception as e:
+                print(f"⚠️ Error recuperando textos pendientes de etiquetar: {e}")
+            min_age = self.claim_timeout
+            time.sleep(self.claim_timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_wait_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except Empty:
+                    break
+            self.slots.acquire()
+            self.executor.submit(self._process_batch, batch)
+
+    def _process_batch(self, batch):
+        try:
+            batch = self._claim(batch)
+            results = None
+            if len(batch) > 1:
+                try:
+                    results = self.tagger.generate_tags_for_texts([content for _, _, content in batch])
+                except Exception as e:
+                    print(f"⚠️ Error etiquetando un lote de {len(batch)} textos; se etiquetan uno a uno: {e}")
+            for index, (client_id, text_id, content) in enumerate(batch):
+                try:
+                    if results is None:
+                        tags = self.tagger.generate_tags_for_text(content)
+                    elif results[index] is None:
+                        # El lote ya consultó la caché para este texto: no se vuelve a contar el fallo.
+                        tags = self.tagger.generate_tags_for_text(content, check_cache=False)
+                    else:
+                        tags = results[index]
+                    self._save(client_id, text_id, content, tags)
+                except Exception as e:
+                    print(f"❌ Error etiquetando el texto {text_id}: {e}")
+        except Exception as e:
+            print(f"❌ Error en el pipeline de etiquetado: {e}")
+        finally:
+            self.slots.release()
+
+    def _claim(self, batch):
+        """Reclama los textos del lote para este proceso. Devuelve los que consiguió."""
+        claimed = []
+        with db_manager.transaction() as cursor:
+            for item in batch:
+                cursor.execute(
+                    """UPDATE texts SET tag_status = 'tagging', tagging_owner = %s, tagging_started_at = NOW()
+                       WHERE id = %s AND content = %s
+                         AND (tag_status = 'pending'
+                              OR (tag_status = 'tagging' AND tagging_started_at < NOW() - INTERVAL %s SECOND))""",
+                    (self.owner, item[1], item[2], self.claim_timeout)
+                )
+                if cursor.rowcount == 1:
+                    claimed.append(item)
+        return claimed
+
+    def _save(self, client_id, text_id, content, tags):
+        tags = normalize_tags(tags)
+        # La condición sobre `content` descarta el resultado si el texto se editó mientras tanto
+        # (la edición ya encoló un nuevo etiquetado), y la del reclamo, si otro proceso lo retomó.
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                """UPDATE texts SET ai_tags = %s, tag_status = %s
+                   WHERE id = %s AND content = %s AND tag_status = 'tagging' AND tagging_owner = %s""",
+                (",".join(tags), 'done' if tags else 'failed', text_id, content, self.owner)
+            )
+            updated = cursor.rowcount == 1
+        if not updated:
+            return
+        db_manager.sync_tags(client_id, 'texts', text_id, tags)
+        if self.notify:
+            text = db_manager.fetch_one("SELECT * FROM texts WHERE id = %s", (text_id,))
+            if text:
+                self.notify(client_id, text)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import random
+
+
+def _delay_range(name, default):
+    """Lee un rango 'min,max' en segundos de una variable de entorno."""
+    low, _, high = os.getenv(name, default).partition(',')
+    low = float(low)
+    return low, float(high or low)
+
+
+class TextInjector:
+    """
+    Escribe el contenido de una publicación en el cuadro de texto que tiene el foco.
+    Cada send_keys es una petición HTTP a chromedriver, así que el modo decide cuántas se hacen:
+    - 'human': carácter a carácter con pausas aleatorias (el comportamiento original, el más lento).
+    - 'burst': trozos de `burst_size` caracteres con una pausa entre trozos.
+    - 'insert': todo el texto de una vez con Input.insertText del protocolo DevTools (como un
+      pegado); si el navegador no lo admite se usa 'burst'.
+    ChromeDriver no puede teclear caracteres fuera del BMP (muchos emojis): en 'human' y 'burst'
+    esos caracteres se insertan con Input.insertText.
+    """
+    MODES = ('human', 'burst', 'insert')
+
+    def __init__(self):
+        self.mode = os.getenv("POST_INPUT_MODE", "human").lower()
+        if self.mode not in self.MODES:
+            print(f"⚠️ POST_INPUT_MODE '{self.mode}' no válido; se usa 'human'.")
+            self.mode = 'human'
+        self.char_delay = _delay_range("POST_INPUT_CHAR_DELAY", "0.05,0.1")
+        self.burst_size = max(1, int(os.getenv("POST_INPUT_BURST_SIZE", 40)))
+        self.burst_pause = _delay_range("POST_INPUT_BURST_PAUSE", "0.2,0.6")
+
+    def type_text(self, driver, element, text, mode=None):
+        """
+        Escribe `text` en `element` (normalmente driver.switch_to.active_element).
+        Returns:
+            str: El modo que se usó realmente.
+        """
+        mode = mode or self.mode
+        if mode == 'insert':
+            if self._insert_text(driver, text):
+                return 'insert'
+            mode = 'burst'
+        if mode == 'burst':
+            for start in range(0, len(text), self.burst_size):
+                self._send(driver, element, text[start:start + self.burst_size])
+                time.sleep(random.uniform(*self.burst_pause))
+            return 'burst'
+        for char in text:
+            self._send(driver, element, char)
+            time.sleep(random.uniform(*self.char_delay))
+        return 'human'
+
+    # --- Internos ---
+
+    def _send(self, driver, element, chunk):
+        """send_keys de un trozo, pasando por Input.insertText los caracteres fuera del BMP."""
+        pending = ''
+        for char in chunk:
+            if ord(char) <= 0xFFFF:
+                pending += char
+                continue
+            if pending:
+                element.send_keys(pending)
+                pending = ''
+            if not self._insert_text(driver, char):
+                raise RuntimeError(f"No se puede escribir el carácter {char!r} en este navegador.")
+        if pending:
+            element.send_keys(pending)
+
+    def _insert_text(self, driver, text):
+        execute_cdp_cmd = getattr(driver, 'execute_cdp_cmd', None)
+        if execute_cdp_cmd is None:
+            return False
+        try:
+            execute_cdp_cmd('Input.insertText', {'text': text})
+            return True
+        except Exception as e:
+            print(f"⚠️ Input.insertText no disponible: {e}")
+            return False
+
+
+# Instancia global
+text_injector = TextInjector()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Acceso a los archivos subidos por los clientes (/uploads/client_<id>/...): URLs firmadas y ETags.
+"""
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+HASH_NAME_LENGTH = 32  # Los nombres de image_pipeline.promote_upload son el hash del contenido truncado.
+
+
+class UploadSigner:
+    """
+    Firma el acceso a los archivos de un cliente con un HMAC de (client_id, caducidad).
+    - La firma vale para todo el directorio del cliente: el panel la obtiene una vez con su JWT y
+      la añade a cada URL, ya que una etiqueta <img> no puede mandar la cabecera Authorization.
+    - La caducidad se redondea a ventanas de `ttl` segundos, así que durante una ventana todas las
+      URLs son idénticas y la caché del navegador sirve; una firma recién emitida siempre dura al
+      menos `ttl` segundos.
+    """
+    def __init__(self, secret):
+        self.secret = secret.encode('utf-8')
+        self.ttl = max(60, int(os.getenv("UPLOAD_URL_TTL_SECONDS", 3600)))
+
+    def sign(self, client_id, now=None):
+        """
+        Returns:
+            dict: `query` (para añadir a la URL), `expires` y `refresh_at` (cuándo pedir la siguiente;
+            la firma anterior sigue valiendo hasta `expires`).
+        """
+        window = int((now if now is not None else time.time()) // self.ttl)
+        expires = (window + 2) * self.ttl
+        return {
+            "query": f"exp={expires}&sig={self._signature(client_id, expires)}",
+            "expires": expires,
+            "refresh_at": expires - self.ttl,
+        }
+
+    def verify(self, client_id, expires, signature):
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(client_id, expires), signature or '')
+
+    def _signature(self, client_id, expires):
+        return hmac.new(self.secret, f"{client_id}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+class FileETags:
+    """
+    ETag fuerte de cada archivo subido, derivado de su contenido.
+    - Si el nombre ya es el hash del contenido (subidas nuevas y sus miniaturas) se usa tal cual.
+    - Si no (archivos antiguos), se calcula el SHA-256 una vez y se memoriza por (ruta, mtime, tamaño).
+    """
+    def __init__(self):
+        self.max_items = int(os.getenv("UPLOAD_ETAG_CACHE_ITEMS", 4096))
+        self.cache = OrderedDict()  # (ruta, mtime_ns, tamaño) -> etag
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if len(stem) == HASH_NAME_LENGTH and all(char in '0123456789abcdef' for char in stem):
+            return stem
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            etag = self.cache.get(key)
+            if etag is not None:
+                self.cache.move_to_end(key)
+                return etag
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+        etag = digest.hexdigest()[:HASH_NAME_LENGTH]
+        with self.lock:
+            self.cache[key] = etag
+            while len(self.cache) > self.max_items:
+                self.cache.popitem(last=False)
+        return etag
+
+
+# Instancia global
+upload_etags = FileETags()